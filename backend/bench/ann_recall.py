@@ -0,0 +1,88 @@
+"""Recall versus latency of the item bank IVF index against exact search.
+
+Uses a synthetic clustered item bank by default, or a real index with
+--index. Queries exclude a random asked set and optionally filter by
+instrument, like a session drawing from the bank.
+
+    python -m bench.ann_recall --items 50000 --queries 500
+    python -m bench.ann_recall --index bundles/item_bank
+"""
+import argparse
+import time
+
+import numpy as np
+
+from utils.ann_index import IVFIndex
+
+
+def synthetic_bank(items, dim, instruments, seed):
+    rng = np.random.default_rng(seed)
+    topics = rng.normal(size=(max(8, items // 200), dim)).astype(np.float32)
+    vectors = topics[rng.integers(len(topics), size=items)] + 0.6 * rng.normal(size=(items, dim)).astype(np.float32)
+    names = [f"instrument_{i % instruments}" for i in range(items)]
+    types = (rng.random(items) < 0.2).astype(int).tolist()
+    return vectors, names, types
+
+
+def percentile(values, pct):
+    return float(np.percentile(values, pct)) if values else 0.0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index", default=None, help="Saved index directory instead of a synthetic bank")
+    parser.add_argument("--items", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--instruments", type=int, default=40)
+    parser.add_argument("--lists", type=int, default=None)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--asked", type=int, default=30, help="Items excluded per query")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--filter-instruments", type=int, default=0, help="Restrict each query to this many instruments")
+    parser.add_argument("--probes", default="1,2,4,8,16,32,64")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed + 1)
+    if args.index:
+        index = IVFIndex.load(args.index)
+    else:
+        vectors, names, types = synthetic_bank(args.items, args.dim, args.instruments, args.seed)
+        t0 = time.perf_counter()
+        index = IVFIndex.build(vectors, names, types, n_lists=args.lists, seed=args.seed)
+        print(f"built {len(index.ids)} items into {index.n_lists} lists in {time.perf_counter() - t0:.1f}s")
+
+    n = len(index.ids)
+    queries = []
+    for _ in range(args.queries):
+        # Queries near real items, as answers are near the questions they respond to
+        base = np.asarray(index.vectors[rng.integers(n)])
+        query = base + 0.5 * rng.normal(size=base.shape).astype(np.float32)
+        asked = set(rng.integers(n, size=args.asked).tolist())
+        instruments = None
+        if args.filter_instruments:
+            instruments = rng.choice(index.instrument_names, size=min(args.filter_instruments, len(index.instrument_names)), replace=False).tolist()
+        queries.append((query, asked, instruments))
+
+    exact, exact_ms = [], []
+    for query, asked, instruments in queries:
+        t0 = time.perf_counter()
+        exact.append([i for i, _ in index.exact_search(query, args.k, asked, instruments)])
+        exact_ms.append((time.perf_counter() - t0) * 1000)
+    print(f"{'n_probe':>8}{'recall@1':>10}{'recall@k':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    print(f"{'exact':>8}{1.0:>10.3f}{1.0:>10.3f}{percentile(exact_ms, 50):>10.3f}{percentile(exact_ms, 99):>10.3f}")
+
+    for n_probe in [int(p) for p in args.probes.split(",") if int(p) <= index.n_lists]:
+        hits1, hitsk, latencies = 0, 0, []
+        for (query, asked, instruments), truth in zip(queries, exact):
+            t0 = time.perf_counter()
+            found = [i for i, _ in index.search(query, args.k, n_probe, asked, instruments)]
+            latencies.append((time.perf_counter() - t0) * 1000)
+            hits1 += bool(found and truth and found[0] == truth[0])
+            hitsk += len(set(found) & set(truth)) / max(1, len(truth))
+        print(f"{n_probe:>8}{hits1 / len(queries):>10.3f}{hitsk / len(queries):>10.3f}"
+              f"{percentile(latencies, 50):>10.3f}{percentile(latencies, 99):>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
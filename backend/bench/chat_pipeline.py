@@ -0,0 +1,315 @@
+"""Load test for the screening pipeline: /questionnaire/start -> /chat/stream -> /questionnaire/end.
+
+Boots the FastAPI app in-process with the deterministic fake models
+(FAKE_MODELS) and an in-memory Mongo (mongomock-motor), or a local mongod
+with --mongo-uri, then drives N concurrent screening sessions over HTTP.
+
+Run from the backend directory:
+
+    python -m bench.chat_pipeline --sessions 50 --turns 8
+    python -m bench.chat_pipeline --sessions 50 --compare bench/results/<previous>.json
+
+Extra dependencies: httpx, uvicorn, mongomock-motor. mongomock does not
+support the bulk_write arguments of pymongo 4.10+, so pin pymongo 4.9.x
+when using the in-memory stand-in.
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+os.environ.setdefault("FAKE_MODELS", "1")
+# Keep the server's request log with the other (ignored) bench output
+os.environ.setdefault("ACCESS_LOG", os.path.join(os.path.dirname(__file__), "results", "access.log"))
+
+import httpx
+import uvicorn
+from utils.fake_llm import FakeEncoder, SYNTHETIC_ANSWERS, synthetic_questionnaire
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+QUESTIONNAIRE = "Bench Questionnaire"
+
+# Server-side stage timings, filled by the wrappers installed in instrument()
+stage_timings = defaultdict(list)
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[k]
+
+
+def summarize(values):
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values),
+        "p50": percentile(values, 50),
+        "p90": percentile(values, 90),
+        "p99": percentile(values, 99),
+        "max": max(values),
+    }
+
+
+def timed(stage, fn):
+    async def wrapper(*args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            stage_timings[stage].append(time.perf_counter() - t0)
+    return wrapper
+
+
+def timed_sync(stage, fn):
+    def wrapper(*args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            stage_timings[stage].append(time.perf_counter() - t0)
+    return wrapper
+
+
+def instrument(args):
+    """Wrap the pipeline stages used by the chat router with timers"""
+    from database import chatbot, sessions
+    from routers import chat
+
+    if not args.real_embeddings:
+        chatbot.model = FakeEncoder()
+    chat.context_embedding = timed("embedding", chat.context_embedding)
+    chat.sim_search = timed_sync("sim_search", chat.sim_search)
+    chat.get_chat = timed("mongo_get_chat", chat.get_chat)
+    chat.store_chat_response = timed("mongo_store_chat_response", chat.store_chat_response)
+    sessions.get_questionair = timed("mongo_get_questionair", sessions.get_questionair)
+
+
+def build_app(args):
+    import main
+    from database.write_buffer import start_write_buffer, stop_write_buffer
+    from utils.utils import MODELS
+
+    if args.model not in MODELS:
+        raise SystemExit(f"Unknown model '{args.model}'. Available: {list(MODELS.keys())}")
+    for model in MODELS.values():
+        if hasattr(model, "ttft"):
+            model.ttft = args.ttft
+            model.token_delay = args.token_delay
+            model.tokens = args.tokens
+
+    async def bench_startup():
+        if args.mongo_uri:
+            from motor.motor_asyncio import AsyncIOMotorClient
+            client = AsyncIOMotorClient(args.mongo_uri)
+        else:
+            from mongomock_motor import AsyncMongoMockClient
+            client = AsyncMongoMockClient()
+        ques_db = client["bench_questionaires"]
+        await ques_db["chats"].delete_many({})
+        await ques_db["questionaires"].delete_many({})
+        await ques_db["questionaires"].insert_one(synthetic_questionnaire(QUESTIONNAIRE, args.questions))
+        main.attach_databases(ques_db, client["bench_users_db"], client["bench_children_db"])
+        start_write_buffer(ques_db)
+
+    # Replace the Atlas startup with the local stand-in
+    main.app.router.on_startup = [bench_startup]
+    main.app.router.on_shutdown = [stop_write_buffer]
+    instrument(args)
+    return main.app
+
+
+def start_server(app, port):
+    config = uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", access_log=False)
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread
+
+
+async def stream_turn(client, session_id, text, args, results):
+    t0 = time.perf_counter()
+    ttft = None
+    done = None
+    async with client.stream("POST", "/api/chat/stream", json={
+        "session_id": session_id, "question": text, "model": args.model, "age": 12,
+    }) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            data = json.loads(line[6:])
+            if ttft is None and data.get("chunk"):
+                ttft = time.perf_counter() - t0
+            if data.get("error"):
+                results["errors"] += 1
+            if data.get("complete"):
+                done = data
+    results["stream_total"].append(time.perf_counter() - t0)
+    results["turns"] += 1
+    if ttft is not None:
+        results["ttft"].append(ttft)
+    return done or {}
+
+
+async def run_session(client, idx, args, results):
+    session_id = f"bench_{idx}_{int(time.time() * 1000)}"
+    t0 = time.perf_counter()
+    response = await client.post("/api/questionnaire/start", json={
+        "session_id": session_id,
+        "student_name": f"Student {idx}",
+        "student_dob": "2013-05-01",
+        "student_gender": "F",
+        "parent_name": f"Parent {idx}",
+        "parent_mobile": f"90000{idx:05d}",
+        "school": f"School {idx % 5}",
+        "questionnaire_name": QUESTIONNAIRE,
+        "tnc_accepted": True,
+    })
+    response.raise_for_status()
+    results["start"].append(time.perf_counter() - t0)
+
+    done = await stream_turn(client, session_id, "/start", args, results)
+    for turn in range(args.turns):
+        if done.get("status"):
+            break
+        done = await stream_turn(client, session_id, SYNTHETIC_ANSWERS[(idx + turn) % len(SYNTHETIC_ANSWERS)], args, results)
+
+    t0 = time.perf_counter()
+    response = await client.post("/api/questionnaire/end", json={"session_id": session_id, "feedback": "bench"})
+    response.raise_for_status()
+    results["end"].append(time.perf_counter() - t0)
+
+
+async def drive(args, base_url):
+    results = defaultdict(list)
+    results["errors"] = 0
+    results["turns"] = 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        async def one(idx):
+            async with semaphore:
+                try:
+                    await run_session(client, idx, args, results)
+                except Exception as e:
+                    results["errors"] += 1
+                    print(f"session {idx} failed: {e}")
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*[one(i) for i in range(args.sessions)])
+        elapsed = time.perf_counter() - t0
+    return results, elapsed
+
+
+def rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        return None
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def compare(current, previous_path):
+    with open(previous_path) as f:
+        previous = json.load(f)
+    print(f"\nComparison against {previous.get('commit')} ({previous_path})")
+    print(f"{'metric':<34}{'before':>12}{'after':>12}{'change':>10}")
+    rows = [("throughput_sessions_per_s", previous["throughput_sessions_per_s"], current["throughput_sessions_per_s"])]
+    for stage, stats in current["latency"].items():
+        before = previous["latency"].get(stage, {})
+        for key in ("p50", "p99"):
+            if stats.get(key) is not None and before.get(key) is not None:
+                rows.append((f"{stage}.{key}", before[key], stats[key]))
+    for name, before, after in rows:
+        change = (after - before) / before * 100 if before else 0.0
+        print(f"{name:<34}{before:>12.4f}{after:>12.4f}{change:>9.1f}%")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=8, help="User turns per session after /start")
+    parser.add_argument("--questions", type=int, default=30, help="Questions in the synthetic questionnaire")
+    parser.add_argument("--model", default="Mistral")
+    parser.add_argument("--ttft", type=float, default=0.2, help="Fake model time to first token (s)")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="Fake model delay between tokens (s)")
+    parser.add_argument("--tokens", type=int, default=32, help="Tokens per fake answer")
+    parser.add_argument("--mongo-uri", default=None, help="Use a local mongod instead of the in-memory stand-in")
+    parser.add_argument("--real-embeddings", action="store_true", help="Use the sentence transformer instead of hashed vectors")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--output", default=None, help="Result file (default: bench/results/<timestamp>_<commit>.json)")
+    parser.add_argument("--compare", default=None, help="Previous result file to diff against")
+    args = parser.parse_args(argv)
+
+    app = build_app(args)
+    rss_before = rss_mb()
+    server, thread = start_server(app, args.port)
+    try:
+        results, elapsed = asyncio.run(drive(args, f"http://127.0.0.1:{args.port}"))
+    finally:
+        server.should_exit = True
+        thread.join(timeout=10)
+
+    latency = {stage: summarize(results[stage]) for stage in ("start", "ttft", "stream_total", "end")}
+    latency.update({stage: summarize(values) for stage, values in stage_timings.items()})
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "config": vars(args),
+        "elapsed_s": elapsed,
+        "sessions": args.sessions,
+        "turns": results["turns"],
+        "errors": results["errors"],
+        "throughput_sessions_per_s": args.sessions / elapsed,
+        "throughput_turns_per_s": results["turns"] / elapsed,
+        "latency": latency,
+        "memory": {
+            "rss_before_mb": rss_before,
+            "rss_after_mb": rss_mb(),
+            "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        },
+    }
+
+    print(f"\n{args.sessions} sessions, {results['turns']} turns in {elapsed:.2f}s "
+          f"({report['throughput_sessions_per_s']:.2f} sessions/s, {report['throughput_turns_per_s']:.2f} turns/s), "
+          f"{results['errors']} errors")
+    print(f"{'stage':<30}{'count':>8}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}")
+    for stage, stats in latency.items():
+        if stats["count"]:
+            print(f"{stage:<30}{stats['count']:>8}{stats['p50']:>10.4f}{stats['p90']:>10.4f}{stats['p99']:>10.4f}{stats['max']:>10.4f}")
+    print(f"memory: {report['memory']}")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{commit}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"results saved to {output}")
+
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""Time to first token through the real model clients, default vs pooled transport.
+
+Starts a local TLS mock of an OpenAI-style /v1/chat/completions stream behind
+a proxy that adds --rtt of latency per round trip (so TCP and TLS handshakes
+cost what they would over a real network), then sends bursts of concurrent
+ChatHuggingFace.astream calls separated by --idle seconds. The default
+huggingface_hub clients drop idle connections after 5 seconds and so
+reconnect on every burst; the pooled transport is warmed first and keeps them.
+
+Run from the backend directory:
+
+    python -m bench.llm_transport --rtt 0.05 --bursts 6 --concurrency 4 --idle 6
+
+Extra dependencies: uvicorn, cryptography.
+"""
+import argparse
+import asyncio
+import datetime
+import ipaddress
+import json
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+
+
+def write_self_signed_cert(directory):
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1)).not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName([x509.DNSName("localhost"),
+                                                    x509.IPAddress(ipaddress.ip_address("127.0.0.1"))]), critical=False)
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+    cert_path, key_path = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    with open(cert_path, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, "wb") as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                  serialization.NoEncryption()))
+    return cert_path, key_path
+
+
+def mock_provider(args):
+    async def root(request):
+        return Response(status_code=200)
+
+    async def chat_completions(request):
+        await request.body()
+
+        async def events():
+            await asyncio.sleep(args.server_ttft)
+            for i in range(args.tokens):
+                chunk = {"id": "mock", "object": "chat.completion.chunk", "created": 0, "model": "mock",
+                         "choices": [{"index": 0, "delta": {"role": "assistant", "content": f"token{i} "},
+                                      "finish_reason": None}]}
+                yield f"data: {json.dumps(chunk)}\n\n"
+                await asyncio.sleep(args.token_delay)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return Starlette(routes=[Route("/", root, methods=["GET", "HEAD"]),
+                             Route("/v1/chat/completions", chat_completions, methods=["POST"])])
+
+
+class LatencyProxy:
+    """TCP proxy adding rtt/2 to every segment in each direction and one rtt to connection setup"""
+
+    def __init__(self, upstream_port, rtt):
+        self.upstream_port = upstream_port
+        self.rtt = rtt
+        self.connections = 0
+
+    async def _pipe(self, reader, writer):
+        queue = asyncio.Queue()
+
+        async def send():
+            while True:
+                deadline, data = await queue.get()
+                if data is None:
+                    break
+                await asyncio.sleep(max(deadline - time.perf_counter(), 0))
+                writer.write(data)
+                await writer.drain()
+            writer.close()
+
+        sender = asyncio.create_task(send())
+        try:
+            while data := await reader.read(65536):
+                queue.put_nowait((time.perf_counter() + self.rtt / 2, data))
+        except ConnectionError:
+            pass
+        queue.put_nowait((0, None))
+        await sender
+
+    async def handle(self, client_reader, client_writer):
+        self.connections += 1
+        await asyncio.sleep(self.rtt)  # TCP handshake
+        upstream_reader, upstream_writer = await asyncio.open_connection("127.0.0.1", self.upstream_port)
+        await asyncio.gather(self._pipe(client_reader, upstream_writer), self._pipe(upstream_reader, client_writer),
+                             return_exceptions=True)
+
+    def start(self, port):
+        loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        async def serve():
+            await asyncio.start_server(self.handle, "127.0.0.1", port)
+            started.set()
+
+        threading.Thread(target=lambda: (loop.run_until_complete(serve()), loop.run_forever()), daemon=True).start()
+        started.wait()
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * pct / 100), len(ordered) - 1)]
+
+
+async def run_mode(mode, url, proxy, args):
+    from huggingface_hub import set_async_client_factory
+    from huggingface_hub.utils._http import default_async_client_factory
+    from langchain_huggingface import ChatHuggingFace, HuggingFaceEndpoint
+    from utils import llm_transport
+
+    opened_before = proxy.connections
+    setup = time.perf_counter()
+    if mode == "pooled":
+        provider = llm_transport.providers["huggingface"]
+        provider.origin = url
+        llm_transport.use_pooled_transports()
+        await provider.warm()
+    else:
+        set_async_client_factory(default_async_client_factory)
+    setup = time.perf_counter() - setup
+    warm_connections = proxy.connections - opened_before
+
+    model = ChatHuggingFace(llm=HuggingFaceEndpoint(endpoint_url=url, task="conversational", max_new_tokens=args.tokens,
+                                                    huggingfacehub_api_token="mock", timeout=30), model_id="mock")
+
+    async def one():
+        start = time.perf_counter()
+        ttft = None
+        async for chunk in model.astream("How was school today?"):
+            if ttft is None and chunk.content:
+                ttft = time.perf_counter() - start
+        return ttft
+
+    ttfts = []
+    for burst in range(args.bursts):
+        if burst:
+            await asyncio.sleep(args.idle)
+        ttfts.extend(await asyncio.gather(*(one() for _ in range(args.concurrency))))
+    await llm_transport.close()
+    return {
+        "mode": mode,
+        "requests": len(ttfts),
+        "ttft_p50": statistics.median(ttfts),
+        "ttft_p90": percentile(ttfts, 90),
+        "ttft_max": max(ttfts),
+        "connections_opened": proxy.connections - opened_before - warm_connections,
+        "warm_connections": warm_connections,
+        "warm_up_seconds": setup if mode == "pooled" else 0.0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rtt", type=float, default=0.05, help="Simulated network round trip (s)")
+    parser.add_argument("--bursts", type=int, default=6)
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent requests per burst")
+    parser.add_argument("--idle", type=float, default=6.0, help="Pause between bursts (s)")
+    parser.add_argument("--server-ttft", type=float, default=0.05, help="Mock model time to first token (s)")
+    parser.add_argument("--token-delay", type=float, default=0.005)
+    parser.add_argument("--tokens", type=int, default=16)
+    parser.add_argument("--port", type=int, default=8443)
+    parser.add_argument("--modes", default="default,pooled")
+    args = parser.parse_args(argv)
+
+    cert_dir = tempfile.mkdtemp()
+    cert_path, key_path = write_self_signed_cert(cert_dir)
+    # Both the default and the pooled clients trust the mock through the environment
+    os.environ["SSL_CERT_FILE"] = cert_path
+
+    # Provider edges keep idle connections far longer than uvicorn's 5 second default
+    config = uvicorn.Config(mock_provider(args), host="127.0.0.1", port=args.port, log_level="warning",
+                            access_log=False, ssl_certfile=cert_path, ssl_keyfile=key_path, timeout_keep_alive=120)
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    proxy = LatencyProxy(args.port, args.rtt)
+    proxy.start(args.port + 1)
+    url = f"https://localhost:{args.port + 1}"
+
+    results = [asyncio.run(run_mode(mode, url, proxy, args)) for mode in args.modes.split(",")]
+    server.should_exit = True
+
+    print(f"\n{args.bursts} bursts x {args.concurrency} requests, {args.idle}s apart, rtt {args.rtt * 1000:.0f} ms")
+    print(f"{'mode':<10}{'p50 ttft':>10}{'p90 ttft':>10}{'max':>10}{'new conns':>11}{'warmed':>8}")
+    for r in results:
+        print(f"{r['mode']:<10}{r['ttft_p50']:>10.4f}{r['ttft_p90']:>10.4f}{r['ttft_max']:>10.4f}"
+              f"{r['connections_opened']:>11}{r['warm_connections']:>8}")
+    if len(results) == 2:
+        saved = results[0]["ttft_p50"] - results[1]["ttft_p50"]
+        print(f"median time to first token {saved * 1000:+.1f} ms faster with the pooled transport")
+
+
+if __name__ == "__main__":
+    main()
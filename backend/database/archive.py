@@ -0,0 +1,183 @@
+import asyncio
+import gzip
+import json
+import logging
+import os
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from urllib.parse import quote
+
+from bson import ObjectId
+from dotenv import load_dotenv
+from pymongo import ASCENDING, ReplaceOne
+from pymongo.errors import OperationFailure
+from utils.metrics import MONGO_SECONDS, CHATS_ARCHIVED
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Sessions whose document was created longer ago than this move to the archive
+CHAT_ARCHIVE_AFTER_DAYS = float(os.getenv("CHAT_ARCHIVE_AFTER_DAYS", "180"))
+CHAT_ARCHIVE_BATCH = int(os.getenv("CHAT_ARCHIVE_BATCH", "200"))
+# Write archived sessions as gzip files here instead of the chats_archive collection
+CHAT_ARCHIVE_DIR = os.getenv("CHAT_ARCHIVE_DIR")
+# Run the archival job in the app every this many hours (0 = only through scripts/archive_chats.py)
+CHAT_ARCHIVE_INTERVAL_HOURS = float(os.getenv("CHAT_ARCHIVE_INTERVAL_HOURS", "0"))
+ARCHIVE_COLLECTION = "chats_archive"
+
+
+def _compress(conversation) -> bytes:
+    return zlib.compress(json.dumps(conversation, separators=(",", ":"), default=str).encode("utf-8"))
+
+
+def _decompress(blob: bytes) -> list:
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+def _archive_path(session_id: str) -> str:
+    return os.path.join(CHAT_ARCHIVE_DIR, f"{quote(session_id, safe='')}.json.gz")
+
+
+def _write_file(chat: dict):
+    os.makedirs(CHAT_ARCHIVE_DIR, exist_ok=True)
+    path = _archive_path(chat["session_id"])
+    with gzip.open(path + ".tmp", "wt", encoding="utf-8") as f:
+        json.dump(chat, f, separators=(",", ":"), default=str)
+    os.replace(path + ".tmp", path)
+
+
+def _read_file(session_id: str) -> Optional[dict]:
+    path = _archive_path(session_id)
+    if not os.path.exists(path):
+        return None
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def summarize(chat: dict) -> dict:
+    """Fields set on the hot document when its conversation moves to the archive"""
+    conversation = chat.get("conversation", [])
+    return {
+        "archived": True,
+        "turn_count": len(conversation),
+        "archived_at": datetime.now(timezone.utc),
+    }
+
+
+async def _write_archive(db, chats: list):
+    if CHAT_ARCHIVE_DIR:
+        for chat in chats:
+            await asyncio.to_thread(_write_file, {k: v for k, v in chat.items() if k != "_id"})
+        return
+    ops = [
+        ReplaceOne(
+            {"session_id": chat["session_id"]},
+            {**{k: v for k, v in chat.items() if k not in ("_id", "conversation")},
+             "conversation_z": _compress(chat.get("conversation", []))},
+            upsert=True,
+        )
+        for chat in chats
+    ]
+    with MONGO_SECONDS.time("archive.bulk_write"):
+        await db[ARCHIVE_COLLECTION].bulk_write(ops, ordered=False)
+
+
+async def load_archived_conversation(db, session_id: str) -> Optional[list]:
+    if CHAT_ARCHIVE_DIR:
+        chat = await asyncio.to_thread(_read_file, session_id)
+        return chat.get("conversation", []) if chat else None
+    with MONGO_SECONDS.time("archive.find_one"):
+        chat = await db[ARCHIVE_COLLECTION].find_one({"session_id": session_id}, {"conversation_z": 1})
+    return _decompress(chat["conversation_z"]) if chat else None
+
+
+async def restore_archived(db, chat: dict) -> dict:
+    """Put the archived conversation back in front of a hot summary document"""
+    if not chat or not chat.get("archived"):
+        return chat
+    archived = await load_archived_conversation(db, chat["session_id"])
+    if archived is None:
+        logger.error(f"Chat {chat['session_id']} is marked archived but missing from the archive")
+        archived = []
+    # Turns written after archiving (late feedback, a resumed session) are in the hot document
+    chat["conversation"] = archived + chat.get("conversation", [])
+    return chat
+
+
+async def archive_chats(db, older_than_days: float = CHAT_ARCHIVE_AFTER_DAYS, batch_size: int = CHAT_ARCHIVE_BATCH,
+                        dry_run: bool = False) -> dict:
+    """Move conversations of sessions created before the cutoff to the archive, leaving a summary.
+
+    The archive is written before the hot document is slimmed down, and the hot
+    update only applies if no turn was added in between, so an interrupted run
+    or a concurrent write never loses a turn; the next run picks it up again.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(days=older_than_days)
+    # Sessions carry no timestamp of their own; the ObjectId records when the document was created
+    id_range = {"$lt": ObjectId.from_datetime(cutoff)}
+    archived = skipped = 0
+    while True:
+        query = {"_id": id_range, "archived": {"$ne": True}}
+        with MONGO_SECONDS.time("archive.find"):
+            chats = await db["chats"].find(query).sort("_id", 1).limit(batch_size).to_list(length=batch_size)
+        if not chats:
+            break
+        id_range = {**id_range, "$gt": chats[-1]["_id"]}
+        if dry_run:
+            archived += len(chats)
+            continue
+        await _write_archive(db, chats)
+        for chat in chats:
+            conversation = chat.get("conversation", [])
+            with MONGO_SECONDS.time("archive.update_one"):
+                result = await db["chats"].update_one(
+                    {"_id": chat["_id"], "conversation": {"$size": len(conversation)}},
+                    {"$unset": {"conversation": ""}, "$set": summarize(chat)},
+                )
+            if result.modified_count:
+                archived += 1
+                CHATS_ARCHIVED.inc()
+            else:
+                skipped += 1
+        logger.info(f"Archived {archived} chats so far (cutoff {cutoff.isoformat()})")
+    return {"archived": archived, "skipped": skipped, "cutoff": cutoff.isoformat(), "dry_run": dry_run}
+
+
+async def _archive_periodically(db):
+    while True:
+        try:
+            summary = await archive_chats(db)
+            logger.info(f"Chat archival finished: {summary}")
+        except Exception as e:
+            logger.error(f"Chat archival failed: {e}")
+        await asyncio.sleep(CHAT_ARCHIVE_INTERVAL_HOURS * 3600)
+
+
+_archive_task: Optional[asyncio.Task] = None
+
+
+async def ensure_archive_index(db):
+    """Unique session_id index on the archive, read by every get_chat of an archived session and the research export"""
+    if CHAT_ARCHIVE_DIR:
+        return
+    try:
+        await db[ARCHIVE_COLLECTION].create_index([("session_id", ASCENDING)], unique=True, name="session_id")
+    except OperationFailure as e:
+        logger.warning(f"Could not create the {ARCHIVE_COLLECTION} session_id index: {e}")
+
+
+async def start_archiver(db):
+    global _archive_task
+    await ensure_archive_index(db)
+    if CHAT_ARCHIVE_INTERVAL_HOURS > 0:
+        _archive_task = asyncio.create_task(_archive_periodically(db))
+    return _archive_task
+
+
+def stop_archiver():
+    global _archive_task
+    if _archive_task:
+        _archive_task.cancel()
+        _archive_task = None
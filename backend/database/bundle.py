@@ -0,0 +1,134 @@
+import json
+import logging
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Directory holding index.json and vectors.npy, see scripts/build_bundle.py
+QUESTIONNAIRE_BUNDLE = os.getenv("QUESTIONNAIRE_BUNDLE")
+INDEX_FILE = "index.json"
+VECTORS_FILE = "vectors.npy"
+BUNDLE_VERSION = 1
+
+
+async def build_bundle(db, out_dir: str) -> dict:
+    """Compile every questionnaire into a metadata index and one float32 vector matrix"""
+    docs = await db["questionaires"].find({}).to_list(length=None)
+    index = {"version": BUNDLE_VERSION, "questionnaires": {}}
+    rows: List[List[float]] = []
+    for doc in docs:
+        name = doc.get("questionnaire")
+        if not name:
+            continue
+        questions = []
+        offset = len(rows)
+        for q in doc.get("questions", []):
+            questions.append({k: v for k, v in q.items() if k != "question_vector"})
+            rows.append(q["question_vector"])
+        entry = {k: v for k, v in doc.items() if k not in ("_id", "questions")}
+        entry.update({"offset": offset, "count": len(questions), "questions": questions})
+        index["questionnaires"][name] = entry
+
+    vectors = np.asarray(rows, dtype=np.float32)
+    index["rows"], index["dim"] = (vectors.shape[0], vectors.shape[1]) if rows else (0, 0)
+
+    # Write to temporary names and swap, so running workers keep their old mapping
+    os.makedirs(out_dir, exist_ok=True)
+    vectors_path = os.path.join(out_dir, VECTORS_FILE)
+    index_path = os.path.join(out_dir, INDEX_FILE)
+    with open(vectors_path + ".tmp", "wb") as f:
+        np.save(f, vectors)
+    with open(index_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(index, f, separators=(",", ":"), default=str)
+    os.replace(vectors_path + ".tmp", vectors_path)
+    os.replace(index_path + ".tmp", index_path)
+    logger.info(f"Built questionnaire bundle in {out_dir}: {len(index['questionnaires'])} questionnaires, {index['rows']} vectors")
+    return {"questionnaires": list(index["questionnaires"]), "rows": index["rows"], "dim": index["dim"]}
+
+
+class QuestionnaireBundle:
+    """Read-only view of a compiled bundle.
+
+    Vectors are memory-mapped, so every worker process opening the same file
+    shares one copy through the page cache. Question lists are built once per
+    questionnaire and shared by all sessions; callers must not mutate them.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, INDEX_FILE), encoding="utf-8") as f:
+            self.index = json.load(f)
+        if self.index.get("version") != BUNDLE_VERSION:
+            raise Exception(f"Unsupported questionnaire bundle version {self.index.get('version')}")
+        self.vectors = np.load(os.path.join(path, VECTORS_FILE), mmap_mode="r")
+        self._questions: Dict[str, List[dict]] = {}
+        self._item_bank: Optional[List[dict]] = None
+
+    def names(self) -> List[str]:
+        return list(self.index["questionnaires"])
+
+    def get_questions(self, name: str) -> Optional[List[dict]]:
+        questions = self._questions.get(name)
+        if questions is None:
+            entry = self.index["questionnaires"].get(name)
+            if entry is None:
+                return None
+            offset = entry["offset"]
+            # Each question_vector is a view into the mapped file, not a copy
+            questions = [dict(q, question_vector=self.vectors[offset + i]) for i, q in enumerate(entry["questions"])]
+            self._questions[name] = questions
+        return questions
+
+    def item_bank(self) -> List[dict]:
+        """Every question of every questionnaire, indexed by bundle row and tagged with its instrument"""
+        if self._item_bank is None:
+            bank = [None] * self.index["rows"]
+            for name, entry in self.index["questionnaires"].items():
+                for i, q in enumerate(self.get_questions(name)):
+                    bank[entry["offset"] + i] = dict(q, instrument=name)
+            self._item_bank = bank
+        return self._item_bank
+
+    def first_item(self, instruments: Optional[List[str]] = None) -> int:
+        """Row of the opening question of the first (allowed) questionnaire"""
+        for name, entry in self.index["questionnaires"].items():
+            if entry["count"] and (not instruments or name in instruments):
+                return entry["offset"]
+        return 0
+
+    def get(self, name: str) -> Optional[dict]:
+        """Questionnaire in the same shape as get_questionair returns"""
+        entry = self.index["questionnaires"].get(name)
+        if entry is None:
+            return None
+        data = {k: v for k, v in entry.items() if k not in ("offset", "count", "questions")}
+        data["questions"] = self.get_questions(name)
+        return data
+
+
+_bundle: Optional[QuestionnaireBundle] = None
+_bundle_failed = False
+
+
+def get_bundle() -> Optional[QuestionnaireBundle]:
+    """Open QUESTIONNAIRE_BUNDLE on first use; None when unset or unreadable"""
+    global _bundle, _bundle_failed
+    if _bundle is None and QUESTIONNAIRE_BUNDLE and not _bundle_failed:
+        try:
+            _bundle = QuestionnaireBundle(QUESTIONNAIRE_BUNDLE)
+            logger.info(f"Opened questionnaire bundle {QUESTIONNAIRE_BUNDLE} ({_bundle.index['rows']} vectors)")
+        except Exception as e:
+            _bundle_failed = True
+            logger.error(f"Error opening questionnaire bundle {QUESTIONNAIRE_BUNDLE}, falling back to Mongo: {e}")
+    return _bundle
+
+
+def get_bundled_questionnaire(name: str) -> Optional[dict]:
+    bundle = get_bundle()
+    return bundle.get(name) if bundle else None
@@ -7,8 +7,15 @@ import json
 import numpy as np
 from sentence_transformers import SentenceTransformer
 import asyncio
+import uuid
+from utils import embedding_pool
+from database import write_buffer
+from database.archive import restore_archived
+from utils import events, http_cache
+from utils.metrics import EMBEDDING_SECONDS, MONGO_SECONDS
 
-model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
+# Loaded on first use; with EMBEDDING_WORKERS set it lives in the worker processes instead
+model = None
 
 logger = logging.getLogger(__name__)
 
@@ -31,9 +38,27 @@ async def connect_questionnaire_db():
         logger.error(f"Error connecting to MongoDB: {e}", exc_info=True)
         raise
 
+def get_model():
+    global model
+    if model is None:
+        model = SentenceTransformer(embedding_pool.EMBEDDING_MODEL)
+    return model
+
 async def get_embedding(text):
-    embedding = await asyncio.to_thread(model.encode, text, normalize_embeddings=True)
-    return embedding.tolist()
+    with EMBEDDING_SECONDS.time():
+        if embedding_pool.pool:
+            embedding = await embedding_pool.pool.encode([text])
+            return embedding[0].tolist()
+        embedding = await asyncio.to_thread(get_model().encode, text, normalize_embeddings=True)
+        return embedding.tolist()
+
+async def get_embeddings(texts):
+    """Embed a batch of texts in one call"""
+    if embedding_pool.pool:
+        embeddings = await embedding_pool.pool.encode(texts)
+    else:
+        embeddings = await asyncio.to_thread(get_model().encode, texts, normalize_embeddings=True)
+    return [e.tolist() for e in embeddings]
 
 async def insert_dataset(db, dir_path):
     """Insert dataset from JSON file into MongoDB"""
@@ -51,8 +76,10 @@ async def insert_dataset(db, dir_path):
                 dataset = json.load(f)
 
             
-            for question in dataset.get("questions", []):
-                question["question_vector"] = await get_embedding(question["question"])
+            dataset_questions = dataset.get("questions", [])
+            vectors = await get_embeddings([q["question"] for q in dataset_questions])
+            for question, vector in zip(dataset_questions, vectors):
+                question["question_vector"] = vector
             questionair_name = dataset.get("questionnaire")
             questions = dataset.get("questions", [])
 
@@ -75,6 +102,7 @@ async def insert_dataset(db, dir_path):
 
             # Insert the dataset
             insert_result = await db["questionaires"].insert_one(dataset)
+            http_cache.invalidate("questionnaires")
             
             logger.info(f"Inserted questionair '{questionair_name}' with ID: {insert_result.inserted_id}")
             uploaded_questionaires.append(questionair_name)
@@ -93,7 +121,8 @@ async def insert_dataset(db, dir_path):
 async def get_questionair(db, questionair_name):
     """Retrieve a specific questionair from the database"""
     try:
-        questionair = await db["questionaires"].find_one({"questionnaire": questionair_name})
+        with MONGO_SECONDS.time("get_questionair"):
+            questionair = await db["questionaires"].find_one({"questionnaire": questionair_name})
         if questionair:
             # Convert ObjectId to string for JSON serialization
             questionair["_id"] = str(questionair["_id"])
@@ -107,7 +136,8 @@ async def list_questionairs(db):
     """List all available questionairs"""
     try:
         cursor = db["questionaires"].find({}, {"questionnaire": 1, "instructions":3, "_id": 0})
-        questionairs = await cursor.to_list(length=None)
+        with MONGO_SECONDS.time("list_questionairs"):
+            questionairs = await cursor.to_list(length=None)
         return [{"name":q["questionnaire"], "instructions":q["instructions"]} for q in questionairs]
     except Exception as e:
         logger.error(f"Error listing questionairs: {e}")
@@ -116,51 +146,67 @@ async def list_questionairs(db):
 async def get_chat(db, session_id):
     """Retrieve a specific chat from the database"""
     try:
-        chat = await db["chats"].find_one({"session_id": session_id})
+        with MONGO_SECONDS.time("get_chat"):
+            chat = await db["chats"].find_one({"session_id": session_id})
+        # Archived sessions keep only a summary in chats; the conversation comes from the archive
+        chat = await restore_archived(db, chat)
+        if write_buffer.buffer:
+            chat = write_buffer.buffer.overlay(session_id, chat)
         if chat:
             # Convert ObjectId to string for JSON serialization
-            chat["_id"] = str(chat["_id"])
+            if "_id" in chat:
+                chat["_id"] = str(chat["_id"])
             return chat
         return None
     except Exception as e:
         logger.error(f"Error retrieving questionair '{session_id}': {e}")
         raise Exception(f"Error retrieving questionair: {str(e)}")
     
-async def store_chat_response(db, session_id, role, best_question_data, message):
-    """Store a chat response in the database"""
+async def store_chat_response(db, session_id, role, best_question_data, message, interrupted=False):
+    """Store a chat response in the database. Interrupted bot turns are the partial answer streamed before the client left"""
     try:
-        chat = await db["chats"].find_one({"session_id": session_id})
-        if not chat:
-            # Create a new chat if it doesn't exist
-            chat = {
-                "session_id": session_id,
-                "conversation": []
-            }
-        
-        # Append the new message to the conversation
+        # Build the new conversation entry
         if(role == 'bot'):
-            chat["conversation"].append({
+            turn = {
                 "role": role,
                 "question_index": best_question_data[0],
                 "question": best_question_data[1],
                 "message": message
-            })
+            }
+            if interrupted:
+                turn["interrupted"] = True
         elif(role == "user"):
-            chat["conversation"].append({
+            turn = {
                 "role": role,
                 "message": message
-            })
+            }
         else:
-            chat["feedback"] = message
-        
-        # Upsert the chat document
-        await db["chats"].update_one(
-            {"session_id": session_id},
-            {"$set": chat},
-            upsert=True
-        )
+            turn = None
+        if turn is not None:
+            turn["turn_id"] = uuid.uuid4().hex
+        else:
+            await events.publish_for_session(db, events.SESSION_COMPLETED, session_id, feedback=message)
+
+        if write_buffer.buffer:
+            # Write-behind: returns immediately, get_chat overlays the buffered writes
+            if turn is not None:
+                write_buffer.buffer.append_turn(session_id, turn)
+            else:
+                write_buffer.buffer.set_fields(session_id, {"feedback": message})
+            http_cache.invalidate_chat(session_id)
+            return
+
+        if turn is not None:
+            # Appended in place: an archived summary has no conversation of its own, and turns
+            # pushed after archiving are read back behind the archived ones by restore_archived
+            update = {"$push": {"conversation": turn}}
+        else:
+            update = {"$set": {"feedback": message}, "$setOnInsert": {"conversation": []}}
+        with MONGO_SECONDS.time("store_chat_response.update_one"):
+            await db["chats"].update_one({"session_id": session_id}, update, upsert=True)
+        http_cache.invalidate_chat(session_id)
         
         logger.info(f"Stored response for session {session_id}")
     except Exception as e:
         logger.error(f"Error storing chat response: {e}")
-        raise Exception(f"Error storing chat response: {str(e)}")
\ No newline at end of file
+        raise Exception(f"Error storing chat response: {str(e)}")
@@ -1,10 +1,21 @@
 from models.children import AddChildRequest, ChildRequest
 import os
+import logging
+from datetime import datetime
 from motor.motor_asyncio import AsyncIOMotorClient
-from typing import List, Optional
+from pydantic import ValidationError
+from pymongo import ASCENDING
+from pymongo.errors import BulkWriteError, OperationFailure
+from typing import AsyncIterator, List, Optional
 from dotenv import load_dotenv
+from utils.metrics import MONGO_SECONDS
+from utils.roster import RosterError
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+ROSTER_IMPORT_BATCH = int(os.getenv("ROSTER_IMPORT_BATCH", "500"))
+
 
 async def connect_children_db():
     """Connect to MongoDB database for users"""
@@ -60,4 +71,129 @@ def get_child_by_school(db, school: str):
             raise Exception(f"No children found for school: {school}")
         return children
     except Exception as e:
-        raise Exception(f"Error fetching children by school {school}: {str(e)}")
\ No newline at end of file
+        raise Exception(f"Error fetching children by school {school}: {str(e)}")
+
+def child_document(request: AddChildRequest) -> dict:
+    """Children collection document for a validated request"""
+    child_data = request.dict()
+    # dob = yyyy-mm-dd
+    child_data["age"] = datetime.now().year - int(child_data["dob"].split("-")[0])
+    child_data["created_at"] = child_data["updated_at"] = datetime.now()
+    return child_data
+
+
+def _child_key(child) -> tuple:
+    return (child["name"], child["dob"], child["school"])
+
+
+_unique_index_ready = False
+
+
+async def ensure_child_index(db):
+    """Unique (name, dob, school) index so concurrent imports cannot add the same child twice"""
+    global _unique_index_ready
+    if _unique_index_ready:
+        return
+    try:
+        await db.children.create_index(
+            [("school", ASCENDING), ("name", ASCENDING), ("dob", ASCENDING)], unique=True, name="school_name_dob"
+        )
+    except OperationFailure as e:
+        # Existing duplicates block the unique index; the batched lookup still catches most of them
+        logger.warning(f"Could not create the unique children index: {e}")
+    _unique_index_ready = True
+
+
+async def _import_batch(db, batch: List[tuple], report: list):
+    """Look up duplicates of a batch in one query, then insert the rest unordered"""
+    schools = list({request.school for _, request in batch})
+    names = list({request.name for _, request in batch})
+    with MONGO_SECONDS.time("children.import.find"):
+        existing = await db.children.find(
+            {"school": {"$in": schools}, "name": {"$in": names}}, {"name": 1, "dob": 1, "school": 1}
+        ).to_list(length=None)
+    existing = {_child_key(child): str(child["_id"]) for child in existing}
+
+    to_insert = []
+    for row, request in batch:
+        key = _child_key(request.dict())
+        if key in existing:
+            report.append({"row": row, "status": "duplicate", "child_id": existing[key]})
+        else:
+            to_insert.append((row, child_document(request)))
+    if not to_insert:
+        return
+
+    failed = {}
+    try:
+        with MONGO_SECONDS.time("children.import.insert_many"):
+            await db.children.insert_many([doc for _, doc in to_insert], ordered=False)
+    except BulkWriteError as e:
+        for error in e.details.get("writeErrors", []):
+            failed[error["index"]] = error
+    for i, (row, doc) in enumerate(to_insert):
+        error = failed.get(i)
+        if error is None:
+            report.append({"row": row, "status": "inserted", "child_id": str(doc["_id"])})
+        elif error.get("code") == 11000:
+            # Added by someone else between the lookup and the insert
+            report.append({"row": row, "status": "duplicate"})
+        else:
+            report.append({"row": row, "status": "failed", "errors": [error.get("errmsg", "insert failed")]})
+
+
+async def import_children(db, rows: AsyncIterator[dict], defaults: Optional[dict] = None,
+                          batch_size: int = ROSTER_IMPORT_BATCH) -> dict:
+    """Validate and insert a roster as it is parsed, batch_size rows per round trip.
+
+    Every row gets a report entry: inserted, duplicate (already enrolled),
+    duplicate_in_file, invalid (with the validation errors) or failed. A
+    roster that stops parsing part way keeps the rows before the problem and
+    reports it under error; uploading the fixed file again is safe.
+    """
+    await ensure_child_index(db)
+    report = []
+    batch = []
+    seen = set()
+    row = 0
+    error = None
+    errors = []
+    async for fields in _until_parse_error(rows, errors):
+        row += 1
+        try:
+            request = AddChildRequest(**{**(defaults or {}), **fields})
+            datetime.strptime(request.dob, "%Y-%m-%d")
+        except ValidationError as e:
+            report.append({"row": row, "status": "invalid",
+                           "errors": [f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()]})
+            continue
+        except ValueError:
+            report.append({"row": row, "status": "invalid", "errors": [f"dob: expected YYYY-MM-DD, got '{fields.get('dob')}'"]})
+            continue
+        key = _child_key(request.dict())
+        if key in seen:
+            report.append({"row": row, "status": "duplicate_in_file"})
+            continue
+        seen.add(key)
+        batch.append((row, request))
+        if len(batch) >= batch_size:
+            await _import_batch(db, batch, report)
+            batch = []
+    if batch:
+        await _import_batch(db, batch, report)
+    if errors:
+        error = f"Stopped after row {row}: {errors[0]}"
+
+    report.sort(key=lambda entry: entry["row"])
+    counts = {}
+    for entry in report:
+        counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+    return {"rows": row, "counts": counts, "report": report, "error": error}
+
+
+async def _until_parse_error(rows: AsyncIterator[dict], errors: list) -> AsyncIterator[dict]:
+    try:
+        async for fields in rows:
+            yield fields
+    except RosterError as e:
+        errors.append(str(e))
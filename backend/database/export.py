@@ -0,0 +1,419 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import re
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional
+
+from bson import ObjectId
+from dotenv import load_dotenv
+from database import jobs
+from database.archive import restore_archived
+from utils.metrics import MONGO_SECONDS, EXPORT_ROWS
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+EXPORT_DIR = os.getenv("EXPORT_DIR", "exports")
+# Documents fetched per cursor batch
+EXPORT_BATCH = int(os.getenv("EXPORT_BATCH", "500"))
+# Rows buffered per table before they are written out as one Parquet row group
+EXPORT_ROW_GROUP = int(os.getenv("EXPORT_ROW_GROUP", "50000"))
+# Source documents per file; a finished file is the unit an interrupted export resumes after
+EXPORT_PART_DOCS = int(os.getenv("EXPORT_PART_DOCS", "20000"))
+EXPORT_COMPRESSION = os.getenv("EXPORT_COMPRESSION", "zstd")
+# HMAC key for pseudonyms; the same key gives the same pseudonym across exports
+EXPORT_PSEUDONYM_KEY = os.getenv("EXPORT_PSEUDONYM_KEY")
+
+MANIFEST = "manifest.json"
+
+# Tables and the collection each one is read from
+TABLES = {"sessions": "chats", "turns": "chats", "children": "children"}
+
+# Name and mobile columns replaced by keyed pseudonyms
+IDENTIFYING = {"name", "student_name", "gaurdian_name", "parent_name", "teacher_name", "parent_mobile", "teacher_mobile"}
+# Names of a session's people, scrubbed from its free text
+SESSION_NAMES = ("student_name", "parent_name", "gaurdian_name", "teacher_name")
+# Free-text session columns scrubbed like turn messages
+FREE_TEXT = ("feedback", "diagnosis")
+
+# Runs of digits, spaces and hyphens; those with at least 9 digits are taken for phone numbers (dates have 8)
+_PHONE = re.compile(r"\+?\d[\d -]{7,}\d")
+
+
+class ExportError(Exception):
+    pass
+
+
+def _schemas() -> dict:
+    string, timestamp = pa.string(), pa.timestamp("ms", tz="UTC")
+    return {
+        "sessions": pa.schema([
+            ("session_id", string), ("started_at", timestamp), ("student_name", string), ("student_dob", string),
+            ("student_gender", string), ("student_age", pa.int32()), ("school", string), ("gaurdian_role", string),
+            ("gaurdian_name", string), ("parent_name", string), ("parent_mobile", string), ("teacher_name", string),
+            ("teacher_mobile", string), ("questionnaire_name", string), ("diagnosis", string), ("feedback", string),
+            ("turn_count", pa.int32()), ("archived", pa.bool_()),
+        ]),
+        "turns": pa.schema([
+            ("session_id", string), ("session_started_at", timestamp), ("turn", pa.int32()), ("role", string),
+            ("question_index", pa.int32()), ("question", string), ("message", string), ("interrupted", pa.bool_()),
+            ("turn_id", string),
+        ]),
+        "children": pa.schema([
+            ("child_id", string), ("name", string), ("dob", string), ("gender", string), ("school", string),
+            ("parent_name", string), ("parent_mobile", string), ("teacher_name", string), ("teacher_mobile", string),
+            ("created_at", timestamp),
+        ]),
+    }
+
+
+class Pseudonymiser:
+    """Keyed, stable pseudonyms, so rows of one person still join across tables and exports"""
+
+    def __init__(self, key: str):
+        self.key = key.encode("utf-8")
+
+    def __call__(self, value):
+        if value is None or value == "":
+            return value
+        normalised = " ".join(str(value).lower().split())
+        return hmac.new(self.key, normalised.encode("utf-8"), hashlib.sha256).hexdigest()[:16]
+
+    def fingerprint(self) -> str:
+        """Identifies the key in the manifest without revealing it"""
+        return hmac.new(self.key, b"export-key-fingerprint", hashlib.sha256).hexdigest()[:12]
+
+    def scrubber(self, names: Iterable[str]):
+        """Replaces the given names, and each part of them, in free text with their pseudonyms, and phone numbers with [mobile]"""
+        parts = {}
+        for name in names:
+            if not name:
+                continue
+            parts[name] = self(name)
+            for part in str(name).split():
+                if len(part) >= 3:
+                    parts.setdefault(part, self(part))
+        lookup = {k.lower(): v for k, v in parts.items()}
+        pattern = re.compile(r"\b(" + "|".join(re.escape(k) for k in sorted(parts, key=len, reverse=True)) + r")\b",
+                             re.IGNORECASE) if parts else None
+
+        def scrub(text):
+            if not text:
+                return text
+            if pattern:
+                text = pattern.sub(lambda m: lookup[m.group(0).lower()], text)
+            return _PHONE.sub(lambda m: "[mobile]" if sum(c.isdigit() for c in m.group(0)) >= 9 else m.group(0), text)
+        return scrub
+
+    def row(self, row: dict) -> dict:
+        for column in IDENTIFYING.intersection(row):
+            row[column] = self(row[column])
+        return row
+
+
+def _int(value) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def session_row(chat: dict, scrub=None) -> dict:
+    row = {
+        "session_id": chat.get("session_id"),
+        "started_at": chat["_id"].generation_time,
+        **{column: _str(chat.get(column)) for column in (
+            "student_name", "student_dob", "student_gender", "school", "gaurdian_role", "gaurdian_name",
+            "parent_name", "parent_mobile", "teacher_name", "teacher_mobile", "questionnaire_name", "diagnosis",
+            "feedback")},
+        "student_age": _int(chat.get("student_age")),
+        "turn_count": len(chat.get("conversation") or []),
+        "archived": bool(chat.get("archived")),
+    }
+    if scrub:
+        for column in FREE_TEXT:
+            row[column] = scrub(row[column])
+    return row
+
+
+def turn_rows(chat: dict, scrub=None) -> List[dict]:
+    """One row per conversation turn. Turns carry no time of their own, so rows keep their position and the session start"""
+    started_at = chat["_id"].generation_time
+    rows = []
+    for i, turn in enumerate(chat.get("conversation") or []):
+        message = _str(turn.get("message"))
+        rows.append({
+            "session_id": chat.get("session_id"),
+            "session_started_at": started_at,
+            "turn": i,
+            "role": turn.get("role"),
+            "question_index": _int(turn.get("question_index")),
+            "question": _str(turn.get("question")),
+            "message": scrub(message) if scrub else message,
+            "interrupted": bool(turn.get("interrupted")),
+            "turn_id": turn.get("turn_id"),
+        })
+    return rows
+
+
+def child_row(child: dict) -> dict:
+    return {
+        "child_id": str(child["_id"]),
+        **{column: _str(child.get(column)) for column in (
+            "name", "dob", "gender", "school", "parent_name", "parent_mobile", "teacher_name", "teacher_mobile")},
+        "created_at": child.get("created_at") or child["_id"].generation_time,
+    }
+
+
+def _str(value) -> Optional[str]:
+    return None if value is None else str(value)
+
+
+class _PartWriter:
+    """Writes one table's rows of the current part to <table>/part-NNNNN.parquet, a row group at a time.
+
+    The file is written under a .tmp name and only renamed when the part is
+    complete, so a file without the suffix is always whole.
+    """
+
+    def __init__(self, directory: str, table: str, schema, compression: str):
+        self.directory = os.path.join(directory, table)
+        self.table = table
+        self.schema = schema
+        self.compression = compression
+        self.rows: List[dict] = []
+        self.writer = None
+        self.path = None
+        self.written = 0
+
+    def open(self, part: int):
+        os.makedirs(self.directory, exist_ok=True)
+        self.path = os.path.join(self.directory, f"part-{part:05d}.parquet")
+        self.written = 0
+
+    def add(self, rows: List[dict]):
+        self.rows.extend(rows)
+        if len(self.rows) >= EXPORT_ROW_GROUP:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.path + ".tmp", self.schema, compression=self.compression)
+        self.writer.write_table(pa.Table.from_pylist(self.rows, schema=self.schema))
+        self.written += len(self.rows)
+        EXPORT_ROWS.inc(self.table, amount=len(self.rows))
+        self.rows = []
+
+    def close(self) -> Optional[dict]:
+        """Finish the part file; returns its manifest entry, or None if the part had no rows"""
+        self.flush()
+        if self.writer is None:
+            return None
+        self.writer.close()
+        self.writer = None
+        os.replace(self.path + ".tmp", self.path)
+        return {"file": os.path.basename(self.path), "rows": self.written}
+
+    def discard(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        self.rows = []
+
+
+def _save_manifest(directory: str, manifest: dict):
+    path = os.path.join(directory, MANIFEST)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2, default=str)
+    os.replace(path + ".tmp", path)
+
+
+def load_manifest(directory: str) -> Optional[dict]:
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def _resolve_options(directory, tables, pseudonymise, key, compression) -> dict:
+    unknown = set(tables) - set(TABLES)
+    if unknown:
+        raise ExportError(f"Unknown tables {sorted(unknown)}; choose from {sorted(TABLES)}")
+    if pseudonymise and not key:
+        # An unkeyed hash of a phone number is reversed by hashing every phone number
+        raise ExportError("Pseudonymisation needs a secret key (EXPORT_PSEUDONYM_KEY)")
+    options = {
+        "tables": sorted(tables),
+        "pseudonymised": bool(pseudonymise),
+        "key_fingerprint": Pseudonymiser(key).fingerprint() if pseudonymise else None,
+        "compression": compression,
+    }
+    manifest = load_manifest(directory)
+    if manifest and manifest["options"] != options:
+        raise ExportError(f"{directory} holds an export made with different options {manifest['options']}; "
+                          "resume it with those or export to a new directory")
+    return manifest or {"options": options, "status": "running", "started_at": datetime.now(timezone.utc),
+                        "sources": {}, "files": {}}
+
+
+async def _in_thread(fn, *args):
+    """Run blocking export work off the event loop; a cancelled caller still waits for it, so cleanup never races it"""
+    task = asyncio.ensure_future(asyncio.to_thread(fn, *args))
+    try:
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        await asyncio.wait([task])
+        raise
+
+
+async def _export_collection(collection, source: str, tables: List[str], directory: str, manifest: dict,
+                             pseudonymiser: Optional[Pseudonymiser], batch_size: int, part_docs: int, restore=None):
+    """Stream one collection in _id order into the part files of its tables, checkpointing after each part"""
+    state = manifest["sources"].setdefault(source, {"last_id": None, "parts": 0, "documents": 0, "done": False})
+    if state["done"]:
+        return
+    schemas = _schemas()
+    writers = {table: _PartWriter(directory, table, schemas[table], manifest["options"]["compression"])
+               for table in tables}
+    for writer in writers.values():
+        writer.open(state["parts"])
+    query = {"_id": {"$gt": ObjectId(state["last_id"])}} if state["last_id"] else {}
+    in_part = 0
+    last_id = None
+
+    def finish_part():
+        for table, writer in writers.items():
+            entry = writer.close()
+            if entry:
+                manifest["files"].setdefault(table, []).append(entry)
+        state["last_id"] = str(last_id)
+        state["parts"] += 1
+        state["documents"] += in_part
+        _save_manifest(directory, manifest)
+        for writer in writers.values():
+            writer.open(state["parts"])
+
+    def write_batch(docs: List[dict]):
+        nonlocal in_part, last_id
+        for doc in docs:
+            scrub = None
+            if pseudonymiser and source == "chats":
+                scrub = pseudonymiser.scrubber(doc.get(c) for c in SESSION_NAMES)
+            for table, writer in writers.items():
+                if table == "sessions":
+                    rows = [session_row(doc, scrub)]
+                elif table == "turns":
+                    rows = turn_rows(doc, scrub)
+                else:
+                    rows = [child_row(doc)]
+                if pseudonymiser:
+                    rows = [pseudonymiser.row(row) for row in rows]
+                writer.add(rows)
+            last_id = doc["_id"]
+            in_part += 1
+            if in_part >= part_docs:
+                finish_part()
+                in_part = 0
+
+    try:
+        cursor = collection.find(query, sort=[("_id", 1)], batch_size=batch_size)
+        while True:
+            with MONGO_SECONDS.time(f"export.{source}"):
+                batch = await cursor.to_list(length=batch_size)
+            if not batch:
+                break
+            if restore:
+                batch = [await restore(doc) for doc in batch]
+            # Pseudonymising, Parquet encoding and the part and manifest writes all block
+            await _in_thread(write_batch, batch)
+        if in_part:
+            await _in_thread(finish_part)
+    except BaseException:
+        # The unfinished part is written again from the last checkpoint on resume
+        for writer in writers.values():
+            writer.discard()
+        raise
+    state["done"] = True
+    await _in_thread(_save_manifest, directory, manifest)
+
+
+async def export(ques_db, children_db, directory: str, tables: Iterable[str] = TABLES, pseudonymise: bool = False,
+                 key: Optional[str] = EXPORT_PSEUDONYM_KEY, batch_size: int = EXPORT_BATCH,
+                 part_docs: int = EXPORT_PART_DOCS, compression: str = EXPORT_COMPRESSION) -> dict:
+    """Export screening data for research as Parquet files under directory, one subdirectory per table.
+
+    Collections are read through batched cursors in _id order and written a
+    row group at a time, so memory stays bounded by the batch and row group
+    sizes. manifest.json records the finished files and the last exported
+    _id; running again with the same directory and options resumes after it.
+    """
+    if pq is None:
+        raise ExportError("Research exports need pyarrow (pip install pyarrow)")
+    tables = list(tables)
+    await asyncio.to_thread(os.makedirs, directory, exist_ok=True)
+    manifest = await asyncio.to_thread(_resolve_options, directory, tables, pseudonymise, key, compression)
+    if manifest["status"] == "complete":
+        return manifest
+    manifest["status"] = "running"
+    await _in_thread(_save_manifest, directory, manifest)
+    pseudonymiser = Pseudonymiser(key) if pseudonymise else None
+
+    chat_tables = [t for t in tables if TABLES[t] == "chats"]
+    try:
+        if chat_tables:
+            await _export_collection(ques_db["chats"], "chats", chat_tables, directory, manifest, pseudonymiser,
+                                     batch_size, part_docs, restore=lambda chat: restore_archived(ques_db, chat))
+        if "children" in tables:
+            await _export_collection(children_db["children"], "children", ["children"], directory, manifest,
+                                     pseudonymiser, batch_size, part_docs)
+    except Exception as e:
+        manifest["status"] = "interrupted"
+        manifest["error"] = str(e)
+        await _in_thread(_save_manifest, directory, manifest)
+        raise
+    manifest["status"] = "complete"
+    manifest.pop("error", None)
+    manifest["finished_at"] = datetime.now(timezone.utc)
+    await _in_thread(_save_manifest, directory, manifest)
+    logger.info(f"Research export in {directory} complete: " + ", ".join(
+        f"{table} {sum(f['rows'] for f in files)} rows" for table, files in manifest["files"].items()))
+    return manifest
+
+
+def export_path(export_id: str) -> str:
+    if not re.fullmatch(r"[\w.-]+", export_id):
+        raise ExportError(f"Invalid export id '{export_id}'")
+    return os.path.join(EXPORT_DIR, export_id)
+
+
+def list_exports() -> List[dict]:
+    """Manifests of the exports under EXPORT_DIR, newest first"""
+    if not os.path.isdir(EXPORT_DIR):
+        return []
+    exports = []
+    for export_id in sorted(os.listdir(EXPORT_DIR), reverse=True):
+        manifest = load_manifest(os.path.join(EXPORT_DIR, export_id))
+        if manifest:
+            exports.append({"export_id": export_id, **manifest})
+    return exports
+
+
+@jobs.register("research_export", concurrency=1, max_attempts=3)
+async def research_export(db, export_id: str, tables: List[str], pseudonymise: bool) -> Dict:
+    # The children database lives on the same cluster as the questionnaire one
+    manifest = await export(db, db.client["children_db"], export_path(export_id), tables, pseudonymise)
+    return {"status": manifest["status"], "files": {t: len(files) for t, files in manifest["files"].items()}}
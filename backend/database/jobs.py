@@ -0,0 +1,262 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, Optional
+
+from dotenv import load_dotenv
+from pymongo import ASCENDING, ReturnDocument
+from utils.metrics import MONGO_SECONDS, JOBS_PROCESSED, JOB_LAG_SECONDS, JOB_SECONDS
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Workers in this process; 0 leaves the jobs to other processes
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# How often idle workers look for jobs enqueued by other processes
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+# A running job whose worker stopped renewing its lease for this long is handed out again
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "300"))
+JOB_RETRY_BACKOFF = float(os.getenv("JOB_RETRY_BACKOFF", "5"))
+JOB_MAX_BACKOFF = 600.0
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobType:
+    """A registered handler with its own concurrency limit and retry budget"""
+
+    def __init__(self, name: str, handler: Callable[..., Awaitable], concurrency: int, max_attempts: int):
+        self.name = name
+        self.handler = handler
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.running = 0
+
+
+job_types: Dict[str, JobType] = {}
+
+
+def register(name: str, concurrency: int = 1, max_attempts: int = 5):
+    """Decorator registering an `async def handler(db, **payload)` as a job type"""
+    def decorator(handler):
+        job_types[name] = JobType(name, handler, concurrency, max_attempts)
+        return handler
+    return decorator
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+async def enqueue(db, job_type: str, payload: dict, key: Optional[str] = None, delay: float = 0):
+    """Record a job in Mongo and wake the local workers.
+
+    With a key, a job of the same key still waiting in the queue is updated
+    instead of adding another, so repeated requests do not pile up work.
+    """
+    now = _now()
+    run_at = now + timedelta(seconds=delay)
+    if key:
+        with MONGO_SECONDS.time("jobs.update_one"):
+            result = await db["jobs"].update_one(
+                {"key": key, "status": QUEUED}, {"$set": {"payload": payload, "run_at": run_at}}
+            )
+        if result.matched_count:
+            return
+    with MONGO_SECONDS.time("jobs.insert_one"):
+        await db["jobs"].insert_one({
+            "type": job_type,
+            "key": key,
+            "payload": payload,
+            "status": QUEUED,
+            "attempts": 0,
+            "created_at": now,
+            "run_at": run_at,
+        })
+    if queue:
+        queue.wake.set()
+
+
+class JobQueue:
+    """Pool of workers claiming job records from Mongo.
+
+    A job is claimed atomically with find_one_and_update, so several
+    processes can share the collection. Claims carry a lease; a job whose
+    worker died is claimed again once the lease runs out. Failures are
+    retried with exponential backoff until the job type's max_attempts.
+    """
+
+    def __init__(self, db, workers: int = JOB_WORKERS):
+        self.db = db
+        self.workers = workers
+        self.worker_id = uuid.uuid4().hex[:8]
+        self.wake = asyncio.Event()
+        self.oldest_queued_at: Optional[datetime] = None
+        self._tasks = []
+
+    def lag(self) -> float:
+        """Seconds the oldest due job has been waiting, as of the last poll"""
+        if self.oldest_queued_at is None:
+            return 0.0
+        return max((_now() - self.oldest_queued_at).total_seconds(), 0.0)
+
+    async def _refresh_lag(self):
+        with MONGO_SECONDS.time("jobs.find_one"):
+            oldest = await self.db["jobs"].find_one(
+                {"status": QUEUED, "run_at": {"$lte": _now()}}, {"run_at": 1}, sort=[("run_at", ASCENDING)]
+            )
+        self.oldest_queued_at = _aware(oldest["run_at"]) if oldest else None
+
+    async def claim(self) -> Optional[dict]:
+        """Claim a due job holding a slot of its type, which run_job gives back"""
+        # Slots are reserved before the first await, so workers claiming at the same time
+        # cannot together run more jobs of a type than its concurrency
+        reserved = [t for t in job_types.values() if t.running < t.concurrency]
+        if not reserved:
+            return None
+        for job_type in reserved:
+            job_type.running += 1
+        job = None
+        now = _now()
+        try:
+            with MONGO_SECONDS.time("jobs.find_one_and_update"):
+                job = await self.db["jobs"].find_one_and_update(
+                    {
+                        "type": {"$in": [t.name for t in reserved]},
+                        "$or": [
+                            {"status": QUEUED, "run_at": {"$lte": now}},
+                            {"status": RUNNING, "lease_until": {"$lt": now}},
+                        ],
+                    },
+                    {
+                        "$set": {"status": RUNNING, "started_at": now, "worker": self.worker_id,
+                                 "lease_until": now + timedelta(seconds=JOB_LEASE_SECONDS)},
+                        "$inc": {"attempts": 1},
+                    },
+                    sort=[("run_at", ASCENDING)],
+                    return_document=ReturnDocument.AFTER,
+                )
+            return job
+        finally:
+            for job_type in reserved:
+                if job is None or job_type.name != job["type"]:
+                    job_type.running -= 1
+
+    async def run_job(self, job: dict):
+        job_type = job_types[job["type"]]
+        start = time.perf_counter()
+        renewal = asyncio.create_task(self._renew_lease(job["_id"]))
+        try:
+            JOB_LAG_SECONDS.observe(max((_now() - _aware(job["run_at"])).total_seconds(), 0.0), job_type.name)
+            result = await job_type.handler(self.db, **job["payload"])
+            update = {"$set": {"status": DONE, "finished_at": _now(), "result": result}, "$unset": {"lease_until": "", "error": ""}}
+            outcome = "done"
+        except Exception as e:
+            if job["attempts"] < job_type.max_attempts:
+                backoff = min(JOB_RETRY_BACKOFF * 2 ** (job["attempts"] - 1), JOB_MAX_BACKOFF)
+                update = {"$set": {"status": QUEUED, "error": str(e), "run_at": _now() + timedelta(seconds=backoff)},
+                          "$unset": {"lease_until": ""}}
+                outcome = "retried"
+                logger.warning(f"Job {job['_id']} ({job_type.name}) failed on attempt {job['attempts']}, retrying in {backoff}s: {e}")
+            else:
+                update = {"$set": {"status": FAILED, "error": str(e), "finished_at": _now()}, "$unset": {"lease_until": ""}}
+                outcome = "failed"
+                logger.error(f"Job {job['_id']} ({job_type.name}) failed after {job['attempts']} attempts: {e}")
+        finally:
+            renewal.cancel()
+            # Slot reserved by claim()
+            job_type.running -= 1
+            JOB_SECONDS.observe(time.perf_counter() - start, job_type.name)
+        JOBS_PROCESSED.inc(job_type.name, outcome)
+        # Only the worker holding the lease may settle the job
+        try:
+            with MONGO_SECONDS.time("jobs.update_one"):
+                await self.db["jobs"].update_one({"_id": job["_id"], "worker": self.worker_id, "status": RUNNING}, update)
+        except Exception as e:
+            logger.error(f"Error settling job {job['_id']} ({job_type.name}) as {outcome}, "
+                         f"it is handed out again when its lease runs out: {e}")
+
+    async def _renew_lease(self, job_id):
+        """Extend the lease while the handler runs, so long jobs are not handed to another worker"""
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+            try:
+                with MONGO_SECONDS.time("jobs.update_one"):
+                    await self.db["jobs"].update_one(
+                        {"_id": job_id, "worker": self.worker_id, "status": RUNNING},
+                        {"$set": {"lease_until": _now() + timedelta(seconds=JOB_LEASE_SECONDS)}},
+                    )
+            except Exception as e:
+                logger.error(f"Error renewing the lease of job {job_id}: {e}")
+
+    async def _work(self):
+        while True:
+            try:
+                job = await self.claim()
+            except Exception as e:
+                logger.error(f"Error claiming a job: {e}")
+                job = None
+            if job is None:
+                self.wake.clear()
+                try:
+                    await asyncio.wait_for(self.wake.wait(), JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self.run_job(job)
+            except Exception as e:
+                # A worker outlives any single job; the job itself is retried once its lease runs out
+                logger.error(f"Error running job {job.get('_id')}: {e}")
+
+    async def _watch_lag(self):
+        while True:
+            try:
+                await self._refresh_lag()
+            except Exception as e:
+                logger.error(f"Error reading the job queue lag: {e}")
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+
+    async def start(self):
+        await self.db["jobs"].create_index([("status", ASCENDING), ("run_at", ASCENDING)])
+        await self.db["jobs"].create_index([("key", ASCENDING), ("status", ASCENDING)])
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._watch_lag()))
+
+    async def stop(self):
+        """Stop claiming jobs; a job cut off here is picked up again when its lease runs out"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+def _aware(value: datetime) -> datetime:
+    # Mongo hands datetimes back naive (UTC) unless the client is tz_aware
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+queue: Optional[JobQueue] = None
+
+
+async def start_job_queue(db):
+    global queue
+    if JOB_WORKERS <= 0:
+        return None
+    queue = JobQueue(db)
+    await queue.start()
+    return queue
+
+
+async def stop_job_queue():
+    global queue
+    if queue:
+        await queue.stop()
+        queue = None
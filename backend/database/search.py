@@ -0,0 +1,287 @@
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from dotenv import load_dotenv
+from pymongo import ASCENDING, DESCENDING, TEXT
+from pymongo.collation import Collation
+from pymongo.errors import OperationFailure
+from utils.metrics import MONGO_SECONDS
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", "25"))
+SEARCH_MAX_PAGE_SIZE = int(os.getenv("SEARCH_MAX_PAGE_SIZE", "100"))
+
+# Prefix and filter queries compare strings case-insensitively; indexes only serve
+# queries with the same collation, so every search index below is built with it
+CASE_INSENSITIVE = Collation(locale="en", strength=2)
+# Sorts after every other character under the ICU collations, closing a prefix range
+PREFIX_END = "\uffff"
+
+PREFIX = "prefix"
+TEXT_MATCH = "text"
+
+
+class SearchError(ValueError):
+    pass
+
+
+class SearchSpec:
+    """What can be searched, filtered and returned for one collection"""
+
+    def __init__(self, collection: str, match_fields: List[str], text_weights: Dict[str, int],
+                 default_fields: List[str], allowed_fields: List[str], indexes: List[list]):
+        self.collection = collection
+        self.match_fields = match_fields
+        self.text_weights = text_weights
+        self.default_fields = default_fields
+        self.allowed_fields = set(default_fields) | set(allowed_fields)
+        self.indexes = indexes
+
+
+CHILDREN = SearchSpec(
+    "children",
+    match_fields=["name", "parent_name", "school"],
+    text_weights={"name": 10, "parent_name": 5, "school": 1},
+    default_fields=["name", "dob", "gender", "school", "parent_name", "teacher_name"],
+    allowed_fields=["age", "parent_mobile", "teacher_mobile", "created_at"],
+    indexes=[
+        [("school", ASCENDING), ("name", ASCENDING), ("_id", DESCENDING)],
+        [("school", ASCENDING), ("parent_name", ASCENDING), ("_id", DESCENDING)],
+        [("name", ASCENDING), ("_id", DESCENDING)],
+        [("parent_name", ASCENDING), ("_id", DESCENDING)],
+        [("school", ASCENDING), ("_id", DESCENDING)],
+        [("teacher_mobile", ASCENDING), ("_id", DESCENDING)],
+    ],
+)
+
+SESSIONS = SearchSpec(
+    "chats",
+    match_fields=["student_name", "gaurdian_name", "parent_name", "school"],
+    text_weights={"student_name": 10, "gaurdian_name": 5, "parent_name": 5, "school": 1},
+    default_fields=["session_id", "student_name", "student_dob", "student_gender", "school", "gaurdian_name",
+                    "questionnaire_name", "diagnosis"],
+    allowed_fields=["student_age", "gaurdian_role", "parent_name", "parent_mobile", "teacher_name", "teacher_mobile",
+                    "feedback", "screening_summary", "archived"],
+    indexes=[
+        [("school", ASCENDING), ("student_name", ASCENDING), ("_id", DESCENDING)],
+        [("school", ASCENDING), ("gaurdian_name", ASCENDING), ("_id", DESCENDING)],
+        [("school", ASCENDING), ("parent_name", ASCENDING), ("_id", DESCENDING)],
+        [("student_name", ASCENDING), ("_id", DESCENDING)],
+        [("gaurdian_name", ASCENDING), ("_id", DESCENDING)],
+        [("parent_name", ASCENDING), ("_id", DESCENDING)],
+        [("school", ASCENDING), ("_id", DESCENDING)],
+        [("diagnosis", ASCENDING), ("_id", DESCENDING)],
+    ],
+)
+
+
+async def _ensure_indexes(collection, spec: SearchSpec):
+    for keys in spec.indexes:
+        name = "search_" + "_".join(field.strip("_") for field, _ in keys)
+        try:
+            await collection.create_index(keys, name=name, collation=CASE_INSENSITIVE)
+        except OperationFailure as e:
+            logger.warning(f"Could not create search index {name} on {spec.collection}: {e}")
+    try:
+        # A collection has at most one text index
+        await collection.create_index([(field, TEXT) for field in spec.text_weights],
+                                      weights=spec.text_weights, name="search_text")
+    except OperationFailure as e:
+        logger.warning(f"Could not create the text index on {spec.collection}: {e}")
+
+
+async def ensure_search_indexes(ques_db, children_db):
+    await _ensure_indexes(children_db.children, CHILDREN)
+    await _ensure_indexes(ques_db["chats"], SESSIONS)
+
+
+def _projection(spec: SearchSpec, fields: Optional[str]) -> dict:
+    if not fields:
+        wanted = spec.default_fields
+    else:
+        wanted = [field.strip() for field in fields.split(",") if field.strip()]
+        unknown = [field for field in wanted if field not in spec.allowed_fields]
+        if unknown:
+            raise SearchError(f"Unknown fields {unknown}; choose from {sorted(spec.allowed_fields)}")
+    return {field: 1 for field in wanted}
+
+
+def _page_size(limit: Optional[int]) -> int:
+    return max(1, min(limit or SEARCH_PAGE_SIZE, SEARCH_MAX_PAGE_SIZE))
+
+
+def _object_id_at(value: str, end_of_day: bool = False) -> ObjectId:
+    """ObjectId bound for a YYYY-MM-DD (UTC) date; _id carries the creation time"""
+    try:
+        day = datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    except ValueError:
+        raise SearchError(f"Expected a YYYY-MM-DD date, got '{value}'")
+    return ObjectId.from_datetime(day + timedelta(days=1) if end_of_day else day)
+
+
+def _range(start, end) -> Optional[dict]:
+    bounds = {}
+    if start is not None:
+        bounds["$gte"] = start
+    if end is not None:
+        bounds["$lt"] = end
+    return bounds or None
+
+
+def _prefix(q: str) -> dict:
+    return {"$gte": q, "$lt": q + PREFIX_END}
+
+
+def _parse_prefix_cursor(spec: SearchSpec, cursor: Optional[str]) -> tuple:
+    """(match field index, value, _id) of the last result sent, encoded as "index:_id:value" """
+    if not cursor:
+        return 0, None, None
+    try:
+        index, after_id, value = cursor.split(":", 2)
+        index = int(index)
+        after_id = ObjectId(after_id)
+    except (ValueError, InvalidId):
+        raise SearchError(f"Invalid cursor '{cursor}'")
+    if not 0 <= index < len(spec.match_fields):
+        raise SearchError(f"Invalid cursor '{cursor}'")
+    return index, value, after_id
+
+
+async def _prefix_page(db, spec: SearchSpec, filters: dict, q: str, page_size: int, projection: dict,
+                       cursor: Optional[str]) -> dict:
+    """Prefix matches in match field order, each field in (value, newest _id first) order.
+
+    Every field is read through its own (field, _id) index, or (school, field, _id)
+    with a school filter, starting at the cursor, so a page reads about
+    page_size entries however many names share the prefix. A document matching
+    several fields is listed under the first one only.
+    """
+    start, after_value, after_id = _parse_prefix_cursor(spec, cursor)
+    results = []
+    for index in range(start, len(spec.match_fields)):
+        field = spec.match_fields[index]
+        conditions = [filters, {field: _prefix(q)}]
+        conditions += [{earlier: {"$not": _prefix(q)}} for earlier in spec.match_fields[:index]]
+        if index == start and after_value is not None:
+            conditions.append({field: {"$gte": after_value}})
+            conditions.append({"$nor": [{field: after_value, "_id": {"$gte": after_id}}]})
+        with MONGO_SECONDS.time(f"search.{spec.collection}.{PREFIX}"):
+            found = await db[spec.collection].find(
+                {"$and": conditions}, {**projection, field: 1}, sort=[(field, ASCENDING), ("_id", DESCENDING)],
+                limit=page_size + 1 - len(results), collation=CASE_INSENSITIVE,
+            ).to_list(length=None)
+        results += [(index, doc) for doc in found]
+        if len(results) > page_size:
+            break
+    next_cursor = None
+    if len(results) > page_size:
+        index, last = results[page_size - 1]
+        next_cursor = f"{index}:{last['_id']}:{last[spec.match_fields[index]]}"
+    page = []
+    for index, doc in results[:page_size]:
+        if spec.match_fields[index] not in projection:
+            doc.pop(spec.match_fields[index], None)
+        doc["_id"] = str(doc["_id"])
+        page.append(doc)
+    return {"results": page, "next_cursor": next_cursor}
+
+
+async def search(db, spec: SearchSpec, filters: dict, q: Optional[str] = None, match: str = PREFIX,
+                 limit: Optional[int] = None, cursor: Optional[str] = None, fields: Optional[str] = None) -> dict:
+    """One page of matches: by name for prefix search, best first for text search, newest first for filters alone.
+
+    Prefix search matches the start of any of the spec's match fields and pages
+    through each field's index in name order. Filter-only listing pages by _id.
+    Both resume from a cursor, so a deep page costs about what the first does.
+    Text search matches whole words (stemmed) and pages by offset in relevance
+    order. next_cursor is None on the last page.
+    """
+    if match not in (PREFIX, TEXT_MATCH):
+        raise SearchError(f"match must be '{PREFIX}' or '{TEXT_MATCH}'")
+    page_size = _page_size(limit)
+    projection = _projection(spec, fields)
+    query = dict(filters)
+    q = (q or "").strip()
+    options = {}
+
+    if match == PREFIX and q:
+        return await _prefix_page(db, spec, filters, q, page_size, projection, cursor)
+    if match == TEXT_MATCH and q:
+        try:
+            offset = int(cursor or 0)
+        except ValueError:
+            raise SearchError(f"Invalid cursor '{cursor}'")
+        query["$text"] = {"$search": q}
+        projection["score"] = {"$meta": "textScore"}
+        sort = [("score", {"$meta": "textScore"}), ("_id", DESCENDING)]
+        options["skip"] = offset
+    else:
+        if cursor:
+            try:
+                after = ObjectId(cursor)
+            except InvalidId:
+                raise SearchError(f"Invalid cursor '{cursor}'")
+            bounds = dict(query.get("_id", {}))
+            bounds["$lt"] = min(bounds.get("$lt", after), after)
+            query["_id"] = bounds
+        sort = [("_id", DESCENDING)]
+        options["collation"] = CASE_INSENSITIVE
+
+    with MONGO_SECONDS.time(f"search.{spec.collection}.{match}"):
+        results = await db[spec.collection].find(query, projection, sort=sort, limit=page_size + 1,
+                                                 **options).to_list(length=None)
+    more = len(results) > page_size
+    results = results[:page_size]
+    next_cursor = None
+    if more:
+        next_cursor = str(options["skip"] + page_size) if "skip" in options else str(results[-1]["_id"])
+    for result in results:
+        result["_id"] = str(result["_id"])
+    return {"results": results, "next_cursor": next_cursor}
+
+
+async def search_children(db, q: Optional[str] = None, match: str = PREFIX, school: Optional[str] = None,
+                          teacher_mobile: Optional[str] = None, dob_from: Optional[str] = None,
+                          dob_to: Optional[str] = None, **page) -> dict:
+    """Children by name, guardian or school, optionally within one school / teacher and a date of birth range"""
+    filters = {}
+    if school:
+        filters["school"] = school
+    if teacher_mobile:
+        filters["teacher_mobile"] = teacher_mobile
+    # dob is stored as YYYY-MM-DD, so string order is date order; dob_to is inclusive
+    dob = _range(dob_from, dob_to + PREFIX_END if dob_to else None)
+    if dob:
+        filters["dob"] = dob
+    return await search(db, CHILDREN, filters, q, match, **page)
+
+
+async def search_sessions(db, q: Optional[str] = None, match: str = PREFIX, school: Optional[str] = None,
+                          diagnosis: Optional[str] = None, diagnosed: Optional[bool] = None,
+                          questionnaire: Optional[str] = None, started_from: Optional[str] = None,
+                          started_to: Optional[str] = None, **page) -> dict:
+    """Screening sessions by student, guardian or school, with diagnosis and start date (UTC, inclusive) filters.
+
+    Sessions still held in the write-behind buffer show up after its next flush.
+    """
+    filters = {}
+    if school:
+        filters["school"] = school
+    if questionnaire:
+        filters["questionnaire_name"] = questionnaire
+    if diagnosis:
+        filters["diagnosis"] = diagnosis
+    elif diagnosed is not None:
+        filters["diagnosis"] = {"$nin": [None, ""]} if diagnosed else {"$in": [None, ""]}
+    started = _range(_object_id_at(started_from) if started_from else None,
+                     _object_id_at(started_to, end_of_day=True) if started_to else None)
+    if started:
+        filters["_id"] = started
+    return await search(db, SESSIONS, filters, q, match, **page)
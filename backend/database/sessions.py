@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+from database import write_buffer
+from database.archive import restore_archived
+from database.bundle import get_bundle, get_bundled_questionnaire
+from database.chatbot import get_questionair
+from utils.metrics import MONGO_SECONDS, SESSION_REHYDRATIONS, SESSION_REHYDRATION_SECONDS
+from utils.utils import questions_asked, questions, last_question_index, status, item_bank_sessions, session_schools
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+ITEM_BANK_NAME = os.getenv("ITEM_BANK_NAME", "Item Bank")
+
+# Only what is needed to rebuild the in-memory state, not the messages
+REHYDRATE_PROJECTION = {"session_id": 1, "questionnaire_name": 1, "instruments": 1, "feedback": 1, "archived": 1, "school": 1,
+                        "conversation.role": 1, "conversation.question_index": 1, "conversation.turn_id": 1}
+
+# Session loads in progress, so concurrent requests for one session share a single read
+_loading: Dict[str, asyncio.Future] = {}
+
+
+async def load_questionnaire(db, name: str) -> Optional[dict]:
+    """Questions of a questionnaire: the item bank, the compiled bundle, or the database without one"""
+    if name == ITEM_BANK_NAME:
+        bundle = get_bundle()
+        return {"questions": bundle.item_bank()} if bundle else None
+    return get_bundled_questionnaire(name) or await get_questionair(db, name)
+
+
+def restore_state(session_id: str, chat: dict, questionnaire: dict):
+    """Rebuild the session's question state from the bot turns already in its conversation.
+
+    Mirrors next_question: every asked index (elaboration prompts are negative)
+    is in questions_asked, last_question_index is the last real question, and a
+    bot turn without a question or any feedback means the questionnaire is done.
+    """
+    asked = set()
+    last_index = 0
+    complete = "feedback" in chat
+    for turn in chat.get("conversation") or []:
+        if turn.get("role") != "bot":
+            continue
+        index = turn.get("question_index")
+        if index is None:
+            complete = True
+            continue
+        asked.add(index)
+        if index >= 0:
+            last_index = index
+    questions[session_id] = questionnaire["questions"]
+    questions_asked[session_id] = asked
+    last_question_index[session_id] = last_index
+    status[session_id] = complete
+    if chat.get("school"):
+        session_schools[session_id] = chat["school"]
+    if chat.get("questionnaire_name") == ITEM_BANK_NAME:
+        item_bank_sessions[session_id] = chat.get("instruments")
+
+
+async def _rehydrate(db, session_id: str) -> bool:
+    start = time.perf_counter()
+    try:
+        with MONGO_SECONDS.time("rehydrate_session"):
+            chat = await db["chats"].find_one({"session_id": session_id}, REHYDRATE_PROJECTION)
+        chat = await restore_archived(db, chat)
+        if write_buffer.buffer:
+            # A session started moments ago may only exist in the write-behind buffer
+            chat = write_buffer.buffer.overlay(session_id, chat)
+        if not chat or not chat.get("questionnaire_name"):
+            SESSION_REHYDRATIONS.inc("missing")
+            return False
+        questionnaire = await load_questionnaire(db, chat["questionnaire_name"])
+        if not questionnaire:
+            logger.warning(f"Cannot rehydrate session {session_id}: questionnaire '{chat['questionnaire_name']}' not found")
+            SESSION_REHYDRATIONS.inc("missing")
+            return False
+        if not questions.get(session_id):
+            restore_state(session_id, chat, questionnaire)
+        SESSION_REHYDRATIONS.inc("loaded")
+        logger.info(f"Rehydrated session {session_id} ({len(questions_asked[session_id])} questions asked)")
+        return True
+    except Exception:
+        SESSION_REHYDRATIONS.inc("error")
+        raise
+    finally:
+        SESSION_REHYDRATION_SECONDS.observe(time.perf_counter() - start)
+        _loading.pop(session_id, None)
+
+
+async def ensure_session(db, session_id: str) -> bool:
+    """Make sure the session's question state is in memory, loading it from its chat after a restart.
+
+    Returns False when there is no such session. Requests arriving while a load
+    is running wait for that load instead of starting another.
+    """
+    if questions.get(session_id):
+        return True
+    loading = _loading.get(session_id)
+    if loading is None:
+        loading = _loading[session_id] = asyncio.ensure_future(_rehydrate(db, session_id))
+    else:
+        SESSION_REHYDRATIONS.inc("coalesced")
+    # One waiter giving up (a client disconnect) must not cancel the load for the others
+    return await asyncio.shield(loading)
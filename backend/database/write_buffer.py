@@ -0,0 +1,251 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from bson import json_util
+from dotenv import load_dotenv
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from utils.metrics import MONGO_SECONDS, CHAT_WRITE_BATCH_SESSIONS, CHAT_WRITE_FAILURES, CHAT_WRITES_DEAD_LETTERED
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Opt-in: acknowledged turns are only in memory until the next flush, so a crash loses them
+CHAT_WRITE_BEHIND = os.getenv("CHAT_WRITE_BEHIND", "0") == "1"
+CHAT_WRITE_BEHIND_INTERVAL = float(os.getenv("CHAT_WRITE_BEHIND_INTERVAL", "0.25"))
+CHAT_WRITE_BEHIND_MAX_BATCH = int(os.getenv("CHAT_WRITE_BEHIND_MAX_BATCH", "500"))
+# Failed writes of a session that Mongo rejected this many times go to the dead-letter collection
+CHAT_WRITE_BEHIND_MAX_ATTEMPTS = int(os.getenv("CHAT_WRITE_BEHIND_MAX_ATTEMPTS", "5"))
+# Writes still buffered when the process stops without reaching Mongo; replayed on the next start
+CHAT_WRITE_BEHIND_SPILL = os.getenv("CHAT_WRITE_BEHIND_SPILL", "chat_writes_spill.jsonl")
+DEAD_LETTER_COLLECTION = "chat_write_failures"
+MAX_BACKOFF = 5.0
+
+
+class _SessionWrites:
+    """Turns and top-level fields waiting to be written for one session"""
+
+    __slots__ = ("turns", "fields", "enqueued_at", "attempts")
+
+    def __init__(self):
+        self.turns = []
+        self.fields = {}
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+
+
+class ChatWriteBuffer:
+    """Write-behind queue for chat documents.
+
+    Appends are grouped per session and flushed across sessions in one
+    unordered bulk_write every interval. A failed batch is requeued ahead of
+    newer writes (at-least-once). Every turn carries a unique turn_id and is
+    appended with $addToSet, so retrying a batch that partly landed does not
+    duplicate turns. A session whose write Mongo keeps rejecting is moved to
+    the dead-letter collection instead of blocking the flush loop, and writes
+    that cannot be flushed at shutdown are spilled to a file and replayed.
+    """
+
+    def __init__(self, db, interval: float = CHAT_WRITE_BEHIND_INTERVAL, max_batch: int = CHAT_WRITE_BEHIND_MAX_BATCH,
+                 spill_path: Optional[str] = CHAT_WRITE_BEHIND_SPILL):
+        self.db = db
+        self.interval = interval
+        self.max_batch = max_batch
+        self.spill_path = spill_path
+        self.pending: Dict[str, _SessionWrites] = {}
+        self.inflight: Dict[str, _SessionWrites] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        # One bulk_write at a time, so a session is never in two batches at once
+        self._lock = asyncio.Lock()
+
+    def _writes(self, session_id: str) -> _SessionWrites:
+        writes = self.pending.get(session_id)
+        if writes is None:
+            writes = self.pending[session_id] = _SessionWrites()
+        return writes
+
+    def append_turn(self, session_id: str, turn: dict):
+        self._writes(session_id).turns.append(turn)
+
+    def set_fields(self, session_id: str, fields: dict):
+        self._writes(session_id).fields.update(fields)
+
+    def overlay(self, session_id: str, chat: Optional[dict]) -> Optional[dict]:
+        """Apply writes that have not reached Mongo yet to a chat read from it"""
+        buffered = [w for w in (self.inflight.get(session_id), self.pending.get(session_id)) if w]
+        if not buffered:
+            return chat
+        if chat is None:
+            chat = {"session_id": session_id, "conversation": []}
+        conversation = list(chat.get("conversation", []))
+        # An in-flight batch may already be in the document we read
+        seen = {turn.get("turn_id") for turn in conversation}
+        for writes in buffered:
+            conversation.extend(turn for turn in writes.turns if turn["turn_id"] not in seen)
+            chat.update(writes.fields)
+        chat["conversation"] = conversation
+        return chat
+
+    def depth(self) -> int:
+        return sum(len(w.turns) + bool(w.fields) for w in list(self.pending.values()) + list(self.inflight.values()))
+
+    def lag(self) -> float:
+        """Age in seconds of the oldest write not yet acknowledged by Mongo"""
+        oldest = [w.enqueued_at for w in list(self.pending.values()) + list(self.inflight.values())]
+        return time.monotonic() - min(oldest) if oldest else 0.0
+
+    def _requeue(self, session_id: str, writes: _SessionWrites):
+        """Put failed writes back ahead of anything buffered for the session since"""
+        newer = self.pending.pop(session_id, None)
+        if newer:
+            writes.turns.extend(newer.turns)
+            writes.fields.update(newer.fields)
+        self.pending[session_id] = writes
+
+    async def _dead_letter(self, session_id: str, writes: _SessionWrites, error: str):
+        logger.error(f"Giving up on {len(writes.turns)} chat turns of session {session_id} after "
+                     f"{writes.attempts} rejected writes, moving them to {DEAD_LETTER_COLLECTION}: {error}")
+        CHAT_WRITES_DEAD_LETTERED.inc()
+        try:
+            with MONGO_SECONDS.time("chat_write_behind.dead_letter"):
+                await self.db[DEAD_LETTER_COLLECTION].insert_one({
+                    "session_id": session_id, "turns": writes.turns, "fields": writes.fields, "error": error,
+                    "failed_at": datetime.now(timezone.utc),
+                })
+        except Exception as e:
+            logger.error(f"Error dead-lettering chat writes of session {session_id}, spilling them: {e}")
+            self._spill({session_id: writes})
+
+    async def flush(self) -> bool:
+        """Write one batch of pending sessions; returns False if (part of) the batch was requeued"""
+        async with self._lock:
+            if not self.pending:
+                return True
+            return await self._write({sid: self.pending.pop(sid) for sid in list(self.pending)[:self.max_batch]})
+
+    async def flush_session(self, session_id: str) -> bool:
+        """Write one session's buffered writes now, before a direct update of its chat document"""
+        async with self._lock:
+            if session_id not in self.pending:
+                return True
+            return await self._write({session_id: self.pending.pop(session_id)})
+
+    async def _write(self, batch: Dict[str, _SessionWrites]) -> bool:
+        self.inflight.update(batch)
+        ops = []
+        for session_id, writes in batch.items():
+            update = {}
+            if writes.turns:
+                update["$addToSet"] = {"conversation": {"$each": writes.turns}}
+            if writes.fields:
+                update["$set"] = writes.fields
+            ops.append(UpdateOne({"session_id": session_id}, update, upsert=True))
+        try:
+            with MONGO_SECONDS.time("chat_write_behind.bulk_write"):
+                await self.db["chats"].bulk_write(ops, ordered=False)
+            CHAT_WRITE_BATCH_SESSIONS.observe(len(ops))
+            return True
+        except BulkWriteError as e:
+            # Unordered: every other write landed; only the rejected sessions are retried
+            errors = {error["index"]: error.get("errmsg", "") for error in e.details.get("writeErrors", [])}
+            logger.error(f"{len(errors)} of {len(ops)} buffered chat writes were rejected, requeueing them")
+            CHAT_WRITE_FAILURES.inc()
+            sessions = list(batch)
+            for index, error in errors.items():
+                writes = batch[sessions[index]]
+                writes.attempts += 1
+                if writes.attempts >= CHAT_WRITE_BEHIND_MAX_ATTEMPTS:
+                    await self._dead_letter(sessions[index], writes, error)
+                else:
+                    self._requeue(sessions[index], writes)
+            return not errors
+        except Exception as e:
+            # Mongo unreachable: nothing is known to be wrong with the writes, keep retrying them
+            logger.error(f"Error flushing {len(ops)} buffered chat writes, requeueing: {e}")
+            CHAT_WRITE_FAILURES.inc()
+            for session_id, writes in batch.items():
+                self._requeue(session_id, writes)
+            return False
+        finally:
+            for session_id in batch:
+                self.inflight.pop(session_id, None)
+
+    def _spill(self, sessions: Dict[str, _SessionWrites]):
+        with open(self.spill_path, "a", encoding="utf-8") as f:
+            for session_id, writes in sessions.items():
+                f.write(json_util.dumps({"session_id": session_id, "turns": writes.turns, "fields": writes.fields}) + "\n")
+
+    def restore_spill(self) -> int:
+        """Queue the writes spilled by an earlier shutdown; returns how many sessions were restored"""
+        if not self.spill_path or not os.path.exists(self.spill_path):
+            return 0
+        restored = 0
+        with open(self.spill_path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json_util.loads(line)
+                writes = self._writes(record["session_id"])
+                writes.turns = record["turns"] + writes.turns
+                writes.fields = {**record["fields"], **writes.fields}
+                restored += 1
+        os.remove(self.spill_path)
+        logger.info(f"Requeued spilled chat writes of {restored} sessions from {self.spill_path}")
+        return restored
+
+    async def _run(self):
+        backoff = self.interval
+        while not self._stopping:
+            await asyncio.sleep(backoff)
+            ok = True
+            while ok and self.pending:
+                ok = await self.flush()
+            backoff = self.interval if ok else min(backoff * 2, MAX_BACKOFF)
+
+    def start(self):
+        self.restore_spill()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self, attempts: int = 5):
+        """Stop the flusher and drain everything still buffered"""
+        self._stopping = True
+        if self._task:
+            await self._task
+        for _ in range(attempts):
+            while self.pending:
+                if not await self.flush():
+                    break
+            if not self.pending:
+                return
+            await asyncio.sleep(self.interval)
+        if not self.spill_path:
+            logger.error(f"Dropping {self.depth()} buffered chat writes after {attempts} failed flushes")
+            return
+        logger.error(f"Spilling {self.depth()} buffered chat writes to {self.spill_path} after {attempts} failed flushes")
+        self._spill(self.pending)
+        self.pending = {}
+
+
+buffer: Optional[ChatWriteBuffer] = None
+
+
+def start_write_buffer(db):
+    global buffer
+    if not CHAT_WRITE_BEHIND:
+        return None
+    buffer = ChatWriteBuffer(db)
+    buffer.start()
+    return buffer
+
+
+async def stop_write_buffer():
+    global buffer
+    if buffer:
+        await buffer.stop()
+        buffer = None
@@ -1,8 +1,13 @@
 import logging
 import os
 
-if not os.path.exists("access.log"):
-    with open("access.log", "a") as f:
+# Request log; contains request bodies, so it stays out of the repository (see .gitignore)
+ACCESS_LOG = os.getenv("ACCESS_LOG", "access.log")
+
+if os.path.dirname(ACCESS_LOG):
+    os.makedirs(os.path.dirname(ACCESS_LOG), exist_ok=True)
+if not os.path.exists(ACCESS_LOG):
+    with open(ACCESS_LOG, "a") as f:
         pass
 
 LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
@@ -10,8 +15,8 @@ logging.basicConfig(
     level=logging.INFO,
     format=LOG_FORMAT,
     handlers=[
-        logging.FileHandler("access.log", mode='a'),
+        logging.FileHandler(ACCESS_LOG, mode='a'),
         logging.StreamHandler()
     ]
 )
-logger = logging.getLogger("access_logger")
\ No newline at end of file
+logger = logging.getLogger("access_logger")
@@ -4,16 +4,29 @@ from fastapi.middleware.cors import CORSMiddleware
 from starlette.requests import Request
 from starlette.responses import Response
 from logging_config import logger
-from database.chatbot import connect_questionnaire_db
+from database.chatbot import connect_questionnaire_db, get_model
 from database.users import connect_users_db
 from database.children import connect_children_db
-from routers import chat, questionnaire, getter, auth, psychologist, parent, teacher
+from database.write_buffer import start_write_buffer, stop_write_buffer
+from database.archive import start_archiver, stop_archiver
+from database.jobs import start_job_queue, stop_job_queue
+from database.search import ensure_search_indexes
+from utils import embedding_pool, events, http_cache, llm_transport, rate_limit
+from utils.metrics import HTTP_REQUESTS, HTTP_LATENCY
+from routers import chat, chat_ws, questionnaire, getter, auth, psychologist, parent, teacher, metrics, admin
 import os
+import asyncio
+import time
 
 
 
 app = FastAPI()
 
+# Registered before CORS so cached and 304 responses still get the CORS headers
+app.middleware("http")(http_cache.middleware)
+# Inside CORS too, so browsers can read the 429 and its Retry-After
+app.middleware("http")(rate_limit.middleware)
+
 # Add CORS middleware BEFORE including routers
 app.add_middleware(
     CORSMiddleware,
@@ -23,29 +36,64 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After"],
 )
 
+# Bulk uploads are streamed to their handler and full of children's names and mobiles:
+# their bodies are neither buffered here nor written to the access log
+UNLOGGED_BODIES = ("/api/teacher/import-children",)
+
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
     ip = request.client.host
     method = request.method
     url = request.url.path
-    body = await request.body()
-    logger.info(f"IP: {ip} | Method: {method} | URL: {url} | Data Sent: {body.decode('utf-8') if method == 'POST' else 'N/A'}")
+    if url.startswith(UNLOGGED_BODIES):
+        sent = f"<{request.headers.get('content-length', 'streamed')} bytes not logged>"
+    else:
+        body = await request.body()
+        sent = body.decode('utf-8') if method == 'POST' else 'N/A'
+    logger.info(f"IP: {ip} | Method: {method} | URL: {url} | Data Sent: {sent}")
     response: Response = await call_next(request)
     if method == "GET":
         logger.info(f"IP: {ip} | Method: {method} | URL: {url} | Data Fetched: {response.body.decode('utf-8') if hasattr(response, 'body') else 'N/A'}")
     return response
 
-@app.on_event("startup")
-async def startup_event():
-    ques_db = await connect_questionnaire_db()
+def route_label(request: Request) -> str:
+    """Full route template of the matched route, e.g. /api/chat/{session_id}"""
+    route = request.scope.get("route")
+    if route is None:
+        return "unmatched"
+    # Newer FastAPI matches routers included with a prefix against the
+    # router-local template, so rebuild the prefix from the leading segments
+    # of the request path that the template does not cover
+    template = route.path.strip("/")
+    segments = request.scope["path"].strip("/").split("/")
+    covered = len(template.split("/")) if template else 0
+    prefix = "/".join(segments[:len(segments) - covered])
+    return "/" + "/".join(p for p in (prefix, template) if p)
+
+@app.middleware("http")
+async def record_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    status_code = 500
+    try:
+        response: Response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        # Label by route template, not raw path, to keep cardinality bounded
+        path = route_label(request)
+        HTTP_REQUESTS.inc(path, request.method, str(status_code))
+        HTTP_LATENCY.observe(time.perf_counter() - start, path, request.method)
+
+def attach_databases(ques_db, users_db, children_db):
+    """Hand the database handles to the routers"""
     getter.router.db = ques_db
     chat.router.db = ques_db
+    chat_ws.router.db = ques_db
     questionnaire.router.db = ques_db
-    users_db = await connect_users_db()
     auth.router.db = users_db
-    children_db = await connect_children_db()
     psychologist.router.dbq = ques_db
     psychologist.router.dbc = children_db
     psychologist.router.dbu = users_db
@@ -53,11 +101,41 @@ async def startup_event():
     parent.router.dbc = children_db
     teacher.router.dbu = users_db
     teacher.router.dbc = children_db
+    admin.router.db = ques_db
+
+@app.on_event("startup")
+async def startup_event():
+    ques_db = await connect_questionnaire_db()
+    users_db = await connect_users_db()
+    children_db = await connect_children_db()
+    attach_databases(ques_db, users_db, children_db)
+    await ensure_search_indexes(ques_db, children_db)
+    await rate_limit.start_rate_limiter(ques_db)
+    start_write_buffer(ques_db)
+    events.start_feed(ques_db)
+    await start_archiver(ques_db)
+    await start_job_queue(ques_db)
+    if not os.getenv("FAKE_MODELS"):
+        await llm_transport.warm_up()
+    if not await embedding_pool.start_pool():
+        await asyncio.to_thread(get_model)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    events.stop_feed()
+    stop_archiver()
+    await stop_job_queue()
+    await llm_transport.close()
+    await stop_write_buffer()
+    embedding_pool.stop_pool()
 
 app.include_router(getter.router, prefix="/api/get", tags=["Getter"])
 app.include_router(auth.router, prefix="/api/auth", tags=["Auth"])
 app.include_router(chat.router, prefix="/api/chat", tags=["Chat"])
+app.include_router(chat_ws.router, prefix="/api/chat", tags=["Chat"])
 app.include_router(questionnaire.router, prefix="/api/questionnaire", tags=["Questionnaire"])
 app.include_router(parent.router, prefix="/api/parent", tags=["Parent"])
 app.include_router(teacher.router, prefix="/api/teacher", tags=["Teacher"])
-app.include_router(psychologist.router, prefix="/api/psychologist", tags=["Psychologist"])
\ No newline at end of file
+app.include_router(psychologist.router, prefix="/api/psychologist", tags=["Psychologist"])
+app.include_router(metrics.router, prefix="/api", tags=["Metrics"])
+app.include_router(admin.router, prefix="/api/admin", tags=["Admin"])
\ No newline at end of file
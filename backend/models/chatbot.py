@@ -1,11 +1,13 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import Optional, List
 
 class ChatRequest(BaseModel):
     session_id: str
     question: str
     model: str = "Mistral"
     age: int = 15
+    # Index of the turn in the session; a retry with the same index is not answered twice
+    turn: Optional[int] = None
 
 class QuestionnaireStartRequest(BaseModel):
     session_id: Optional[str] = None
@@ -19,6 +21,8 @@ class QuestionnaireStartRequest(BaseModel):
     teacher_mobile: Optional[str] = None
     questionnaire_name: str
     tnc_accepted: bool
+    # Only used when questionnaire_name is the item bank
+    instruments: Optional[List[str]] = None
 
 class EndRequest(BaseModel):
     session_id: str
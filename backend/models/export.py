@@ -0,0 +1,6 @@
+from pydantic import BaseModel
+from typing import List
+
+class ExportRequest(BaseModel):
+    tables: List[str] = ["sessions", "turns", "children"]
+    pseudonymise: bool = True
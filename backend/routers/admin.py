@@ -0,0 +1,90 @@
+from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import FileResponse
+from utils.profiling import list_profiles, load_profile
+from utils.users import require_admin
+from database import export, jobs
+from models.export import ExportRequest
+from datetime import datetime
+from typing import Optional
+import logging
+import os
+import uuid
+
+router = APIRouter(dependencies=[Depends(require_admin)])
+logger = logging.getLogger(__name__)
+
+@router.get("/profiles")
+async def get_profiles():
+    """List captured request profiles, newest first"""
+    return {"profiles": list_profiles()}
+
+@router.get("/profiles/{profile_id}")
+async def get_profile(profile_id: str):
+    """Get the span breakdown and sampled stacks of one profile"""
+    profile = load_profile(profile_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail=f"Profile '{profile_id}' not found")
+    return {"profile": profile}
+
+@router.get("/jobs")
+async def get_jobs(status: Optional[str] = None, type: Optional[str] = None, limit: int = 50):
+    """Recent background jobs, newest first, with the number of jobs in each status"""
+    query = {k: v for k, v in (("status", status), ("type", type)) if v}
+    recent = await router.db["jobs"].find(query, {"payload": 1, "type": 1, "status": 1, "attempts": 1, "error": 1,
+                                                   "created_at": 1, "run_at": 1, "finished_at": 1}) \
+        .sort("_id", -1).limit(min(limit, 500)).to_list(length=None)
+    for job in recent:
+        job["_id"] = str(job["_id"])
+    counts = await router.db["jobs"].aggregate([{"$group": {"_id": "$status", "count": {"$sum": 1}}}]).to_list(length=None)
+    return {
+        "jobs": recent,
+        "counts": {c["_id"]: c["count"] for c in counts},
+        "lag_seconds": jobs.queue.lag() if jobs.queue else None,
+    }
+
+@router.post("/exports")
+async def start_export(req: ExportRequest):
+    """Queue a research export of sessions, turns and children as Parquet files; poll /exports/{export_id}"""
+    if export.pq is None:
+        raise HTTPException(status_code=501, detail="Research exports need pyarrow on the server")
+    if set(req.tables) - set(export.TABLES):
+        raise HTTPException(status_code=400, detail=f"Unknown tables; choose from {sorted(export.TABLES)}")
+    if req.pseudonymise and not export.EXPORT_PSEUDONYM_KEY:
+        raise HTTPException(status_code=400, detail="Pseudonymised exports need EXPORT_PSEUDONYM_KEY set on the server")
+    export_id = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    await jobs.enqueue(router.db, "research_export",
+                       {"export_id": export_id, "tables": req.tables, "pseudonymise": req.pseudonymise},
+                       key=f"export:{export_id}")
+    return {"export_id": export_id}
+
+@router.get("/exports")
+async def get_exports():
+    """Research exports with their status and files, newest first"""
+    return {"exports": export.list_exports()}
+
+@router.get("/exports/{export_id}")
+async def get_export(export_id: str):
+    try:
+        manifest = export.load_manifest(export.export_path(export_id))
+    except export.ExportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not manifest:
+        # Queued exports have no manifest until a worker starts them
+        job = await router.db["jobs"].find_one({"key": f"export:{export_id}"}, {"status": 1, "error": 1})
+        if not job:
+            raise HTTPException(status_code=404, detail=f"Export '{export_id}' not found")
+        return {"export_id": export_id, "status": job["status"], "error": job.get("error")}
+    return {"export_id": export_id, **manifest}
+
+@router.get("/exports/{export_id}/{table}/{file_name}")
+async def download_export_file(export_id: str, table: str, file_name: str):
+    """One finished Parquet file of an export"""
+    try:
+        manifest = export.load_manifest(export.export_path(export_id))
+    except export.ExportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Only files the manifest lists as finished, which also keeps the path inside the export
+    if not manifest or file_name not in {f["file"] for f in manifest["files"].get(table, [])}:
+        raise HTTPException(status_code=404, detail=f"No finished file '{table}/{file_name}' in export '{export_id}'")
+    return FileResponse(os.path.join(export.export_path(export_id), table, file_name),
+                        media_type="application/vnd.apache.parquet", filename=f"{export_id}-{table}-{file_name}")
@@ -30,6 +30,9 @@ async def login(user: UserLogin):
         "mobile": found["mobile"],
         "user_id": str(found["_id"])
     }
+    if found.get("school"):
+        # Lets the rate limiter count teachers against their school without a lookup
+        token_data["school"] = found["school"]
     access_token = create_access_token(token_data)
     user_info = {k: v for k, v in found.items() if k not in ['password', '_id']}
     # print(user_info)
@@ -59,6 +62,8 @@ async def refresh_token(current_user: dict = Depends(get_current_user)):
         "mobile": current_user["mobile"],
         "user_id": str(current_user["_id"])
     }
+    if current_user.get("school"):
+        token_data["school"] = current_user["school"]
     new_token = create_access_token(token_data)
     
     return {
@@ -1,17 +1,273 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Header, Request
 from fastapi.responses import StreamingResponse
 from models.chatbot import ChatRequest
 from database.chatbot import get_chat, get_embedding, store_chat_response
 from utils.rag_chain import get_chain
-from utils.utils import MODELS, questions_asked, questions, last_question_index, status
+from utils import speculation
+from utils.utils import MODELS, questions_asked, questions, last_question_index, status, item_bank_sessions, turn_results
+from utils.ann_index import get_item_bank_index
+from database.bundle import get_bundle
+from database.sessions import ensure_session
+from utils.metrics import SIM_SEARCH_SECONDS, LLM_TTFT_SECONDS, LLM_GENERATION_SECONDS, ACTIVE_STREAMS, STREAMS_CANCELLED, TOKENS_SAVED, CONTEXT_SELECTION_COMPARED, TURNS_DEDUPLICATED
+from utils.profiling import start_profile, finish_profile, span
+from utils.context_embedding import context_embedding, full_context_text, CONTEXT_EMBEDDING_MODE, CONTEXT_EMBEDDING_COMPARE
+from typing import Optional
+import asyncio
 import json
 import logging
+import os
+import time
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+DISCONNECT_POLL_INTERVAL = float(os.getenv("DISCONNECT_POLL_INTERVAL", "0.5"))
+# Generation budget of the HuggingFace models, used to estimate tokens saved on cancel
+LLM_MAX_NEW_TOKENS = int(os.getenv("LLM_MAX_NEW_TOKENS", "128"))
+# How long a finished turn can be replayed to a client retrying with the same idempotency key
+TURN_RESULT_TTL = float(os.getenv("TURN_RESULT_TTL", "300"))
+# How long a turn keeps generating after its last client left, waiting for a retry; 0 stops it at once
+TURN_RETRY_GRACE = float(os.getenv("TURN_RETRY_GRACE", "5"))
+
+# Asked after a short answer, under the negative index of the question it follows up
+ELABORATE_QUESTION = "Can you please elaborate on that?"
+
+_background_tasks = set()
+
+class ClientDisconnected(Exception):
+    pass
+
+def _log_background_error(task):
+    if not task.cancelled() and task.exception():
+        logger.error(f"Background task failed: {task.exception()}")
+
+def run_in_background(coro):
+    """Run a coroutine that must finish even if the request task is cancelled"""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    task.add_done_callback(_log_background_error)
+    return task
+
+async def wait_for_disconnect(http_request: Request):
+    while not await http_request.is_disconnected():
+        await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+
+async def until_disconnected_call(coro, watcher):
+    """Await coro, cancelling it as soon as the watcher sees the client go away"""
+    task = asyncio.ensure_future(coro)
+    try:
+        done, _ = await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        # Do not leave the upstream call running after the request task is cancelled.
+        # Awaiting it here would be cancelled again by the enclosing cancel scope.
+        task.cancel()
+        raise
+    if task not in done:
+        task.cancel()
+        await asyncio.wait({task})
+        raise ClientDisconnected()
+    return task.result()
+
+async def until_disconnected(stream, watcher):
+    """Iterate an upstream stream until it ends or the client disconnects, then close it"""
+    iterator = stream.__aiter__()
+    cancelled = False
+    try:
+        while True:
+            try:
+                item = await until_disconnected_call(iterator.__anext__(), watcher)
+            except StopAsyncIteration:
+                return
+            except asyncio.CancelledError:
+                # The cancelled __anext__ unwinds the upstream generator itself;
+                # closing it now would fail while it is still running
+                cancelled = True
+                raise
+            yield item
+    finally:
+        if not cancelled and hasattr(iterator, "aclose"):
+            await iterator.aclose()
+
+class StreamedTurn:
+    """One answer being generated, buffered so retries and reconnects can follow or replay it"""
+
+    def __init__(self, turn, model: str):
+        self.turn = turn
+        self.model = model
+        self.chunks = []
+        self.done = False
+        self.result = None
+        self.task: Optional[asyncio.Task] = None
+        self.grace: Optional[asyncio.TimerHandle] = None
+        self.followers = 0
+        self.expires_at = None
+        self._updated = asyncio.Event()
+
+    def append(self, chunk: str):
+        self.chunks.append(chunk)
+        self._updated.set()
+
+    def finish(self, result: dict):
+        self.result = result
+        self.done = True
+        self.expires_at = time.monotonic() + TURN_RESULT_TTL
+        self._updated.set()
+
+    @property
+    def failed(self) -> bool:
+        """Finished without a whole answer: cut off or errored, so a retry should generate again"""
+        return self.done and bool(self.result.get("interrupted") or "error" in self.result)
+
+    def keep_alive(self):
+        """A client is following the turn again: stop any pending cancellation"""
+        if self.grace:
+            self.grace.cancel()
+            self.grace = None
+
+    def cancel_later(self, delay: float):
+        if not self.done and self.task and not self.grace:
+            if delay <= 0:
+                self.task.cancel()
+            else:
+                self.grace = asyncio.get_running_loop().call_later(delay, self.task.cancel)
+
+    async def follow(self, offset: int = 0):
+        """Yield (offset, chunk) from offset on until the answer is complete"""
+        while True:
+            while offset < len(self.chunks):
+                yield offset, self.chunks[offset]
+                offset += 1
+            if self.done:
+                return
+            self._updated.clear()
+            if offset == len(self.chunks) and not self.done:
+                await self._updated.wait()
+
+def forget_failed_turn(cache_key: str, streamed: StreamedTurn):
+    """Drop a turn that ended without a whole answer, so a retry with its key is not served the remains"""
+    if (streamed.failed or not streamed.done) and turn_results.get(cache_key) is streamed:
+        del turn_results[cache_key]
+
+def prune_turn_results():
+    now = time.monotonic()
+    for key in [k for k, t in turn_results.items() if t.done and t.expires_at < now]:
+        turn_results.pop(key, None)
+
+async def generate_turn(db, request: ChatRequest, chat_history: Optional[dict], streamed: StreamedTurn,
+                        profile_header: Optional[str] = None):
+    """Store the user message, pick the next question and stream the answer into streamed.
+
+    chat_history is the history before this turn (read from Mongo when None) and
+    is brought up to date with the user message and the answer. Profiling
+    starts here rather than in the request, so it always ends with the turn.
+    """
+    llm = MODELS[request.model]
+    profile = start_profile("chat_stream", profile_header)
+    full_answer = ""
+    best_question_index, best_question = None, None
+    conversation = []
+    interrupted = False
+    try:
+        if chat_history is None:
+            with span(profile, "get_chat"):
+                chat_history = await get_chat(db, request.session_id) or {"conversation": []}
+        conversation = chat_history.setdefault("conversation", [])
+        with span(profile, "store_user_message"):
+            await store_chat_response(db, request.session_id, "user", [], request.question)
+        conversation.append({"role": "user", "message": request.question})
+
+        best_question_index, best_question = await next_question(
+            request.session_id, request.question, chat_history, questions[request.session_id], profile
+        )
+        with span(profile, "prompt_construction"):
+            rag_chain = get_chain(llm=llm, age=request.age, chat_history=chat_history, question=best_question)
+        generation_start = time.perf_counter()
+        async for chunk in answer_stream(request, rag_chain, chat_history, best_question_index, {
+            "input": request.question,
+            "question": best_question,
+            "context": "",
+            "conversation": conversation,
+            "age": request.age
+        }):
+            chunk_text = extract_text_from_chunk(chunk, request.model)
+            if chunk_text:
+                if not streamed.chunks:
+                    first_chunk_at = time.perf_counter()
+                    LLM_TTFT_SECONDS.observe(first_chunk_at - generation_start, request.model)
+                    if profile:
+                        profile.record("llm_ttft", generation_start, first_chunk_at)
+                full_answer += chunk_text
+                streamed.append(chunk_text)
+        generation_end = time.perf_counter()
+        LLM_GENERATION_SECONDS.observe(generation_end - generation_start, request.model)
+        if profile:
+            profile.record("llm_generation", generation_start, generation_end)
+
+        with span(profile, "store_bot_message"):
+            await store_chat_response(db, request.session_id, "bot", [best_question_index, best_question], full_answer)
+        conversation.append({"role": "bot", "question_index": best_question_index, "question": best_question, "message": full_answer})
+        run_in_background(speculate_next(request.session_id, request.model, list(conversation)))
+        streamed.finish({
+            "model": request.model,
+            "status": status.get(request.session_id, False),
+            "complete": True,
+            "full_answer": full_answer
+        })
+    except asyncio.CancelledError:
+        interrupted = True
+        logger.info(f"No client left, cancelled {request.model} turn {streamed.turn} for session {request.session_id} "
+                    f"after {len(streamed.chunks)} chunks")
+        STREAMS_CANCELLED.inc(request.model)
+        TOKENS_SAVED.inc(request.model, amount=max(0, LLM_MAX_NEW_TOKENS - len(streamed.chunks)))
+        if best_question is not None:
+            run_in_background(store_chat_response(
+                db, request.session_id, "bot", [best_question_index, best_question], full_answer, interrupted=True
+            ))
+            conversation.append({"role": "bot", "question_index": best_question_index, "question": best_question,
+                                 "message": full_answer, "interrupted": True})
+        streamed.finish({
+            "model": request.model,
+            "status": status.get(request.session_id, False),
+            "complete": True,
+            "interrupted": True,
+            "full_answer": full_answer
+        })
+        raise
+    except Exception as e:
+        logger.error(f"Error generating turn {streamed.turn} for session {request.session_id}: {e}")
+        streamed.finish({
+            "error": str(e),
+            "model": request.model,
+            "status": status.get(request.session_id, False),
+            "complete": True
+        })
+    finally:
+        if profile:
+            # Writing the profile must not be cut short when the turn was cancelled
+            run_in_background(finish_profile(profile, session_id=request.session_id, model=request.model,
+                                             question_index=best_question_index, interrupted=interrupted))
+
+async def follow_turn(streamed: StreamedTurn, http_request: Request):
+    """SSE frames of a turn; when the last client leaves, the turn is cancelled after TURN_RETRY_GRACE"""
+    ACTIVE_STREAMS.inc()
+    streamed.followers += 1
+    streamed.keep_alive()
+    watcher = asyncio.ensure_future(wait_for_disconnect(http_request))
+    try:
+        async for _, chunk in until_disconnected(streamed.follow(), watcher):
+            yield f"data: {json.dumps({'chunk': chunk, 'complete': False})}\n\n"
+        yield f"data: {json.dumps({'chunk': '', **streamed.result})}\n\n"
+    except ClientDisconnected:
+        pass
+    finally:
+        watcher.cancel()
+        ACTIVE_STREAMS.dec()
+        streamed.followers -= 1
+        if streamed.followers == 0:
+            streamed.cancel_later(TURN_RETRY_GRACE)
+
 def extract_text_from_chunk(chunk, model_name):
     try:
         if chunk is None:
@@ -29,176 +285,162 @@ def extract_text_from_chunk(chunk, model_name):
         logger.error(f"Error extracting text from chunk for {model_name}: {e}")
         return ""
 
-def sim_search(user_embedding, questions_list, asked_questions_set):
-    user_vector = np.array(user_embedding).reshape(1, -1)
-    max_sim = -1
-    best_question = None
-
-    for i in range(len(questions_list)):
-        if i in asked_questions_set:
-            continue
-        if questions_list[i].get("type", 0) == 1:
-            continue
-        q_vec = np.array(questions_list[i]["question_vector"]).reshape(1, -1)
-        sim = cosine_similarity(user_vector, q_vec)[0][0]
-        if sim > max_sim:
-            max_sim = sim
-            best_question = i
-
-    if best_question is None:
-        for i in range(len(questions_list)):
-            if i in asked_questions_set:
-                continue
-            if questions_list[i].get("type", 0) == 0:
-                continue
-            q_vec = np.array(questions_list[i]["question_vector"]).reshape(1, -1)
-            sim = cosine_similarity(user_vector, q_vec)[0][0]
-            if sim > max_sim:
-                max_sim = sim
-                best_question = i
-
-    return best_question, max_sim
+def rank_similar(user_embedding, questions_list, asked_questions_set, k=1):
+    """Up to k unasked questions in the order sim_search would pick them, with their similarity"""
+    if not questions_list:
+        return []
+    user_vector = np.asarray(user_embedding, dtype=np.float64).ravel()
+    # One matrix product instead of a cosine_similarity call per question
+    matrix = np.asarray([q["question_vector"] for q in questions_list], dtype=np.float64)
+    norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(user_vector)
+    norms[norms == 0] = 1
+    sims = matrix @ user_vector / norms
 
-@router.post("/stream")
-async def chat_stream(request: ChatRequest):
-    try:
-        if request.model not in MODELS:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Model '{request.model}' not available. Available models: {list(MODELS.keys())}"
-            )
+    types = np.array([q.get("type", 0) for q in questions_list])
+    available = np.ones(len(questions_list), dtype=bool)
+    asked = [i for i in asked_questions_set if 0 <= i < len(questions_list)]
+    available[asked] = False
+    ranked = []
+    for mask in (available & (types != 1), available & (types == 1)):
+        candidates = np.flatnonzero(mask & (sims > -1))
+        # Stable, so ties keep the questionnaire order like argmax does
+        for i in candidates[np.argsort(-sims[candidates], kind="stable")][:k - len(ranked)]:
+            ranked.append((int(i), sims[i]))
+    return ranked
 
-        # Store user message
-        await store_chat_response(router.db, request.session_id, "user", [], request.question)
+def sim_search(user_embedding, questions_list, asked_questions_set):
+    """Most similar unasked question of type 0 (or other non-1 types), falling back to type 1"""
+    ranked = rank_similar(user_embedding, questions_list, asked_questions_set)
+    return ranked[0] if ranked else (None, -1)
 
-        # Get model and chat history
-        llm = MODELS[request.model]
-        chat_history = await get_chat(router.db, request.session_id)
+def rank_questions(session_id, user_embedding, questions_list, asked_questions_set, k=1):
+    """Up to k next questions, best first: ANN over the item bank for bank sessions, linear search otherwise"""
+    if session_id in item_bank_sessions:
+        return get_item_bank_index().rank(user_embedding, asked_questions_set, item_bank_sessions[session_id], k)
+    return rank_similar(user_embedding, questions_list, asked_questions_set, k)
 
-        session_questions = questions.get(request.session_id)
-        if not session_questions:
-            raise HTTPException(status_code=400, detail="No questions available for this session")
+def select_question(session_id, user_embedding, questions_list, asked_questions_set):
+    """Pick the next question: ANN over the item bank for bank sessions, linear sim_search otherwise"""
+    if session_id in item_bank_sessions:
+        return get_item_bank_index().select(user_embedding, asked_questions_set, item_bank_sessions[session_id])
+    return sim_search(user_embedding, questions_list, asked_questions_set)
 
-        if request.question.strip().lower() == "/start":
-            best_question_index = 0
-            last_question_index[request.session_id] = 0
+async def next_question(session_id, question, chat_history, session_questions, profile=None):
+    """Resolve the question to ask after a user turn and record it in the session state"""
+    if question.strip().lower() == "/start":
+        best_question_index = 0
+        if session_id in item_bank_sessions:
+            best_question_index = get_bundle().first_item(item_bank_sessions[session_id])
+        last_question_index[session_id] = best_question_index
 
-        elif len(request.question.strip().split(' ')) <= 3 and -last_question_index.get(request.session_id, 0) - 1 not in questions_asked.get(request.session_id, set()):
-            best_question_index = -last_question_index.get(request.session_id, 0) - 1
+    elif len(question.strip().split(' ')) <= 3 and -last_question_index.get(session_id, 0) - 1 not in questions_asked.get(session_id, set()):
+        best_question_index = -last_question_index.get(session_id, 0) - 1
 
-        else:
-            text = ""
-            for conv in chat_history.get('conversation', [])[-6:]:
-                text += " " + f"{conv.get('message', '')}"
-            user_embedding = await get_embedding(request.question + text)
-            best_question_index, _ = sim_search(
+    else:
+        conversation = chat_history.get('conversation', [])
+        with span(profile, "embedding"):
+            user_embedding = await context_embedding(session_id, question, conversation)
+        with SIM_SEARCH_SECONDS.time(), span(profile, "sim_search"):
+            best_question_index, _ = select_question(
+                session_id,
                 user_embedding,
                 session_questions,
-                questions_asked.setdefault(request.session_id, set())
+                questions_asked.setdefault(session_id, set())
             )
-            last_question_index[request.session_id] = best_question_index
+        if CONTEXT_EMBEDDING_COMPARE and CONTEXT_EMBEDDING_MODE != "full":
+            full_embedding = await get_embedding(full_context_text(question, conversation))
+            full_index, _ = select_question(session_id, full_embedding, session_questions, questions_asked[session_id])
+            CONTEXT_SELECTION_COMPARED.inc("same" if full_index == best_question_index else "different")
+        last_question_index[session_id] = best_question_index
 
-        if best_question_index is not None and best_question_index < 0:
-            best_question = "Can you please elaborate on that?"
-            questions_asked.setdefault(request.session_id, set()).add(best_question_index)
+    if best_question_index is not None and best_question_index < 0:
+        best_question = ELABORATE_QUESTION
+        questions_asked.setdefault(session_id, set()).add(best_question_index)
 
-        elif best_question_index is None:
-            best_question = "The questionnaire is complete. Thank you for your responses! Please provide us with any additional comments or feedback."
-            status[request.session_id] = True
+    elif best_question_index is None:
+        best_question = "The questionnaire is complete. Thank you for your responses! Please provide us with any additional comments or feedback."
+        status[session_id] = True
 
-        else:
-            questions_asked.setdefault(request.session_id, set()).add(best_question_index)
-            best_question = session_questions[best_question_index]['question']
-
-        rag_chain = get_chain(
-            llm=llm,
-            age=request.age,
-            chat_history=chat_history,
-            question=best_question
-        )
+    else:
+        questions_asked.setdefault(session_id, set()).add(best_question_index)
+        best_question = session_questions[best_question_index]['question']
 
-        async def generate_stream():
-            try:
-                full_answer = ""
-                chunk_count = 0
-
-                logger.info(f"Starting stream for model: {request.model}")
-
-                if hasattr(rag_chain, 'astream'):
-                    try:
-                        async for chunk in rag_chain.astream({
-                            "input": request.question,
-                            "question": best_question,
-                            "context": "",
-                            "conversation": chat_history.get('conversation', []),
-                            "age": request.age
-                        }):
-                            chunk_count += 1
-                            logger.info(f"Received chunk {chunk_count} for {request.model}: {type(chunk)}")
-                            chunk_text = extract_text_from_chunk(chunk, request.model)
-                            if chunk_text:
-                                full_answer += chunk_text
-                                data = {
-                                    "chunk": chunk_text,
-                                    "complete": False
-                                }
-                                yield f"data: {json.dumps(data)}\n\n"
-                    except StopAsyncIteration:
-                        logger.info(f"Stream completed normally for {request.model}")
-
-                else:
-                    logger.info(f"Using non-streaming for {request.model}")
-                    response = await rag_chain.ainvoke({
-                        "input": request.question,
-                        "question": best_question,
-                        "context": "",
-                        "responses": chat_history.get('responses', []),
-                        "follow_up_responses": chat_history.get('follow_up_responses', []),
-                        "conversation": chat_history.get('conversation', []),
-                        "age": request.age
-                    })
-                    full_answer = str(response)
-                    data = {
-                        "chunk": full_answer,
-                        "complete": False
-                    }
-                    yield f"data: {json.dumps(data)}\n\n"
-
-                completion_data = {
-                    "chunk": "",
-                    "model": request.model,
-                    "status": status.get(request.session_id, False),
-                    "complete": True,
-                    "full_answer": full_answer
-                }
-                yield f"data: {json.dumps(completion_data)}\n\n"
-
-                await store_chat_response(router.db, request.session_id, "bot", [best_question_index, best_question], full_answer)
-
-                logger.info(f"Stream completed for {request.model}, total chunks: {chunk_count}")
-
-            except Exception as e:
-                logger.error(f"Error in generate_stream for {request.model}: {e}")
-                error_data = {
-                    "error": str(e),
-                    "model": request.model,
-                    "status": status.get(request.session_id, False),
-                    "complete": True
-                }
-                yield f"data: {json.dumps(error_data)}\n\n"
-
-        return StreamingResponse(
-            generate_stream(),
-            media_type="text/event-stream",
-            headers={
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-                "Access-Control-Allow-Origin": "*",
-            }
+    return best_question_index, best_question
+
+def answer_stream(request: ChatRequest, rag_chain, chat_history: dict, best_question_index, inputs: dict):
+    """Chunks of the turn's answer: from the speculative draft of its question when there is one, else from rag_chain"""
+    draft = speculation.take(request.session_id, request.model, best_question_index)
+    if draft:
+        return speculation.serve(draft, MODELS[request.model], chat_history, request.question,
+                                 lambda: rag_chain.astream(inputs))
+    return rag_chain.astream(inputs)
+
+async def next_candidates(session_id, conversation):
+    """The questions likeliest to follow the user's answer to the last bot turn, best first.
+
+    The answer is not known yet, so questions are ranked by the recent
+    conversation alone; a short answer would get the elaboration prompt,
+    which is tried second.
+    """
+    session_questions = questions.get(session_id)
+    if not session_questions or status.get(session_id):
+        return []
+    asked = questions_asked.setdefault(session_id, set())
+    user_embedding = await get_embedding(full_context_text("", conversation).strip())
+    with SIM_SEARCH_SECONDS.time():
+        ranked = rank_questions(session_id, user_embedding, session_questions, asked, speculation.SPECULATIVE_TOP_K)
+    candidates = [(index, session_questions[index]["question"]) for index, _ in ranked]
+    elaborate = -last_question_index.get(session_id, 0) - 1
+    if elaborate not in asked:
+        candidates.insert(1, (elaborate, ELABORATE_QUESTION))
+    return candidates[:speculation.SPECULATIVE_TOP_K]
+
+async def speculate_next(session_id, model, conversation):
+    """Start drafting the next question while the user reads this answer and types theirs"""
+    if not speculation.SPECULATIVE_DRAFTS:
+        return
+    candidates = await next_candidates(session_id, conversation)
+    if candidates:
+        speculation.start(session_id, MODELS[model], model, {"conversation": conversation}, candidates)
+
+@router.post("/stream")
+async def chat_stream(request: ChatRequest, http_request: Request, x_profile: Optional[str] = Header(None),
+                      idempotency_key: Optional[str] = Header(None)):
+    if request.model not in MODELS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Model '{request.model}' not available. Available models: {list(MODELS.keys())}"
         )
+    # Retried turns are recognised by the Idempotency-Key header or the client's turn index
+    key = idempotency_key or (f"turn-{request.turn}" if request.turn is not None else None)
+    cache_key = f"{request.session_id}:{key}" if key else None
+    streamed = turn_results.get(cache_key) if key else None
+    if streamed:
+        TURNS_DEDUPLICATED.inc("replayed" if streamed.done else "attached")
+        logger.info(f"Duplicate turn {key} for session {request.session_id}, {'replaying' if streamed.done else 'attaching'}")
+    else:
+        streamed = StreamedTurn(key, request.model)
+        if key:
+            prune_turn_results()
+            # Registered before the first await, so a duplicate arriving meanwhile attaches to this turn
+            turn_results[cache_key] = streamed
+        if not await ensure_session(router.db, request.session_id):
+            streamed.finish({"error": "No questions available for this session", "model": request.model,
+                             "status": False, "complete": True})
+            if key:
+                turn_results.pop(cache_key, None)
+            raise HTTPException(status_code=400, detail="No questions available for this session")
+        # The generation belongs to the turn, not to this request, so a retry can pick it up
+        streamed.task = asyncio.create_task(generate_turn(router.db, request, None, streamed, x_profile))
+        if key:
+            streamed.task.add_done_callback(lambda _: forget_failed_turn(cache_key, streamed))
 
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"Error setting up stream: {e}")
-        raise HTTPException(status_code=500, detail=f"Error setting up stream: {e}")
\ No newline at end of file
+    return StreamingResponse(
+        follow_turn(streamed, http_request),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "Access-Control-Allow-Origin": "*",
+        }
+    )
@@ -0,0 +1,200 @@
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from pydantic import ValidationError
+from models.chatbot import ChatRequest
+from database.chatbot import get_chat
+from database.sessions import ensure_session
+from routers.chat import StreamedTurn, generate_turn
+from utils import rate_limit
+from utils.utils import MODELS, status, socket_sessions, session_schools
+from utils.metrics import ACTIVE_SOCKETS, TURNS_DEDUPLICATED
+from typing import Optional
+import asyncio
+import logging
+import math
+import os
+import time
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+WS_HEARTBEAT_INTERVAL = float(os.getenv("WS_HEARTBEAT_INTERVAL", "20"))
+# Heartbeats a client may miss before the connection is considered dead
+WS_HEARTBEAT_MISSES = int(os.getenv("WS_HEARTBEAT_MISSES", "2"))
+# How long an answer keeps generating after its connection drops, waiting for a resume
+WS_RESUME_GRACE = float(os.getenv("WS_RESUME_GRACE", "10"))
+
+class ResidentSession:
+    """Chat history and latest answer of a session served over WebSocket.
+
+    The history is read from Mongo once and then kept in step locally, so a
+    turn costs the question selection and the LLM call only, and a client
+    reconnecting to the same worker resumes without reading it again.
+    """
+
+    def __init__(self, session_id: str, chat_history: dict):
+        self.session_id = session_id
+        self.chat_history = chat_history
+        self.turn: Optional[StreamedTurn] = None
+        self.connections = 0
+        self.eviction: Optional[asyncio.TimerHandle] = None
+
+    def attach(self):
+        self.connections += 1
+        if self.eviction:
+            self.eviction.cancel()
+            self.eviction = None
+
+    def detach(self):
+        """Forget the session once no connection has resumed it within the grace period"""
+        self.connections -= 1
+        if self.connections == 0 and not self.eviction:
+            self.eviction = asyncio.get_running_loop().call_later(WS_RESUME_GRACE, self.evict)
+
+    def evict(self):
+        self.eviction = None
+        if self.connections == 0 and socket_sessions.get(self.session_id) is self:
+            del socket_sessions[self.session_id]
+
+class ChatConnection:
+    """One WebSocket attached to a resident session"""
+
+    def __init__(self, websocket: WebSocket, session_id: str):
+        self.websocket = websocket
+        self.session_id = session_id
+        self.resident: Optional[ResidentSession] = None
+        self.last_seen = time.monotonic()
+        self.streamer: Optional[asyncio.Task] = None
+        self._send_lock = asyncio.Lock()
+
+    async def send(self, frame: dict):
+        async with self._send_lock:
+            await self.websocket.send_json(frame)
+
+    async def heartbeat(self):
+        while True:
+            await asyncio.sleep(WS_HEARTBEAT_INTERVAL)
+            if time.monotonic() - self.last_seen > WS_HEARTBEAT_INTERVAL * (WS_HEARTBEAT_MISSES + 1):
+                logger.info(f"WebSocket for session {self.session_id} missed {WS_HEARTBEAT_MISSES} heartbeats, closing")
+                await self.websocket.close(code=1001)
+                return
+            await self.send({"type": "ping"})
+
+    async def stream(self, streamed: StreamedTurn, offset: int = 0):
+        try:
+            async for i, chunk in streamed.follow(offset):
+                await self.send({"type": "chunk", "turn": streamed.turn, "offset": i, "chunk": chunk})
+            await self.send({"type": "complete", "turn": streamed.turn, **streamed.result})
+        except Exception as e:
+            # The receive loop notices the disconnect and starts the resume grace period
+            logger.info(f"Stopped sending turn {streamed.turn} to session {self.session_id}: {e}")
+
+    def start_streaming(self, streamed: StreamedTurn, offset: int = 0):
+        if self.streamer and not self.streamer.done():
+            self.streamer.cancel()
+        self.streamer = asyncio.create_task(self.stream(streamed, offset))
+
+    async def on_turn(self, message: dict):
+        previous = self.resident.turn
+        if previous and "turn" in message and message["turn"] == previous.turn and not previous.failed:
+            # A client retrying a turn it already sent follows the existing answer; a cut-off one is generated again
+            TURNS_DEDUPLICATED.inc("replayed" if previous.done else "attached")
+            self.start_streaming(previous)
+            return
+        if previous and not previous.done:
+            await self.send({"type": "error", "turn": message.get("turn"), "error": f"Turn {previous.turn} is still being answered"})
+            return
+        try:
+            request = ChatRequest(session_id=self.session_id, question=message.get("question", ""),
+                                  **{k: message[k] for k in ("model", "age") if k in message})
+        except ValidationError as e:
+            await self.send({"type": "error", "turn": message.get("turn"), "error": str(e)})
+            return
+        if request.model not in MODELS:
+            await self.send({"type": "error", "turn": message.get("turn"),
+                             "error": f"Model '{request.model}' not available. Available models: {list(MODELS.keys())}"})
+            return
+        # The HTTP middleware only sees the handshake, so every turn is counted here
+        group = rate_limit.group_for(self.websocket.url.path) if rate_limit.RATE_LIMIT else None
+        refused = group and await rate_limit.check(group, rate_limit.client_ip(self.websocket), None,
+                                                   session_schools.get(self.session_id))
+        if refused:
+            scope, retry_after = refused
+            await self.send({"type": "error", "turn": message.get("turn"), "error": f"Too many requests for this {scope}",
+                             "retry_after": max(1, math.ceil(retry_after))})
+            return
+        turn = message.get("turn", previous.turn + 1 if previous else 0)
+        streamed = StreamedTurn(turn, request.model)
+        self.resident.turn = streamed
+        streamed.task = asyncio.create_task(generate_turn(router.db, request, self.resident.chat_history, streamed))
+        self.start_streaming(streamed)
+
+    async def on_resume(self, message: dict):
+        streamed = self.resident.turn
+        if not streamed or streamed.turn != message.get("turn"):
+            await self.send({"type": "error", "turn": message.get("turn"), "error": "Turn cannot be resumed, reload the chat"})
+            return
+        self.start_streaming(streamed, int(message.get("offset", 0)))
+
+    async def run(self):
+        self.resident = socket_sessions.get(self.session_id)
+        if self.resident is None:
+            chat_history = await get_chat(router.db, self.session_id) or {"conversation": []}
+            chat_history.pop("_id", None)
+            self.resident = socket_sessions[self.session_id] = ResidentSession(self.session_id, chat_history)
+        self.resident.attach()
+        streamed = self.resident.turn
+        if streamed:
+            # A previous connection may have dropped mid-answer; keep generating for this one
+            streamed.keep_alive()
+
+        heartbeat = asyncio.create_task(self.heartbeat())
+        try:
+            await self.send({
+                "type": "ready",
+                "status": status.get(self.session_id, False),
+                "turn": streamed.turn if streamed else None,
+                "turn_complete": streamed.done if streamed else None,
+            })
+            while True:
+                message = await self.websocket.receive_json()
+                self.last_seen = time.monotonic()
+                kind = message.get("type")
+                if kind == "turn":
+                    await self.on_turn(message)
+                elif kind == "resume":
+                    await self.on_resume(message)
+                elif kind == "ping":
+                    await self.send({"type": "pong"})
+                elif kind != "pong":
+                    await self.send({"type": "error", "error": f"Unknown message type '{kind}'"})
+        finally:
+            heartbeat.cancel()
+            if self.streamer:
+                self.streamer.cancel()
+            streamed = self.resident.turn
+            if streamed:
+                streamed.cancel_later(WS_RESUME_GRACE)
+            self.resident.detach()
+
+@router.websocket("/ws/{session_id}")
+async def chat_socket(websocket: WebSocket, session_id: str):
+    """Whole screening session over one connection.
+
+    Client frames: {"type": "turn", "question", "model", "age", "turn"},
+    {"type": "resume", "turn", "offset"} after a reconnect, and "ping"/"pong".
+    Server frames: "ready", "chunk" (with its offset), "complete", "error" and "ping".
+    """
+    await websocket.accept()
+    if not await ensure_session(router.db, session_id):
+        await websocket.send_json({"type": "error", "error": "No questions available for this session"})
+        await websocket.close(code=4404)
+        return
+    ACTIVE_SOCKETS.inc()
+    try:
+        await ChatConnection(websocket, session_id).run()
+    except WebSocketDisconnect:
+        logger.info(f"WebSocket for session {session_id} disconnected")
+    except Exception as e:
+        logger.error(f"Error in WebSocket for session {session_id}: {e}")
+    finally:
+        ACTIVE_SOCKETS.dec()
@@ -1,6 +1,7 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from database.chatbot import list_questionairs, get_questionair, get_chat
 from utils.utils import MODELS, db
+from utils import http_cache
 import logging
 
 router = APIRouter()
@@ -43,12 +44,15 @@ async def get_questionnaire(questionnaire: str):
         raise HTTPException(status_code=500, detail=f"Error fetching questionnaire '{questionnaire}': {str(e)}")
 
 @router.get("/chat/{session_id}")
-async def get_chat_by_id(session_id: str):
+async def get_chat_by_id(session_id: str, request: Request):
     """Get chat history for a specific session"""
     try:
         chat = await get_chat(router.db, session_id)
         if not chat:
             raise HTTPException(status_code=404, detail=f"Chat with session ID '{session_id}' not found")
+        if "feedback" not in chat:
+            # Still being answered; only completed transcripts are kept server side
+            http_cache.no_store(request)
         return {"chat": chat}
     except Exception as e:
         logger.error(f"Error fetching chat for session '{session_id}': {e}")
@@ -1,6 +1,7 @@
 from fastapi import APIRouter, HTTPException
 from models.children import AddChildRequest, ChildRequest, GetChildren
 from utils.utils import MODELS, db
+from pymongo.errors import DuplicateKeyError
 import logging
 from datetime import datetime
 from bson import ObjectId
@@ -18,7 +19,10 @@ async def addChild(request: AddChildRequest):
     # dob = yyyy-mm-dd
     child_data["age"] = datetime.now().year - int(child_data["dob"].split("-")[0])
     child_data["created_at"] = child_data["updated_at"] = datetime.now()
-    await router.dbc.children.insert_one(child_data)
+    try:
+        await router.dbc.children.insert_one(child_data)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Child with this name and date of birth already exists")
     return {"message": "Child added successfully", "child_id": str(child_data["_id"])}
 
 @router.post("/children")
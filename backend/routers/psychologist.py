@@ -1,9 +1,16 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from database.chatbot import list_questionairs, get_questionair, get_chat
 from models.chatbot import UpdateDiagnosisRequest
 from models.children import GetChildBySchool
 from database.chatbot import get_chat
+from database.search import SearchError, search_children, search_sessions
+from database import write_buffer
 from utils.utils import MODELS, db
+from utils import events, http_cache, post_session
+from typing import Optional
+import asyncio
+import json
 import logging
 
 router = APIRouter()
@@ -23,12 +30,14 @@ async def get_unique_schools():
         raise HTTPException(status_code=500, detail=f"Error fetching unique schools: {str(e)}")
 
 @router.get("/chat/{session_id}")
-async def get_chat_by_id(session_id: str):
+async def get_chat_by_id(session_id: str, request: Request):
     """Get chat history for a specific session"""
     try:
         chat = await get_chat(router.dbq, session_id)
         if not chat:
             raise HTTPException(status_code=404, detail=f"Chat with session ID '{session_id}' not found")
+        if "feedback" not in chat:
+            http_cache.no_store(request)
         return {"chat": chat}
     except Exception as e:
         logger.error(f"Error fetching chat for session '{session_id}': {e}")
@@ -45,15 +54,79 @@ async def get_chat_responses():
         logger.error(f"Error fetching chat responses: {e}")
         raise HTTPException(status_code=500, detail=f"Error fetching chat responses: {str(e)}")
 
+@router.get("/search-sessions")
+async def searchSessions(q: Optional[str] = None, match: str = "prefix", school: Optional[str] = None,
+                         diagnosis: Optional[str] = None, diagnosed: Optional[bool] = None,
+                         questionnaire: Optional[str] = None, started_from: Optional[str] = None,
+                         started_to: Optional[str] = None, limit: Optional[int] = None, cursor: Optional[str] = None,
+                         fields: Optional[str] = None):
+    """Page of sessions by student, guardian or school with diagnosis and start date filters, without transcripts"""
+    try:
+        return await search_sessions(router.dbq, q, match, school=school, diagnosis=diagnosis, diagnosed=diagnosed,
+                                     questionnaire=questionnaire, started_from=started_from, started_to=started_to,
+                                     limit=limit, cursor=cursor, fields=fields)
+    except SearchError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/search-children")
+async def searchChildren(q: Optional[str] = None, match: str = "prefix", school: Optional[str] = None,
+                         dob_from: Optional[str] = None, dob_to: Optional[str] = None, limit: Optional[int] = None,
+                         cursor: Optional[str] = None, fields: Optional[str] = None):
+    """Page of children whose name, guardian or school starts with q (match=text for word search)"""
+    try:
+        return await search_children(router.dbc, q, match, school=school, dob_from=dob_from, dob_to=dob_to,
+                                     limit=limit, cursor=cursor, fields=fields)
+    except SearchError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/events")
+async def session_events(http_request: Request, school: Optional[str] = None):
+    """Server-sent feed of session started / completed / diagnosis set deltas, optionally for one school.
+
+    Clients open the feed, then load /chat-responses once and apply deltas on top.
+    A "resync" event means the client fell behind and should reload the table.
+    """
+    async def event_stream():
+        subscription = events.bus.subscribe(school)
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), events.PSYCHOLOGIST_FEED_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    if await http_request.is_disconnected():
+                        return
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"data: {json.dumps(event, default=str)}\n\n"
+        finally:
+            events.bus.unsubscribe(subscription)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "Access-Control-Allow-Origin": "*",
+        }
+    )
+
 @router.post("/update-diagnosis")
 async def updateDiagnosis(req: UpdateDiagnosisRequest):
     session_id = req.session_id
+    # The buffered insert of a new chat sets diagnosis to None; it must land before the update
+    if write_buffer.buffer and not await write_buffer.buffer.flush_session(session_id):
+        raise HTTPException(status_code=503, detail="The chat is still being saved, try again")
     chat_data = await router.dbq.chats.find_one({"session_id": session_id})
     if not chat_data:
         raise HTTPException(status_code=404, detail=f"Chat with session ID '{session_id}' not found")
     
-    chat_data["diagnosis"] = req.diagnosis
-    await router.dbq.chats.update_one({"session_id": session_id}, {"$set": chat_data})
+    # Only touch the diagnosis so buffered conversation writes are not overwritten
+    await router.dbq.chats.update_one({"session_id": session_id}, {"$set": {"diagnosis": req.diagnosis}})
+    http_cache.invalidate_chat(session_id)
+    events.publish(events.DIAGNOSIS_SET, session_id, chat_data.get("school"), diagnosis=req.diagnosis)
+    await post_session.enqueue_diagnosis_set(router.dbq, session_id)
     return {"message": "Diagnosis updated successfully"}
 
 
@@ -1,7 +1,14 @@
 from fastapi import APIRouter, HTTPException
 from models.chatbot import QuestionnaireStartRequest, EndRequest
-from database.chatbot import get_questionair, store_chat_response
-from utils.utils import questions_asked, questions, last_question_index, status
+from database.chatbot import store_chat_response
+from database.bundle import get_bundle
+from database.sessions import ITEM_BANK_NAME, load_questionnaire
+from utils.ann_index import get_item_bank_index
+from utils.context_embedding import forget_session
+from database import write_buffer
+from utils import events, post_session, speculation
+from utils.utils import MODELS, questions_asked, questions, last_question_index, status, item_bank_sessions, session_schools
+from utils.metrics import MONGO_SECONDS
 import logging
 import datetime
 
@@ -13,8 +20,16 @@ async def start_questionnaire(request: QuestionnaireStartRequest):
     if not request.tnc_accepted:
         raise HTTPException(status_code=400, detail="Terms and Conditions must be accepted to start the questionnaire")
     try:
-        # Get questionnaire data from database
-        questionnaire_data = await get_questionair(router.db, request.questionnaire_name)
+        # Get questionnaire data from the compiled bundle, or the database without one
+        if request.questionnaire_name == ITEM_BANK_NAME and (not get_item_bank_index() or not get_bundle()):
+            raise HTTPException(status_code=404, detail="Item bank is not available on this server")
+        if request.questionnaire_name == ITEM_BANK_NAME and request.instruments:
+            # An unknown name would leave the session without candidate questions on its first answer
+            known = get_item_bank_index().instrument_names
+            unknown = [name for name in request.instruments if name not in known]
+            if unknown:
+                raise HTTPException(status_code=400, detail=f"Unknown instruments {unknown}; choose from {known}")
+        questionnaire_data = await load_questionnaire(router.db, request.questionnaire_name)
         if not questionnaire_data:
             raise HTTPException(status_code=404, detail=f"Questionnaire '{request.questionnaire_name}' not found")
         
@@ -29,12 +44,27 @@ async def start_questionnaire(request: QuestionnaireStartRequest):
         data["conversation"] = []
         data["diagnosis"] = None
         
-        await router.db["chats"].insert_one(data)
+        if write_buffer.buffer:
+            # Created by the next write-behind flush; $addToSet creates the conversation array
+            write_buffer.buffer.set_fields(session_id, {k: v for k, v in data.items() if k != "conversation"})
+        else:
+            with MONGO_SECONDS.time("insert_chat"):
+                await router.db["chats"].insert_one(data)
         
         questions_asked[session_id] = set()
         questions[session_id] = questionnaire_data["questions"]
         last_question_index[session_id] = 0
         status[session_id] = False
+        session_schools[session_id] = request.school
+        if request.questionnaire_name == ITEM_BANK_NAME:
+            item_bank_sessions[session_id] = request.instruments
+        if speculation.SPECULATIVE_DRAFTS and speculation.SPECULATIVE_FIRST_MODEL in MODELS and questions[session_id]:
+            # The first question does not depend on any answer, so it is drafted while the chat page loads
+            first = get_bundle().first_item(request.instruments) if session_id in item_bank_sessions else 0
+            speculation.start(session_id, MODELS[speculation.SPECULATIVE_FIRST_MODEL], speculation.SPECULATIVE_FIRST_MODEL,
+                              {"conversation": []}, [(first, questions[session_id][first]["question"])])
+        events.publish(events.SESSION_STARTED, session_id, data.get("school"),
+                       session={k: v for k, v in data.items() if k not in ("_id", "conversation")})
 
         return {"session_id": session_id}
         
@@ -48,6 +78,9 @@ async def start_questionnaire(request: QuestionnaireStartRequest):
 async def end_questionnaire(request: EndRequest):
     try:
         await store_chat_response(router.db, request.session_id, "feedback", [], request.feedback)
+        await post_session.enqueue_session_end(router.db, request.session_id)
+        speculation.discard(request.session_id)
+        forget_session(request.session_id)
         return {"message": "Thank for your feedback. Feedback saved successfully! You may now leave the page"}
     except HTTPException:
         raise
@@ -1,6 +1,11 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from models.children import AddChildRequest, ChildRequest, GetChildren, GetChildBySchool
+from database.children import child_document, import_children
+from database.search import SearchError, search_children
+from utils.roster import RosterError, parser_for
 from utils.utils import MODELS, db
+from pymongo.errors import DuplicateKeyError
+from typing import Optional
 import logging
 from datetime import datetime
 from bson import ObjectId
@@ -14,13 +19,32 @@ async def addChild(request: AddChildRequest):
     if existing:
         raise HTTPException(status_code=400, detail="Child with this name and date of birth already exists in this school")
     
-    child_data = request.dict()
-    # dob = yyyy-mm-dd
-    child_data["age"] = datetime.now().year - int(child_data["dob"].split("-")[0])
-    child_data["created_at"] = child_data["updated_at"] = datetime.now()
-    await router.dbc.children.insert_one(child_data)
+    child_data = child_document(request)
+    try:
+        await router.dbc.children.insert_one(child_data)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Child with this name and date of birth already exists in this school")
     return {"message": "Child added successfully", "child_id": str(child_data["_id"])}
 
+@router.post("/import-children")
+async def importChildren(request: Request, school: Optional[str] = None, teacher_name: Optional[str] = None,
+                         teacher_mobile: Optional[str] = None):
+    """Enroll a class roster sent as the request body (text/csv, a JSON array or JSON lines).
+
+    Query parameters fill columns the roster leaves out. The body is parsed as it
+    arrives and inserted in batches; the response has one report entry per row.
+    """
+    try:
+        parse = parser_for(request.headers.get("content-type"))
+    except RosterError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    defaults = {k: v for k, v in (("school", school), ("teacher_name", teacher_name), ("teacher_mobile", teacher_mobile)) if v}
+    result = await import_children(router.dbc, parse(request.stream()), defaults)
+    if result["error"] and not result["rows"]:
+        raise HTTPException(status_code=400, detail=f"Could not parse roster: {result['error']}")
+    logger.info(f"Imported roster for {school or 'mixed schools'}: {result['counts']}")
+    return result
+
 @router.post("/children")
 async def getChildren(req: GetChildren):
     mobile = req.mobile
@@ -33,6 +57,21 @@ async def getChildren(req: GetChildren):
     
     return {"children": children}
 
+@router.get("/search-children")
+async def searchChildren(q: Optional[str] = None, match: str = "prefix", school: Optional[str] = None,
+                         teacher_mobile: Optional[str] = None, dob_from: Optional[str] = None,
+                         dob_to: Optional[str] = None, limit: Optional[int] = None, cursor: Optional[str] = None,
+                         fields: Optional[str] = None):
+    """Page of children whose name, guardian or school starts with q (match=text for word search).
+
+    Pass next_cursor back as cursor for the following page.
+    """
+    try:
+        return await search_children(router.dbc, q, match, school=school, teacher_mobile=teacher_mobile,
+                                     dob_from=dob_from, dob_to=dob_to, limit=limit, cursor=cursor, fields=fields)
+    except SearchError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @router.post("/children-by-school")
 async def getChildrenBySchool(req: GetChildBySchool):
     school = req.school
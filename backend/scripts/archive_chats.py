@@ -0,0 +1,36 @@
+"""Move conversations of old screening sessions out of the hot chats collection.
+
+Each archived session keeps its summary (student, school, diagnosis, feedback,
+turn count) in chats; the conversation is compressed into chats_archive, or
+into CHAT_ARCHIVE_DIR when that is set. get_chat reads it back transparently.
+Run from the backend directory, e.g. from cron:
+
+    python -m scripts.archive_chats --older-than-days 180
+"""
+import argparse
+import asyncio
+
+from database.archive import CHAT_ARCHIVE_AFTER_DAYS, CHAT_ARCHIVE_BATCH, archive_chats, ensure_archive_index
+from database.chatbot import connect_questionnaire_db
+
+
+async def run(args):
+    db = await connect_questionnaire_db()
+    await ensure_archive_index(db)
+    summary = await archive_chats(db, args.older_than_days, args.batch_size, args.dry_run)
+    verb = "Would archive" if args.dry_run else "Archived"
+    print(f"{verb} {summary['archived']} chats created before {summary['cutoff']}"
+          f" ({summary['skipped']} changed during the run and were left for the next one)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--older-than-days", type=float, default=CHAT_ARCHIVE_AFTER_DAYS)
+    parser.add_argument("--batch-size", type=int, default=CHAT_ARCHIVE_BATCH)
+    parser.add_argument("--dry-run", action="store_true", help="Only count the chats that would be archived")
+    args = parser.parse_args(argv)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
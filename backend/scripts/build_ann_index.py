@@ -0,0 +1,40 @@
+"""Build the item bank ANN index from a compiled questionnaire bundle.
+
+Works offline: it only reads the bundle written by scripts/build_bundle.py.
+Point ITEM_BANK_INDEX at the output and keep QUESTIONNAIRE_BUNDLE on the
+same bundle, since index ids are bundle rows.
+
+    python -m scripts.build_ann_index --bundle bundles/questionnaires --out bundles/item_bank
+"""
+import argparse
+import time
+
+from database.bundle import QuestionnaireBundle
+from utils.ann_index import IVFIndex
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bundle", default="bundles/questionnaires")
+    parser.add_argument("--out", default="bundles/item_bank")
+    parser.add_argument("--lists", type=int, default=None, help="Number of inverted lists (default sqrt(items))")
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    bundle = QuestionnaireBundle(args.bundle)
+    bank = bundle.item_bank()
+    t0 = time.perf_counter()
+    index = IVFIndex.build(
+        bundle.vectors,
+        [q["instrument"] for q in bank],
+        [q.get("type", 0) for q in bank],
+        n_lists=args.lists,
+        iterations=args.iterations,
+    )
+    index.save(args.out)
+    print(f"Indexed {len(bank)} items from {len(bundle.names())} instruments into {index.n_lists} lists "
+          f"in {time.perf_counter() - t0:.1f}s -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+"""Compile the questionaires collection into a memory-mapped bundle.
+
+Run from the backend directory, then point QUESTIONNAIRE_BUNDLE at the output:
+
+    python -m scripts.build_bundle --out bundles/questionnaires
+"""
+import argparse
+import asyncio
+
+from database.bundle import build_bundle
+from database.chatbot import connect_questionnaire_db
+
+
+async def run(out_dir):
+    db = await connect_questionnaire_db()
+    summary = await build_bundle(db, out_dir)
+    print(f"Wrote {summary['rows']} vectors (dim {summary['dim']}) for {len(summary['questionnaires'])} questionnaires to {out_dir}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", default="bundles/questionnaires", help="Output directory")
+    args = parser.parse_args(argv)
+    asyncio.run(run(args.out))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""Export screening data for research as compressed Parquet files.
+
+Writes sessions (one row per chat, without the transcript), turns (one row
+per conversation turn) and children into one subdirectory per table under
+--out. Running the same command again after an interruption resumes after
+the last finished file. With --pseudonymise, names and mobile numbers (and
+names quoted in messages) become keyed pseudonyms from EXPORT_PSEUDONYM_KEY.
+Run from the backend directory:
+
+    python -m scripts.export_research --out exports/2026-spring --pseudonymise
+"""
+import argparse
+import asyncio
+
+from database.archive import ensure_archive_index
+from database.chatbot import connect_questionnaire_db
+from database.children import connect_children_db
+from database.export import EXPORT_BATCH, EXPORT_COMPRESSION, EXPORT_PART_DOCS, TABLES, ExportError, export
+
+
+async def run(args):
+    ques_db = await connect_questionnaire_db()
+    children_db = await connect_children_db()
+    # Every archived chat is read back by session_id
+    await ensure_archive_index(ques_db)
+    manifest = await export(ques_db, children_db, args.out, args.tables.split(","), args.pseudonymise,
+                            batch_size=args.batch_size, part_docs=args.part_docs, compression=args.compression)
+    for table, files in manifest["files"].items():
+        print(f"{table}: {sum(f['rows'] for f in files)} rows in {len(files)} files")
+    print(f"Export {manifest['status']} in {args.out}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", required=True, help="Export directory; an existing export there is resumed")
+    parser.add_argument("--tables", default=",".join(TABLES))
+    parser.add_argument("--pseudonymise", action="store_true")
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH, help="Documents per cursor batch")
+    parser.add_argument("--part-docs", type=int, default=EXPORT_PART_DOCS, help="Source documents per file")
+    parser.add_argument("--compression", default=EXPORT_COMPRESSION)
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(run(args))
+    except ExportError as e:
+        parser.exit(1, f"{e}\n")
+
+
+if __name__ == "__main__":
+    main()
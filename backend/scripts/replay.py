@@ -0,0 +1,329 @@
+"""Replay screening transcripts through question selection and the answer chain.
+
+Every user message of a transcript is fed, in order, through the same
+next_question and get_chain path as /api/chat/stream, once per model. The
+replayed answers (not the stored ones) become the history of later turns.
+One row per turn is written to Parquet part files in --out, next to a
+checkpoint; re-running with the same --out skips sessions already written.
+
+Run from the backend directory:
+
+    python -m scripts.replay --source synthetic --sessions 2000 --fake-models --fake-embeddings
+    python -m scripts.replay --source mongo --limit 500 --models Mistral,Gemini --concurrency Gemini=2
+    python -m scripts.replay --source jsonl --input chats.jsonl --out replays/prompt-v2
+
+Extra dependency: pyarrow.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from collections import defaultdict
+
+SYNTHETIC_QUESTIONNAIRE = "Synthetic Questionnaire"
+CHECKPOINT_FILE = "_checkpoint.json"
+COLUMNS = ["model", "session_id", "turn", "user_message", "question_index", "question",
+           "original_question_index", "same_question", "answer", "latency_ms", "error"]
+
+
+def to_transcript(chat):
+    """User messages of a stored chat, each with the question_index the live bot asked next"""
+    conversation = chat.get("conversation", [])
+    messages = []
+    for i, turn in enumerate(conversation):
+        if turn.get("role") != "user":
+            continue
+        reply = conversation[i + 1] if i + 1 < len(conversation) else None
+        original = reply.get("question_index") if reply and reply.get("role") == "bot" else None
+        messages.append((turn.get("message", ""), original))
+    return {
+        "session_id": chat["session_id"],
+        "questionnaire_name": chat.get("questionnaire_name"),
+        "instruments": chat.get("instruments"),
+        "age": chat.get("student_age") or 15,
+        "messages": messages,
+    }
+
+
+async def read_transcripts(args, db):
+    if args.source == "synthetic":
+        from utils.fake_llm import SYNTHETIC_ANSWERS
+        rng = random.Random(args.seed)
+        for i in range(args.sessions):
+            answers = [rng.choice(SYNTHETIC_ANSWERS) for _ in range(args.turns - 1)]
+            yield {
+                "session_id": f"synthetic-{i}",
+                "questionnaire_name": SYNTHETIC_QUESTIONNAIRE,
+                "instruments": None,
+                "age": rng.randint(8, 17),
+                "messages": [(message, None) for message in ["/start"] + answers],
+            }
+    elif args.source == "jsonl":
+        with open(args.input, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield to_transcript(json.loads(line))
+    else:
+        from database.archive import restore_archived
+        query = {"school": args.school} if args.school else {}
+        cursor = db["chats"].find(query, {"_id": 0}).batch_size(200)
+        if args.limit:
+            cursor = cursor.limit(args.limit)
+        async for chat in cursor:
+            yield to_transcript(await restore_archived(db, chat))
+
+
+class Replayer:
+    def __init__(self, args, db):
+        self.args = args
+        self.db = db
+        self.questionnaires = {}
+        self._lookup_lock = asyncio.Lock()
+        self.limits = {}
+        self.summary = defaultdict(lambda: defaultdict(float))
+
+    async def session_questions(self, transcript):
+        from database.bundle import get_bundle, get_bundled_questionnaire
+        from database.chatbot import connect_questionnaire_db, get_questionair
+        from routers.questionnaire import ITEM_BANK_NAME
+        from utils.fake_llm import synthetic_questionnaire
+
+        name = transcript["questionnaire_name"]
+        async with self._lookup_lock:
+            if name not in self.questionnaires:
+                if name == SYNTHETIC_QUESTIONNAIRE:
+                    data = synthetic_questionnaire(name, self.args.questions)
+                elif name == ITEM_BANK_NAME and get_bundle():
+                    data = {"questions": get_bundle().item_bank()}
+                else:
+                    data = get_bundled_questionnaire(name)
+                    if not data:
+                        # Transcripts from a file only need Mongo for questionnaires missing from the bundle
+                        if self.db is None:
+                            self.db = await connect_questionnaire_db()
+                        data = await get_questionair(self.db, name)
+                self.questionnaires[name] = data["questions"] if data else None
+        return self.questionnaires[name]
+
+    async def replay(self, transcript, model):
+        """Replay one transcript against one model; returns its rows"""
+        from routers.chat import next_question, extract_text_from_chunk
+        from routers.questionnaire import ITEM_BANK_NAME
+        from utils.rag_chain import get_chain
+        from utils.utils import MODELS, questions, questions_asked, last_question_index, status, item_bank_sessions, context_state
+
+        rows = []
+        session_questions = await self.session_questions(transcript)
+        if not session_questions:
+            return [dict.fromkeys(COLUMNS, None) | {
+                "model": model, "session_id": transcript["session_id"], "turn": 0,
+                "error": f"Questionnaire '{transcript['questionnaire_name']}' not found",
+            }]
+
+        # Session state lives in the same module dicts the routers use, under a private key
+        sid = f"replay:{model}:{transcript['session_id']}"
+        questions[sid] = session_questions
+        questions_asked[sid] = set()
+        last_question_index[sid] = 0
+        status[sid] = False
+        if transcript["questionnaire_name"] == ITEM_BANK_NAME:
+            item_bank_sessions[sid] = transcript["instruments"]
+        chat_history = {"conversation": []}
+        conversation = chat_history["conversation"]
+        try:
+            for turn, (message, original) in enumerate(transcript["messages"]):
+                row = dict.fromkeys(COLUMNS, None) | {
+                    "model": model, "session_id": transcript["session_id"], "turn": turn,
+                    "user_message": message, "original_question_index": original,
+                }
+                rows.append(row)
+                conversation.append({"role": "user", "message": message})
+                try:
+                    best_question_index, best_question = await next_question(sid, message, chat_history, session_questions)
+                    rag_chain = get_chain(llm=MODELS[model], age=transcript["age"], chat_history=chat_history, question=best_question)
+                    async with self.limits[model]:
+                        start = time.perf_counter()
+                        answer = await rag_chain.ainvoke({
+                            "input": message,
+                            "question": best_question,
+                            "context": "",
+                            "conversation": conversation,
+                            "age": transcript["age"]
+                        })
+                        row["latency_ms"] = round((time.perf_counter() - start) * 1000, 3)
+                except Exception as e:
+                    # The rest of the transcript would replay against a diverged history
+                    row["error"] = str(e)
+                    break
+                answer = extract_text_from_chunk(answer, model)
+                conversation.append({"role": "bot", "question_index": best_question_index, "question": best_question, "message": answer})
+                row.update(question_index=best_question_index, question=best_question, answer=answer)
+                if original is not None:
+                    row["same_question"] = original == best_question_index
+        finally:
+            for state in (questions, questions_asked, last_question_index, status, item_bank_sessions, context_state):
+                state.pop(sid, None)
+        return rows
+
+    def record(self, rows):
+        for row in rows:
+            stats = self.summary[row["model"]]
+            stats["turns"] += 1
+            if row["error"]:
+                stats["errors"] += 1
+            if row["latency_ms"] is not None:
+                stats["latency_ms"] += row["latency_ms"]
+            if row["same_question"] is not None:
+                stats["compared"] += 1
+                stats["same_question"] += row["same_question"]
+
+
+class ResultWriter:
+    """Parquet part files plus a checkpoint of the (model, session) pairs they contain"""
+
+    def __init__(self, out_dir, part_rows):
+        self.out_dir = out_dir
+        self.part_rows = part_rows
+        self.rows = []
+        self.pending = []
+        os.makedirs(out_dir, exist_ok=True)
+        path = os.path.join(out_dir, CHECKPOINT_FILE)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                checkpoint = json.load(f)
+        else:
+            checkpoint = {"parts": 0, "done": []}
+        self.parts = checkpoint["parts"]
+        self.done = set(checkpoint["done"])
+
+    @staticmethod
+    def key(model, session_id):
+        return f"{model}/{session_id}"
+
+    def add(self, model, session_id, rows):
+        self.rows.extend(rows)
+        self.pending.append(self.key(model, session_id))
+        if len(self.rows) >= self.part_rows:
+            self.flush()
+
+    def flush(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if not self.pending:
+            return
+        part = os.path.join(self.out_dir, f"part-{self.parts:05d}.parquet")
+        table = pa.Table.from_pydict({column: [row[column] for row in self.rows] for column in COLUMNS})
+        pq.write_table(table, part + ".tmp", compression="zstd")
+        os.replace(part + ".tmp", part)
+        # The checkpoint only names sessions whose part is fully written
+        self.parts += 1
+        self.done.update(self.pending)
+        path = os.path.join(self.out_dir, CHECKPOINT_FILE)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"parts": self.parts, "done": sorted(self.done)}, f)
+        os.replace(path + ".tmp", path)
+        self.rows, self.pending = [], []
+
+
+def parse_concurrency(values, models, default):
+    limits = dict.fromkeys(models, default)
+    for value in values:
+        model, _, limit = value.partition("=")
+        if model not in limits:
+            raise SystemExit(f"--concurrency names unknown model '{model}'")
+        limits[model] = int(limit)
+    return limits
+
+
+async def run(args):
+    from database import chatbot
+    from utils.utils import MODELS
+
+    models = args.models.split(",")
+    unknown = [m for m in models if m not in MODELS]
+    if unknown:
+        raise SystemExit(f"Unknown models {unknown}. Available: {list(MODELS.keys())}")
+    if args.fake_embeddings:
+        from utils.fake_llm import FakeEncoder
+        chatbot.model = FakeEncoder()
+    db = await chatbot.connect_questionnaire_db() if args.source == "mongo" else None
+
+    replayer = Replayer(args, db)
+    limits = parse_concurrency(args.concurrency, models, args.default_concurrency)
+    replayer.limits = {model: asyncio.Semaphore(limit) for model, limit in limits.items()}
+    writer = ResultWriter(args.out, args.part_rows)
+    skipped = len(writer.done)
+
+    # Enough sessions in flight to keep every model's slots busy between LLM calls
+    workers = sum(limits.values()) * 2
+    jobs = asyncio.Queue(maxsize=workers * 4)
+    started = time.perf_counter()
+    completed = 0
+
+    async def produce():
+        async for transcript in read_transcripts(args, db):
+            for model in models:
+                if writer.key(model, transcript["session_id"]) not in writer.done:
+                    await jobs.put((transcript, model))
+        for _ in range(workers):
+            await jobs.put(None)
+
+    async def work():
+        nonlocal completed
+        while (job := await jobs.get()) is not None:
+            transcript, model = job
+            rows = await replayer.replay(transcript, model)
+            replayer.record(rows)
+            writer.add(model, transcript["session_id"], rows)
+            completed += 1
+            if completed % args.progress_every == 0:
+                print(f"{completed} sessions replayed ({completed / (time.perf_counter() - started):.1f}/s)")
+
+    await asyncio.gather(produce(), *(work() for _ in range(workers)))
+    writer.flush()
+
+    elapsed = time.perf_counter() - started
+    print(f"Replayed {completed} sessions in {elapsed:.1f}s ({skipped} already in the checkpoint), results in {args.out}")
+    for model, stats in replayer.summary.items():
+        answered = stats["turns"] - stats["errors"]
+        mean_latency = stats["latency_ms"] / answered if answered else 0
+        same = f"{stats['same_question'] / stats['compared']:.1%}" if stats["compared"] else "n/a"
+        print(f"  {model}: {int(stats['turns'])} turns, {int(stats['errors'])} errors, "
+              f"mean latency {mean_latency:.1f} ms, same question as live {same}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", choices=["mongo", "jsonl", "synthetic"], default="mongo")
+    parser.add_argument("--input", help="JSON lines of chat documents, for --source jsonl")
+    parser.add_argument("--school", help="Only replay chats of this school (--source mongo)")
+    parser.add_argument("--limit", type=int, default=0, help="Replay at most this many chats (--source mongo)")
+    parser.add_argument("--sessions", type=int, default=100, help="Synthetic sessions")
+    parser.add_argument("--turns", type=int, default=8, help="User messages per synthetic session")
+    parser.add_argument("--questions", type=int, default=40, help="Questions in the synthetic questionnaire")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--models", default="Mistral", help="Comma separated model names")
+    parser.add_argument("--default-concurrency", type=int, default=4, help="Concurrent LLM calls per model")
+    parser.add_argument("--concurrency", action="append", default=[], metavar="MODEL=N",
+                        help="Override the concurrency of one model (repeatable)")
+    parser.add_argument("--fake-models", action="store_true", help="Use the deterministic local models (FAKE_MODELS)")
+    parser.add_argument("--fake-embeddings", action="store_true", help="Hash-based embeddings instead of the sentence transformer")
+    parser.add_argument("--out", default=None, help="Output directory; reuse it to resume a run")
+    parser.add_argument("--part-rows", type=int, default=5000, help="Rows per Parquet part file")
+    parser.add_argument("--progress-every", type=int, default=100)
+    args = parser.parse_args(argv)
+    if args.source == "jsonl" and not args.input:
+        parser.error("--source jsonl needs --input")
+    if args.out is None:
+        args.out = os.path.join("replays", time.strftime("%Y%m%d-%H%M%S"))
+    if args.fake_models:
+        # Must be set before utils.utils builds the model registry
+        os.environ["FAKE_MODELS"] = "1"
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
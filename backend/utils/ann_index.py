@@ -0,0 +1,168 @@
+import json
+import logging
+import os
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Directory written by scripts/build_ann_index.py; ids refer to rows of QUESTIONNAIRE_BUNDLE
+ITEM_BANK_INDEX = os.getenv("ITEM_BANK_INDEX")
+ITEM_BANK_N_PROBE = int(os.getenv("ITEM_BANK_N_PROBE", "8"))
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+class IVFIndex:
+    """Inverted-file index over unit vectors.
+
+    A spherical k-means quantizer splits the vectors into lists; a query scans
+    only the n_probe lists whose centroids are closest. Vectors are stored
+    grouped by list so each probe is one contiguous slice.
+    """
+
+    def __init__(self, centroids, vectors, ids, offsets, instruments, types, instrument_names: List[str]):
+        self.centroids = centroids
+        self.vectors = vectors
+        self.ids = ids
+        self.offsets = offsets
+        self.instruments = instruments
+        self.types = types
+        self.instrument_names = instrument_names
+        self._instrument_codes = {name: i for i, name in enumerate(instrument_names)}
+        # Map from bundle row id to position in the grouped arrays
+        self.positions = np.empty(len(ids), dtype=np.int64)
+        self.positions[ids] = np.arange(len(ids))
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, vectors, instruments: Sequence[str], types: Sequence[int], n_lists: Optional[int] = None,
+              iterations: int = 20, sample: int = 50000, seed: int = 0) -> "IVFIndex":
+        vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+        n = len(vectors)
+        n_lists = min(n, n_lists or max(1, int(np.sqrt(n))))
+        rng = np.random.default_rng(seed)
+        train = vectors[rng.choice(n, min(n, sample), replace=False)]
+        centroids = train[rng.choice(len(train), n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            assign = np.argmax(train @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, train)
+            counts = np.bincount(assign, minlength=n_lists)
+            empty = counts == 0
+            # Reseed empty lists with random training points
+            sums[empty] = train[rng.integers(len(train), size=int(empty.sum()))]
+            centroids = _normalize(sums)
+
+        assign = np.concatenate([
+            np.argmax(vectors[i:i + 8192] @ centroids.T, axis=1) for i in range(0, n, 8192)
+        ]) if n else np.zeros(0, dtype=np.int64)
+        order = np.argsort(assign, kind="stable")
+        offsets = np.searchsorted(assign[order], np.arange(n_lists + 1))
+
+        instrument_names = sorted(set(instruments))
+        codes = {name: i for i, name in enumerate(instrument_names)}
+        instrument_codes = np.array([codes[name] for name in instruments], dtype=np.int32)
+        return cls(centroids, vectors[order], order.astype(np.int64), offsets.astype(np.int64),
+                   instrument_codes[order], np.asarray(types, dtype=np.int32)[order], instrument_names)
+
+    def save(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        for name in ("centroids", "vectors", "ids", "offsets", "instruments", "types"):
+            np.save(os.path.join(path, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"instrument_names": self.instrument_names, "n_lists": self.n_lists, "rows": len(self.ids)}, f)
+
+    @classmethod
+    def load(cls, path: str) -> "IVFIndex":
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r" if name == "vectors" else None)
+                  for name in ("centroids", "vectors", "ids", "offsets", "instruments", "types")}
+        return cls(instrument_names=meta["instrument_names"], **arrays)
+
+    def _filter(self, rows: np.ndarray, exclude: Optional[Iterable[int]], instruments: Optional[Iterable[str]],
+                types: Optional[Iterable[int]]) -> np.ndarray:
+        mask = np.ones(len(rows), dtype=bool)
+        if types is not None:
+            mask &= np.isin(self.types[rows], list(types))
+        if instruments:
+            codes = [self._instrument_codes[name] for name in instruments if name in self._instrument_codes]
+            mask &= np.isin(self.instruments[rows], codes)
+        if exclude:
+            excluded = [i for i in exclude if 0 <= i < len(self.ids)]
+            if excluded:
+                mask &= np.isin(rows, self.positions[excluded], invert=True)
+        return rows[mask]
+
+    def _top_k(self, rows: np.ndarray, query: np.ndarray, k: int) -> List[Tuple[int, float]]:
+        if not len(rows):
+            return []
+        scores = self.vectors[rows] @ query
+        k = min(k, len(rows))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(self.ids[rows[i]]), float(scores[i])) for i in top]
+
+    def search(self, query, k: int = 1, n_probe: int = ITEM_BANK_N_PROBE, exclude: Optional[Iterable[int]] = None,
+               instruments: Optional[Iterable[str]] = None, types: Optional[Iterable[int]] = None) -> List[Tuple[int, float]]:
+        """Approximate top-k (bundle row id, cosine) among items passing the filters"""
+        query = _normalize(np.asarray(query, dtype=np.float32))
+        probe = np.argsort(-(self.centroids @ query))[:n_probe]
+        rows = np.concatenate([np.arange(self.offsets[c], self.offsets[c + 1]) for c in probe])
+        rows = self._filter(rows, exclude, instruments, types)
+        if not len(rows) and n_probe < self.n_lists:
+            # Filters emptied the probed lists; widen to everything
+            return self.exact_search(query, k, exclude, instruments, types)
+        return self._top_k(rows, query, k)
+
+    def exact_search(self, query, k: int = 1, exclude: Optional[Iterable[int]] = None,
+                     instruments: Optional[Iterable[str]] = None, types: Optional[Iterable[int]] = None) -> List[Tuple[int, float]]:
+        """Brute-force search with the same filters, the reference for recall"""
+        query = _normalize(np.asarray(query, dtype=np.float32))
+        rows = self._filter(np.arange(len(self.ids)), exclude, instruments, types)
+        return self._top_k(rows, query, k)
+
+    def rank(self, user_embedding, asked_questions_set, instruments: Optional[Iterable[str]] = None, k: int = 1,
+             n_probe: int = ITEM_BANK_N_PROBE) -> List[Tuple[int, float]]:
+        """Up to k items in the order select would pick them: items that are not type 1 first, then type 1"""
+        other_types = [t for t in np.unique(self.types).tolist() if t != 1]
+        ranked = []
+        for types in (other_types, [1]):
+            if len(ranked) < k:
+                ranked += self.search(user_embedding, k - len(ranked), n_probe, asked_questions_set, instruments, types)
+        return ranked
+
+    def select(self, user_embedding, asked_questions_set, instruments: Optional[Iterable[str]] = None,
+               n_probe: int = ITEM_BANK_N_PROBE):
+        """Same contract as sim_search: prefer items that are not type 1, then fall back to type 1"""
+        ranked = self.rank(user_embedding, asked_questions_set, instruments, 1, n_probe)
+        return ranked[0] if ranked else (None, -1)
+
+
+_index: Optional[IVFIndex] = None
+_index_failed = False
+
+
+def get_item_bank_index() -> Optional[IVFIndex]:
+    """Open ITEM_BANK_INDEX on first use; None when unset or unreadable"""
+    global _index, _index_failed
+    if _index is None and ITEM_BANK_INDEX and not _index_failed:
+        try:
+            _index = IVFIndex.load(ITEM_BANK_INDEX)
+            logger.info(f"Opened item bank index {ITEM_BANK_INDEX} ({len(_index.ids)} items, {_index.n_lists} lists)")
+        except Exception as e:
+            _index_failed = True
+            logger.error(f"Error opening item bank index {ITEM_BANK_INDEX}: {e}")
+    return _index
@@ -0,0 +1,73 @@
+import os
+from collections import deque
+from typing import List
+
+import numpy as np
+from dotenv import load_dotenv
+from database.chatbot import get_embedding, get_embeddings
+from utils.utils import context_state
+
+load_dotenv()
+
+# "incremental" keeps a rolling vector per session, "full" re-embeds question + last messages every turn
+CONTEXT_EMBEDDING_MODE = os.getenv("CONTEXT_EMBEDDING_MODE", "incremental")
+CONTEXT_WINDOW = int(os.getenv("CONTEXT_WINDOW", "6"))
+# Weight of a message relative to the one after it; 1.0 weighs the whole window equally
+CONTEXT_DECAY = float(os.getenv("CONTEXT_DECAY", "0.7"))
+# Also run the full-string selection and count how often the chosen question differs
+CONTEXT_EMBEDDING_COMPARE = os.getenv("CONTEXT_EMBEDDING_COMPARE", "0") == "1"
+# Sessions whose vectors are kept; an evicted session re-embeds its window on its next turn
+CONTEXT_STATE_MAX_SESSIONS = int(os.getenv("CONTEXT_STATE_MAX_SESSIONS", "5000"))
+
+
+def full_context_text(question: str, conversation: List[dict]) -> str:
+    """The question followed by the last CONTEXT_WINDOW messages, as embedded by the full mode"""
+    text = ""
+    for conv in conversation[-CONTEXT_WINDOW:]:
+        text += " " + f"{conv.get('message', '')}"
+    return question + text
+
+
+def rolling_vector(vectors) -> List[float]:
+    """Recency-weighted, normalised sum of message vectors ordered oldest to newest"""
+    stacked = np.array(vectors)
+    weights = CONTEXT_DECAY ** np.arange(len(stacked) - 1, -1, -1)
+    combined = weights @ stacked
+    norm = np.linalg.norm(combined)
+    return (combined / norm if norm else combined).tolist()
+
+
+async def context_embedding(session_id: str, question: str, conversation: List[dict]) -> List[float]:
+    """Embedding of the conversation context used to pick the next question.
+
+    In incremental mode only messages added since the last call are embedded
+    (normally the previous bot turn and the new answer, in one batch); their
+    vectors are cached in context_state and combined with the cached ones.
+    """
+    if CONTEXT_EMBEDDING_MODE == "full":
+        return await get_embedding(full_context_text(question, conversation))
+
+    state = context_state.get(session_id)
+    if state is None:
+        state = context_state[session_id] = {"vectors": deque(maxlen=CONTEXT_WINDOW), "embedded": 0}
+        while len(context_state) > CONTEXT_STATE_MAX_SESSIONS:
+            context_state.popitem(last=False)
+    else:
+        context_state.move_to_end(session_id)
+    new_messages = conversation[state["embedded"]:][-CONTEXT_WINDOW:]
+    if not conversation or conversation[-1].get("message") != question:
+        # The answer has not been stored (or read back) yet; embed it without caching
+        new_messages = new_messages + [{"message": question}]
+        cache_upto = len(new_messages) - 1
+    else:
+        cache_upto = len(new_messages)
+    vectors = await get_embeddings([m.get("message", "") for m in new_messages]) if new_messages else []
+    state["vectors"].extend(vectors[:cache_upto])
+    state["embedded"] = len(conversation)
+    window = list(state["vectors"]) + vectors[cache_upto:]
+    return rolling_vector(window[-CONTEXT_WINDOW:])
+
+
+def forget_session(session_id: str):
+    """Drop the cached vectors of a session that has ended"""
+    context_state.pop(session_id, None)
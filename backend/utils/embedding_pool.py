@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+# 0 keeps encoding in the API process (asyncio.to_thread)
+EMBEDDING_WORKERS = int(os.getenv("EMBEDDING_WORKERS", "0"))
+EMBEDDING_WORKER_THREADS = int(os.getenv("EMBEDDING_WORKER_THREADS", "1"))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+
+# Per-process model, loaded once by the pool initializer
+_worker_model = None
+
+
+def _init_worker(model_name: str, threads: int):
+    """Load the sentence transformer once inside a worker process"""
+    global _worker_model
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    torch.set_num_threads(threads)
+    _worker_model = SentenceTransformer(model_name)
+
+
+def _worker_dimension() -> int:
+    return _worker_model.get_sentence_embedding_dimension()
+
+
+def _encode_into(shm_name: str, total_rows: int, dim: int, start: int, texts: List[str]) -> int:
+    """Encode texts and write the vectors into rows [start, start + len(texts)) of the shared block"""
+    vectors = _worker_model.encode(texts, normalize_embeddings=True, convert_to_numpy=True)
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        out = np.ndarray((total_rows, dim), dtype=np.float32, buffer=shm.buf)
+        out[start:start + len(texts)] = vectors
+        del out
+    finally:
+        shm.close()
+    return len(texts)
+
+
+def _release(shm: shared_memory.SharedMemory, chunks: List[Future]):
+    """Free the shared block once no worker can write into it: queued chunks are cancelled, running ones finish first"""
+    running = [chunk for chunk in chunks if not chunk.cancel() and not chunk.done()]
+
+    def free():
+        shm.close()
+        shm.unlink()
+
+    if not running:
+        free()
+        return
+    left = [len(running)]
+    lock = threading.Lock()
+
+    def finished(_):
+        with lock:
+            left[0] -= 1
+            last = left[0] == 0
+        if last:
+            free()
+
+    for chunk in running:
+        chunk.add_done_callback(finished)
+
+
+class EmbeddingPool:
+    """Pool of worker processes that each hold their own copy of the embedding model.
+
+    Texts go to the workers over the executor pipe, vectors come back through a
+    shared memory block so large batches are never pickled.
+    """
+
+    def __init__(self, workers: int, model_name: str = EMBEDDING_MODEL,
+                 threads: int = EMBEDDING_WORKER_THREADS, batch_size: int = EMBEDDING_BATCH_SIZE):
+        self.workers = workers
+        self.model_name = model_name
+        self.threads = threads
+        self.batch_size = batch_size
+        self.dim: Optional[int] = None
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    async def start(self):
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.model_name, self.threads),
+        )
+        loop = asyncio.get_running_loop()
+        # Touch every worker so models are loaded before the first request
+        dims = await asyncio.gather(*[
+            loop.run_in_executor(self._executor, _worker_dimension) for _ in range(self.workers)
+        ])
+        self.dim = dims[0]
+        logger.info(f"Embedding pool started with {self.workers} workers (dim={self.dim})")
+
+    def shutdown(self):
+        if self._executor:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+            logger.info("Embedding pool stopped")
+
+    async def encode(self, texts: List[str]) -> np.ndarray:
+        """Encode texts across the workers and return a (len(texts), dim) float32 array"""
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        rows = len(texts)
+        shm = shared_memory.SharedMemory(create=True, size=rows * self.dim * 4)
+        chunks: List[Future] = []
+        try:
+            # Spread small requests one text per worker, large ones in batch_size chunks
+            step = max(1, min(self.batch_size, -(-rows // self.workers)))
+            for i in range(0, rows, step):
+                chunks.append(self._executor.submit(_encode_into, shm.name, rows, self.dim, i, texts[i:i + step]))
+            done, _ = await asyncio.wait([asyncio.wrap_future(chunk) for chunk in chunks],
+                                         return_when=asyncio.FIRST_EXCEPTION)
+            for chunk in done:
+                chunk.result()
+            result = np.ndarray((rows, self.dim), dtype=np.float32, buffer=shm.buf).copy()
+        finally:
+            # After a failure or cancellation other chunks may still be writing into the block
+            _release(shm, chunks)
+        return result
+
+
+pool: Optional[EmbeddingPool] = None
+
+
+async def start_pool():
+    """Start the worker pool if EMBEDDING_WORKERS is set"""
+    global pool
+    if EMBEDDING_WORKERS <= 0:
+        return None
+    pool = EmbeddingPool(EMBEDDING_WORKERS)
+    await pool.start()
+    return pool
+
+
+def stop_pool():
+    global pool
+    if pool:
+        pool.shutdown()
+        pool = None
@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+from typing import Dict, Optional, Set
+
+from dotenv import load_dotenv
+from utils.metrics import FEED_EVENTS
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# "bus": routers publish in-process (standalone server)
+# "change_stream": every worker tails the chats collection (needs a replica set)
+PSYCHOLOGIST_FEED_SOURCE = os.getenv("PSYCHOLOGIST_FEED_SOURCE", "bus")
+PSYCHOLOGIST_FEED_QUEUE_SIZE = int(os.getenv("PSYCHOLOGIST_FEED_QUEUE_SIZE", "256"))
+PSYCHOLOGIST_FEED_HEARTBEAT = float(os.getenv("PSYCHOLOGIST_FEED_HEARTBEAT", "15"))
+# Sessions whose school is remembered for filtering; older ones are looked up again when needed
+PSYCHOLOGIST_FEED_MAX_SESSIONS = int(os.getenv("PSYCHOLOGIST_FEED_MAX_SESSIONS", "10000"))
+
+SESSION_STARTED = "session_started"
+SESSION_COMPLETED = "session_completed"
+DIAGNOSIS_SET = "diagnosis_set"
+RESYNC = "resync"
+
+
+class Subscription:
+    def __init__(self, school: Optional[str], queue_size: int):
+        self.school = school
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+
+    def put(self, event: dict):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # A consumer this far behind gets one resync marker and refetches the table
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({"type": RESYNC})
+
+
+class EventBus:
+    """Fan-out of session deltas to the psychologist feeds of this process"""
+
+    def __init__(self, queue_size: int = PSYCHOLOGIST_FEED_QUEUE_SIZE, max_sessions: int = PSYCHOLOGIST_FEED_MAX_SESSIONS):
+        self.queue_size = queue_size
+        self.max_sessions = max_sessions
+        # Subscriptions by the school they follow (None = every school); empty sets are removed
+        self.subscribers: Dict[Optional[str], Set[Subscription]] = {}
+        # session_id -> school, so later deltas can be filtered without a read; least recently used first
+        self.schools: "OrderedDict[str, Optional[str]]" = OrderedDict()
+
+    def subscribe(self, school: Optional[str] = None) -> Subscription:
+        subscription = Subscription(school, self.queue_size)
+        self.subscribers.setdefault(school, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscriptions = self.subscribers.get(subscription.school)
+        if subscriptions is not None:
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self.subscribers[subscription.school]
+
+    def subscriber_count(self) -> int:
+        return sum(len(subscriptions) for subscriptions in self.subscribers.values())
+
+    def publish(self, event_type: str, session_id: str, school: Optional[str] = None, **data):
+        if school is not None:
+            self.schools[session_id] = school
+            self.schools.move_to_end(session_id)
+            while len(self.schools) > self.max_sessions:
+                self.schools.popitem(last=False)
+        else:
+            school = self.schools.get(session_id)
+        event = {"type": event_type, "session_id": session_id, "school": school, **data}
+        FEED_EVENTS.inc(event_type)
+        for key in {None, school}:
+            for subscription in list(self.subscribers.get(key, ())):
+                subscription.put(event)
+
+
+bus = EventBus()
+
+
+def publish(event_type: str, session_id: str, school: Optional[str] = None, **data):
+    """Publish a delta from a router; a no-op when the change stream is the source"""
+    if PSYCHOLOGIST_FEED_SOURCE != "bus":
+        return
+    bus.publish(event_type, session_id, school, **data)
+
+
+async def publish_for_session(db, event_type: str, session_id: str, **data):
+    """Publish a delta for a session whose school the caller does not have at hand"""
+    if PSYCHOLOGIST_FEED_SOURCE != "bus":
+        return
+    school = bus.schools.get(session_id)
+    if school is None:
+        chat = await db["chats"].find_one({"session_id": session_id}, {"school": 1})
+        school = chat.get("school") if chat else None
+    bus.publish(event_type, session_id, school, **data)
+
+
+def _event_from_change(change: dict) -> Optional[tuple]:
+    doc = change.get("fullDocument") or {}
+    session_id = doc.get("session_id")
+    if not session_id:
+        return None
+    if change["operationType"] == "insert":
+        session = {k: v for k, v in doc.items() if k not in ("_id", "conversation")}
+        return SESSION_STARTED, session_id, doc.get("school"), {"session": session}
+    updated = change.get("updateDescription", {}).get("updatedFields", {})
+    if "diagnosis" in updated:
+        return DIAGNOSIS_SET, session_id, doc.get("school"), {"diagnosis": updated["diagnosis"]}
+    if "feedback" in updated:
+        return SESSION_COMPLETED, session_id, doc.get("school"), {"feedback": updated["feedback"]}
+    return None
+
+
+async def watch_chats(db):
+    """Feed the bus from a Mongo change stream on the chats collection, resuming after errors"""
+    pipeline = [{"$match": {"$or": [
+        {"operationType": "insert"},
+        {"updateDescription.updatedFields.diagnosis": {"$exists": True}},
+        {"updateDescription.updatedFields.feedback": {"$exists": True}},
+    ]}}]
+    resume_token = None
+    while True:
+        try:
+            async with db["chats"].watch(pipeline, full_document="updateLookup", resume_after=resume_token) as stream:
+                async for change in stream:
+                    resume_token = stream.resume_token
+                    event = _event_from_change(change)
+                    if event:
+                        event_type, session_id, school, data = event
+                        bus.publish(event_type, session_id, school, **data)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Chats change stream failed, restarting: {e}")
+            await asyncio.sleep(1)
+
+
+_watch_task: Optional[asyncio.Task] = None
+
+
+def start_feed(db):
+    global _watch_task
+    if PSYCHOLOGIST_FEED_SOURCE == "change_stream":
+        _watch_task = asyncio.create_task(watch_chats(db))
+    return _watch_task
+
+
+def stop_feed():
+    global _watch_task
+    if _watch_task:
+        _watch_task.cancel()
+        _watch_task = None
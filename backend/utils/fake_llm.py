@@ -0,0 +1,108 @@
+import asyncio
+import hashlib
+import time
+from typing import Any, AsyncIterator, List, Optional
+
+import numpy as np
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+VOCABULARY = [
+    "that", "sounds", "really", "important", "thank", "you", "for", "sharing",
+    "how", "do", "you", "feel", "about", "it", "when", "this", "happens",
+    "could", "tell", "me", "a", "little", "more", "at", "school", "or", "home",
+]
+EMBEDDING_DIM = 384
+
+# Student replies used by synthetic sessions
+SYNTHETIC_ANSWERS = [
+    "yes",
+    "not really",
+    "I get angry when my brother takes my things and then I shout at him",
+    "sometimes I feel sad at school because nobody wants to play with me",
+    "I sleep fine most nights but sometimes I have bad dreams",
+    "my teacher says I talk too much in class",
+    "no",
+    "I like drawing and playing football with my friends after school",
+]
+
+
+class FakeStreamingChatModel(BaseChatModel):
+    """Deterministic chat model for local benchmarks and CI runs.
+
+    The reply is derived from a hash of the prompt, so the same input always
+    streams the same tokens with the configured latencies.
+    """
+
+    model_name: str = "fake"
+    ttft: float = 0.2
+    token_delay: float = 0.02
+    tokens: int = 32
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-streaming"
+
+    def _reply(self, messages: List[BaseMessage]) -> List[str]:
+        prompt = "\n".join(str(m.content) for m in messages)
+        seed = hashlib.sha256(f"{self.model_name}:{prompt}".encode("utf-8")).digest()
+        words = [VOCABULARY[seed[i % len(seed)] % len(VOCABULARY)] for i in range(self.tokens)]
+        return [w if i == 0 else " " + w for i, w in enumerate(words)]
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager=None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.ttft + self.token_delay * (self.tokens - 1))
+        text = "".join(self._reply(messages))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager=None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.ttft + self.token_delay * (self.tokens - 1))
+        text = "".join(self._reply(messages))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager=None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.ttft)
+        for i, token in enumerate(self._reply(messages)):
+            if i:
+                await asyncio.sleep(self.token_delay)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+
+def fake_vector(text: str) -> List[float]:
+    """Deterministic unit vector, so offline runs never download the embedding model"""
+    digest = hashlib.sha256(text.encode("utf-8")).digest()
+    values = [(digest[i % len(digest)] - 127.5) / 127.5 for i in range(EMBEDDING_DIM)]
+    norm = sum(v * v for v in values) ** 0.5
+    return [v / norm for v in values]
+
+
+class FakeEncoder:
+    """Stands in for the sentence transformer behind database.chatbot.get_model"""
+
+    def encode(self, texts, normalize_embeddings=True):
+        if isinstance(texts, str):
+            return np.array(fake_vector(texts), dtype=np.float32)
+        return np.array([fake_vector(t) for t in texts], dtype=np.float32)
+
+
+def synthetic_questionnaire(name: str, questions: int) -> dict:
+    """Questionnaire document with fake question vectors; every fifth question is type 1"""
+    return {
+        "questionnaire": name,
+        "instructions": "Synthetic questionnaire for benchmarks",
+        "questions": [
+            {
+                "question": f"Synthetic screening question number {i}",
+                "type": 1 if i % 5 == 4 else 0,
+                "question_vector": fake_vector(f"question {i}"),
+            }
+            for i in range(questions)
+        ],
+    }
@@ -0,0 +1,190 @@
+import hashlib
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Set
+from urllib.parse import unquote
+
+from dotenv import load_dotenv
+from starlette.requests import Request
+from starlette.responses import Response
+from utils.metrics import HTTP_CACHE_REQUESTS
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+HTTP_CACHE = os.getenv("HTTP_CACHE", "1") == "1"
+HTTP_CACHE_MAX_BYTES = int(os.getenv("HTTP_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+# Other workers do not see this worker's invalidations; entries they hold expire after this long
+HTTP_CACHE_TTL = float(os.getenv("HTTP_CACHE_TTL", "300"))
+
+
+class CachePolicy:
+    """Caching rules for one route template, e.g. /api/get/chat/{session_id}"""
+
+    def __init__(self, template: str, cache_control: str, tags: Callable[[dict], List[str]], ttl: float = HTTP_CACHE_TTL):
+        self.template = template
+        self.pattern = re.compile("^" + re.sub(r"\{(\w+)\}", r"(?P<\1>[^/]+)", template) + "$")
+        self.cache_control = cache_control
+        self.tags = tags
+        self.ttl = ttl
+
+
+def _chat_tags(params: dict) -> List[str]:
+    return [f"chat:{params['session_id']}"]
+
+
+POLICIES = [
+    CachePolicy("/api/get/models", "public, max-age=3600", lambda params: ["models"]),
+    CachePolicy("/api/get/questionnaires", "public, max-age=60", lambda params: ["questionnaires"]),
+    CachePolicy("/api/get/questionnaire/{name}", "public, max-age=60", lambda params: ["questionnaires"]),
+    # Transcripts are personal data: only the browser may keep them, and it has to revalidate
+    CachePolicy("/api/get/chat/{session_id}", "private, no-cache", _chat_tags),
+    CachePolicy("/api/psychologist/chat/{session_id}", "private, no-cache", _chat_tags),
+]
+
+
+class CachedResponse:
+    __slots__ = ("etag", "body", "media_type", "cache_control", "tags", "expires_at", "route")
+
+    def __init__(self, etag, body, media_type, cache_control, tags, expires_at, route):
+        self.etag = etag
+        self.body = body
+        self.media_type = media_type
+        self.cache_control = cache_control
+        self.tags = tags
+        self.expires_at = expires_at
+        self.route = route
+
+
+class ResponseCache:
+    """Rendered GET responses by URL, least recently used evicted first, dropped by tag on writes"""
+
+    def __init__(self, max_bytes: int = HTTP_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        self.by_tag: Dict[str, Set[str]] = {}
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at < time.monotonic():
+            self.discard(key)
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key: str, entry: CachedResponse):
+        if len(entry.body) > self.max_bytes // 8:
+            return
+        self.discard(key)
+        self.entries[key] = entry
+        self.size += len(entry.body)
+        for tag in entry.tags:
+            self.by_tag.setdefault(tag, set()).add(key)
+        while self.size > self.max_bytes:
+            self.discard(next(iter(self.entries)))
+
+    def discard(self, key: str):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        self.size -= len(entry.body)
+        for tag in entry.tags:
+            keys = self.by_tag.get(tag)
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    del self.by_tag[tag]
+
+    def invalidate(self, *tags: str):
+        for tag in tags:
+            for key in list(self.by_tag.get(tag, ())):
+                self.discard(key)
+
+
+cache = ResponseCache()
+
+
+def invalidate(*tags: str):
+    """Drop cached responses built from data that was just written"""
+    cache.invalidate(*tags)
+
+
+def invalidate_chat(session_id: str):
+    cache.invalidate(f"chat:{session_id}")
+
+
+def no_store(request: Request):
+    """Called by an endpoint whose response may still change, so it is revalidated but not kept"""
+    request.state.http_cache_store = False
+
+
+def _etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def _matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+def _not_modified(etag: str, cache_control: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+
+
+def _policy_for(path: str):
+    for policy in POLICIES:
+        match = policy.pattern.match(path)
+        if match:
+            return policy, {k: unquote(v) for k, v in match.groupdict().items()}
+    return None, None
+
+
+async def middleware(request: Request, call_next):
+    """ETag / Cache-Control for the read-mostly getters, backed by the rendered-response cache"""
+    if not HTTP_CACHE or request.method != "GET":
+        return await call_next(request)
+    policy, params = _policy_for(request.url.path)
+    if policy is None:
+        return await call_next(request)
+
+    key = str(request.url.path) + ("?" + request.url.query if request.url.query else "")
+    if_none_match = request.headers.get("if-none-match")
+    entry = cache.get(key)
+    if entry is not None:
+        # Keep the route for the request metrics, which label by the matched route
+        request.scope["route"] = entry.route
+        if _matches(if_none_match, entry.etag):
+            HTTP_CACHE_REQUESTS.inc(policy.template, "not_modified")
+            return _not_modified(entry.etag, entry.cache_control)
+        HTTP_CACHE_REQUESTS.inc(policy.template, "hit")
+        return Response(entry.body, media_type=entry.media_type,
+                        headers={"ETag": entry.etag, "Cache-Control": entry.cache_control})
+
+    response = await call_next(request)
+    if response.status_code != 200:
+        HTTP_CACHE_REQUESTS.inc(policy.template, "bypass")
+        return response
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    etag = _etag(body)
+    headers = {k: v for k, v in response.headers.items() if k.lower() != "content-length"}
+    headers.update({"ETag": etag, "Cache-Control": policy.cache_control})
+    if getattr(request.state, "http_cache_store", True):
+        cache.put(key, CachedResponse(etag, body, response.media_type or headers.get("content-type"),
+                                      policy.cache_control, policy.tags(params),
+                                      time.monotonic() + policy.ttl, request.scope.get("route")))
+    if _matches(if_none_match, etag):
+        HTTP_CACHE_REQUESTS.inc(policy.template, "not_modified")
+        return _not_modified(etag, policy.cache_control)
+    HTTP_CACHE_REQUESTS.inc(policy.template, "miss")
+    return Response(body, status_code=200, headers=headers)
@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+import httpx
+from dotenv import load_dotenv
+from utils.metrics import LLM_CONNECTIONS_OPENED, LLM_CONNECT_SECONDS
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+try:
+    import h2  # noqa: F401  (httpx needs it for HTTP/2)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    """Reads an event stream to its end once the final [DONE] event arrives.
+
+    huggingface_hub stops iterating at [DONE] and leaves the response open
+    until the whole client is closed, so without this the connection is
+    never handed back to the pool and the next request opens a new one.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    async def __aiter__(self):
+        chunks = self.stream.__aiter__()
+        tail = b""
+        async for chunk in chunks:
+            tail = tail[-16:] + chunk
+            if b"data: [DONE]" in tail:
+                # All that follows is the end of the chunked body
+                chunk += b"".join([rest async for rest in chunks])
+                await self.stream.aclose()
+            yield chunk
+
+    async def aclose(self):
+        await self.stream.aclose()
+
+
+class _SharedTransport(httpx.AsyncBaseTransport):
+    """Hands a provider's pool to SDK clients without letting them close it.
+
+    The SDKs build their own httpx.AsyncClient and close it (and its transport)
+    with themselves, so each gets this wrapper around the one shared pool. It
+    also traces new connections, which is where the handshake cost shows up.
+    """
+
+    def __init__(self, provider: "ProviderTransport"):
+        self.provider = provider
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if "trace" not in request.extensions:
+            request.extensions["trace"] = self.provider.tracer()
+        response = await self.provider.transport().handle_async_request(request)
+        if response.headers.get("content-type", "").startswith("text/event-stream"):
+            response.stream = _ReleasingStream(response.stream)
+        return response
+
+    async def aclose(self):
+        pass
+
+
+class ProviderTransport:
+    """Keep-alive connection pool and timeouts for one model provider, tunable with LLM_HTTP_<NAME>_* variables"""
+
+    def __init__(self, name: str, origin: str, max_connections: int = 20, keepalive: int = 10,
+                 keepalive_expiry: float = 90.0, connect_timeout: float = 5.0, read_timeout: float = 60.0,
+                 http2: bool = True, warm: int = 2):
+        prefix = f"LLM_HTTP_{name.upper()}_"
+        self.name = name
+        self.origin = os.getenv(prefix + "ORIGIN", origin)
+        self.max_connections = int(os.getenv(prefix + "MAX_CONNECTIONS", str(max_connections)))
+        self.keepalive = int(os.getenv(prefix + "KEEPALIVE", str(keepalive)))
+        # httpx drops idle connections after 5 seconds by default, which bursty traffic keeps paying for
+        self.keepalive_expiry = float(os.getenv(prefix + "KEEPALIVE_EXPIRY", str(keepalive_expiry)))
+        self.connect_timeout = float(os.getenv(prefix + "CONNECT_TIMEOUT", str(connect_timeout)))
+        self.read_timeout = float(os.getenv(prefix + "READ_TIMEOUT", str(read_timeout)))
+        self.http2 = os.getenv(prefix + "HTTP2", "1" if http2 else "0") == "1" and HTTP2_AVAILABLE
+        # Connections opened at startup; one is enough when HTTP/2 multiplexes
+        self.warm_connections = int(os.getenv(prefix + "WARM", str(1 if self.http2 else warm)))
+        self._transport: Optional[httpx.AsyncHTTPTransport] = None
+
+    @property
+    def timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(self.read_timeout, connect=self.connect_timeout, pool=self.connect_timeout)
+
+    def transport(self) -> httpx.AsyncHTTPTransport:
+        if self._transport is None:
+            self._transport = httpx.AsyncHTTPTransport(
+                http2=self.http2,
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.keepalive,
+                                    keepalive_expiry=self.keepalive_expiry),
+            )
+        return self._transport
+
+    def client(self, **kwargs) -> httpx.AsyncClient:
+        """A client over the shared pool; closing it leaves the pool open"""
+        return httpx.AsyncClient(transport=_SharedTransport(self), timeout=self.timeout, **kwargs)
+
+    def tracer(self):
+        """httpcore trace hook for one request, timing any connection it has to open"""
+        started = {}
+
+        async def trace(event: str, info: dict):
+            if event == "connection.connect_tcp.started":
+                started["tcp"] = time.perf_counter()
+            elif event == "connection.connect_tcp.complete":
+                LLM_CONNECTIONS_OPENED.inc(self.name)
+                LLM_CONNECT_SECONDS.observe(time.perf_counter() - started.pop("tcp"), self.name, "tcp")
+            elif event == "connection.start_tls.started":
+                started["tls"] = time.perf_counter()
+            elif event == "connection.start_tls.complete":
+                LLM_CONNECT_SECONDS.observe(time.perf_counter() - started.pop("tls"), self.name, "tls")
+
+        return trace
+
+    async def warm(self):
+        """Open connections (TCP, TLS, protocol negotiation) before the first user needs them"""
+        async with self.client() as client:
+            async def touch():
+                try:
+                    await client.head(self.origin)
+                except httpx.HTTPError as e:
+                    logger.warning(f"Could not pre-warm a connection to {self.origin} ({self.name}): {e}")
+            await asyncio.gather(*(touch() for _ in range(self.warm_connections)))
+
+    async def aclose(self):
+        if self._transport is not None:
+            await self._transport.aclose()
+            self._transport = None
+
+
+providers: Dict[str, ProviderTransport] = {
+    "huggingface": ProviderTransport("huggingface", "https://router.huggingface.co", read_timeout=120.0),
+    "gemini": ProviderTransport("gemini", "https://generativelanguage.googleapis.com", read_timeout=60.0),
+}
+
+
+def use_pooled_transports():
+    """Route the huggingface_hub async clients through the shared pool"""
+    from huggingface_hub import set_async_client_factory
+    try:
+        # Same request id / error body hooks as the hub's default factory
+        from huggingface_hub.utils._http import async_hf_request_event_hook, async_hf_response_event_hook
+        event_hooks = {"request": [async_hf_request_event_hook], "response": [async_hf_response_event_hook]}
+    except ImportError:
+        event_hooks = None
+    set_async_client_factory(lambda: providers["huggingface"].client(follow_redirects=True, event_hooks=event_hooks))
+
+
+def pooled_gemini_client(api_key: Optional[str]):
+    """google-genai client whose async calls go through the shared pool"""
+    from google.genai import Client
+    from google.genai.types import HttpOptions
+    gemini = providers["gemini"]
+    return Client(api_key=api_key, http_options=HttpOptions(
+        httpx_async_client=gemini.client(),
+        timeout=int(gemini.read_timeout * 1000),
+    ))
+
+
+async def warm_up():
+    await asyncio.gather(*(provider.warm() for provider in providers.values()))
+    logger.info("Pre-warmed model provider connections: " + ", ".join(
+        f"{p.name} x{p.warm_connections} ({'HTTP/2' if p.http2 else 'HTTP/1.1'})" for p in providers.values()))
+
+
+async def close():
+    for provider in providers.values():
+        await provider.aclose()
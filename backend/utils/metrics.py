@@ -0,0 +1,247 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Tuple
+
+# Latency buckets in seconds, from sub-millisecond Mongo hits to slow LLM generations
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+REGISTRY: List["_Metric"] = []
+
+
+class _Metric:
+    """Base for metrics whose hot-path writes go to a per-thread shard.
+
+    Each thread gets its own dict of label values -> cell, so recording never
+    takes a lock; shards are only merged when the metrics are rendered.
+    """
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._local = threading.local()
+        self._shards: List[Dict[tuple, list]] = []
+        self._shards_lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _new_cell(self) -> list:
+        raise NotImplementedError
+
+    def _cell(self, labels: tuple) -> list:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._shards_lock:
+                self._shards.append(shard)
+        cell = shard.get(labels)
+        if cell is None:
+            cell = shard[labels] = self._new_cell()
+        return cell
+
+    def _merged(self) -> Dict[tuple, list]:
+        merged: Dict[tuple, list] = {}
+        with self._shards_lock:
+            shards = list(self._shards)
+        for shard in shards:
+            for labels, cell in list(shard.items()):
+                total = merged.get(labels)
+                if total is None:
+                    merged[labels] = list(cell)
+                else:
+                    for i, v in enumerate(cell):
+                        total[i] += v
+        return merged
+
+    def _label_str(self, labels: tuple, extra: str = "") -> str:
+        parts = [f'{k}="{_escape(str(v))}"' for k, v in zip(self.labelnames, labels)]
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labels, cell in sorted(self._merged().items()):
+            lines.extend(self._render_cell(labels, cell))
+        return lines
+
+    def _render_cell(self, labels: tuple, cell: list) -> List[str]:
+        return [f"{self.name}{self._label_str(labels)} {_fmt(cell[0])}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_cell(self) -> list:
+        return [0]
+
+    def inc(self, *labels, amount: float = 1):
+        self._cell(labels)[0] += amount
+
+
+class Gauge(_Metric):
+    """Gauge built from inc/dec deltas, or read from a callback at render time"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 callback: Callable[[], float] = None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def _new_cell(self) -> list:
+        return [0]
+
+    def inc(self, *labels, amount: float = 1):
+        self._cell(labels)[0] += amount
+
+    def dec(self, *labels, amount: float = 1):
+        self._cell(labels)[0] -= amount
+
+    def render(self) -> List[str]:
+        if self.callback is None:
+            return super().render()
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}",
+                f"{self.name} {_fmt(self.callback())}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_cell(self) -> list:
+        # one slot per bucket, one for +Inf, then the running sum
+        return [0] * (len(self.buckets) + 2)
+
+    def observe(self, value: float, *labels):
+        cell = self._cell(labels)
+        cell[bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def _render_cell(self, labels: tuple, cell: list) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), cell[:-1]):
+            cumulative += count
+            le = 'le="+Inf"' if bound == float("inf") else 'le="%s"' % _fmt(bound)
+            lines.append(f"{self.name}_bucket{self._label_str(labels, le)} {cumulative}")
+        lines.append(f"{self.name}_sum{self._label_str(labels)} {_fmt(cell[-1])}")
+        lines.append(f"{self.name}_count{self._label_str(labels)} {cumulative}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt(value: float) -> str:
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+def render() -> str:
+    """Render every registered metric in the Prometheus text exposition format"""
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def _active_sessions() -> int:
+    from utils.utils import questions
+    return len(questions)
+
+
+def _feed_subscribers() -> int:
+    from utils.events import bus
+    return bus.subscriber_count()
+
+
+def _write_buffer_stat(stat: str) -> float:
+    from database import write_buffer
+    if not write_buffer.buffer:
+        return 0
+    return getattr(write_buffer.buffer, stat)()
+
+
+def _job_queue_lag() -> float:
+    from database import jobs
+    return jobs.queue.lag() if jobs.queue else 0
+
+
+def _rate_limit_keys() -> float:
+    from utils import rate_limit
+    return len(rate_limit.memory.full_at)
+
+
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests by route, method and status", ("route", "method", "status"))
+HTTP_CACHE_REQUESTS = Counter("http_cache_requests_total",
+                              "Cached getter requests by route and result (hit, not_modified, miss, bypass)", ("route", "result"))
+HTTP_LATENCY = Histogram("http_request_duration_seconds", "Time until the response headers are sent", ("route", "method"))
+EMBEDDING_SECONDS = Histogram("embedding_seconds", "Time to embed a chat turn")
+SIM_SEARCH_SECONDS = Histogram("sim_search_seconds", "Time to pick the next question by similarity")
+MONGO_SECONDS = Histogram("mongo_seconds", "Mongo round trip time by operation", ("op",))
+LLM_TTFT_SECONDS = Histogram("llm_time_to_first_token_seconds", "Time from generation start to the first chunk", ("model",))
+LLM_CONNECTIONS_OPENED = Counter("llm_connections_opened_total", "New connections opened to model providers", ("provider",))
+LLM_CONNECT_SECONDS = Histogram("llm_connect_seconds", "Time spent opening provider connections, by phase (tcp, tls)",
+                                ("provider", "phase"))
+LLM_GENERATION_SECONDS = Histogram("llm_generation_seconds", "Total generation time per answer", ("model",))
+STREAMS_CANCELLED = Counter("streams_cancelled_total", "Generations cancelled because the SSE client disconnected", ("model",))
+TOKENS_SAVED = Counter("llm_tokens_saved_total", "Estimated tokens not generated thanks to cancellation", ("model",))
+CONTEXT_SELECTION_COMPARED = Counter("context_selection_compared_total",
+                                     "Incremental vs full-string context selection, by whether they picked the same question", ("result",))
+TURNS_DEDUPLICATED = Counter("chat_turns_deduplicated_total",
+                             "Retried chat turns served from a running or finished generation", ("result",))
+ACTIVE_STREAMS = Gauge("active_streams", "SSE chat streams currently open")
+ACTIVE_SOCKETS = Gauge("active_chat_sockets", "WebSocket chat connections currently open")
+ACTIVE_SESSIONS = Gauge("active_sessions", "Screening sessions held in memory", callback=_active_sessions)
+CHAT_WRITE_QUEUE_DEPTH = Gauge("chat_write_queue_depth", "Chat writes buffered but not yet acknowledged by Mongo",
+                               callback=lambda: _write_buffer_stat("depth"))
+CHAT_WRITE_QUEUE_LAG = Gauge("chat_write_queue_lag_seconds", "Age of the oldest buffered chat write",
+                             callback=lambda: _write_buffer_stat("lag"))
+CHAT_WRITE_BATCH_SESSIONS = Histogram("chat_write_batch_sessions", "Sessions per write-behind bulk_write",
+                                      buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500))
+CHAT_WRITE_FAILURES = Counter("chat_write_failures_total", "Write-behind batches that failed and were requeued")
+CHAT_WRITES_DEAD_LETTERED = Counter("chat_writes_dead_lettered_total",
+                                    "Sessions whose buffered writes Mongo kept rejecting, moved to the dead-letter collection")
+JOBS_PROCESSED = Counter("jobs_processed_total", "Background jobs run, by type and outcome (done, retried, failed)",
+                         ("type", "result"))
+JOB_LAG_SECONDS = Histogram("job_lag_seconds", "Time from a job being due to a worker starting it", ("type",))
+JOB_SECONDS = Histogram("job_seconds", "Time to run a background job", ("type",))
+JOB_QUEUE_LAG = Gauge("job_queue_lag_seconds", "How long the oldest due job has been waiting", callback=_job_queue_lag)
+CHATS_ARCHIVED = Counter("chats_archived_total", "Chat conversations moved from the hot collection to the archive")
+SPECULATIVE_TURNS = Counter("speculative_turns_total",
+                            "Turns by whether a pre-generated draft matched the chosen question (hit, hit_pending, miss, none)",
+                            ("result",))
+SPECULATIVE_TOKENS = Counter("speculative_tokens_total", "Streamed chunks of pre-generated drafts, by outcome (used, wasted)",
+                             ("outcome",))
+SESSION_REHYDRATIONS = Counter("session_rehydrations_total",
+                               "Session states rebuilt from chats on a miss, by result (loaded, missing, coalesced, error)",
+                               ("result",))
+SESSION_REHYDRATION_SECONDS = Histogram("session_rehydration_seconds", "Time to rebuild a session's state from its chat")
+EXPORT_ROWS = Counter("export_rows_total", "Rows written to research export files, by table", ("table",))
+RATE_LIMIT_REQUESTS = Counter("rate_limit_requests_total", "Requests checked by the rate limiter, by route group and decision (allowed, limited)",
+                              ("group", "decision"))
+RATE_LIMIT_THROTTLED = Counter("rate_limit_throttled_total", "Requests refused, by route group and the scope (school, user, ip) whose bucket was empty",
+                               ("group", "scope"))
+RATE_LIMIT_BACKEND_ERRORS = Counter("rate_limit_backend_errors_total", "Shared rate limit checks that fell back to the worker's own buckets")
+RATE_LIMIT_KEYS = Gauge("rate_limit_keys", "Rate limit buckets held in this worker's memory", callback=_rate_limit_keys)
+FEED_EVENTS = Counter("psychologist_feed_events_total", "Session deltas published to the psychologist feed", ("type",))
+FEED_SUBSCRIBERS = Gauge("psychologist_feed_subscribers", "Psychologist dashboards connected to the live feed",
+                         callback=_feed_subscribers)
@@ -0,0 +1,93 @@
+"""Work done after a screening session ends, run by the job queue instead of the request handlers"""
+import asyncio
+import logging
+from collections import Counter
+from datetime import datetime, timezone
+
+import numpy as np
+from database import jobs, write_buffer
+from database.bundle import get_bundle
+from database.chatbot import get_chat, get_embeddings
+from database.sessions import ITEM_BANK_NAME, load_questionnaire
+
+logger = logging.getLogger(__name__)
+
+SCORE_SESSION = "score_session"
+EMBED_TRANSCRIPT = "embed_transcript"
+
+
+async def _question_count(db, questionnaire_name: str) -> int:
+    questionnaire = await load_questionnaire(db, questionnaire_name)
+    return len(questionnaire.get("questions", [])) if questionnaire else 0
+
+
+@jobs.register(SCORE_SESSION, concurrency=4)
+async def score_session(db, session_id: str):
+    """Coverage of the questionnaire from the question_index of each bot turn"""
+    # The summary is written straight to Mongo, so the session's buffered writes have to land first
+    if write_buffer.buffer and not await write_buffer.buffer.flush_session(session_id):
+        raise RuntimeError(f"Buffered writes of chat '{session_id}' could not be flushed")
+    chat = await get_chat(db, session_id)
+    if not chat:
+        raise ValueError(f"Chat '{session_id}' not found")
+    conversation = chat.get("conversation", [])
+    bot_turns = [turn for turn in conversation if turn.get("role") == "bot"]
+    user_turns = [turn for turn in conversation if turn.get("role") == "user" and turn.get("message") != "/start"]
+    # Negative indices are follow-ups to the question at -index - 1
+    indices = [turn["question_index"] for turn in bot_turns if turn.get("question_index") is not None]
+    asked = {i for i in indices if i >= 0}
+    total = await _question_count(db, chat.get("questionnaire_name"))
+
+    summary = {
+        "questions_asked": len(asked),
+        "questions_total": total,
+        "coverage": round(len(asked) / total, 4) if total else None,
+        "follow_ups": sum(1 for i in indices if i < 0),
+        "interrupted_turns": sum(1 for turn in bot_turns if turn.get("interrupted")),
+        "answers": len(user_turns),
+        "mean_answer_words": round(float(np.mean([len(t.get("message", "").split()) for t in user_turns])), 2) if user_turns else 0,
+        "scored_at": datetime.now(timezone.utc),
+    }
+    if chat.get("questionnaire_name") == ITEM_BANK_NAME and get_bundle():
+        bank = get_bundle().item_bank()
+        summary["questions_by_instrument"] = dict(Counter(bank[i]["instrument"] for i in asked if i < len(bank) and bank[i]))
+    await db["chats"].update_one({"session_id": session_id}, {"$set": {"screening_summary": summary}})
+    return {k: v for k, v in summary.items() if k != "scored_at"}
+
+
+@jobs.register(EMBED_TRANSCRIPT, concurrency=1)
+async def embed_transcript(db, session_id: str):
+    """One normalised vector per session (mean of its answers), labelled with school and diagnosis"""
+    chat = await get_chat(db, session_id)
+    if not chat:
+        raise ValueError(f"Chat '{session_id}' not found")
+    answers = [turn["message"] for turn in chat.get("conversation", [])
+               if turn.get("role") == "user" and turn.get("message") and turn["message"] != "/start"]
+    if not answers:
+        return {"answers": 0}
+    vector = np.mean(np.asarray(await get_embeddings(answers), dtype=np.float32), axis=0)
+    vector /= np.linalg.norm(vector) or 1.0
+    await db["transcript_embeddings"].update_one(
+        {"session_id": session_id},
+        {"$set": {
+            "school": chat.get("school"),
+            "diagnosis": chat.get("diagnosis"),
+            "answers": len(answers),
+            "vector": vector.tolist(),
+            "updated_at": datetime.now(timezone.utc),
+        }},
+        upsert=True,
+    )
+    return {"answers": len(answers)}
+
+
+async def enqueue_session_end(db, session_id: str):
+    await asyncio.gather(
+        jobs.enqueue(db, SCORE_SESSION, {"session_id": session_id}, key=f"{SCORE_SESSION}:{session_id}"),
+        jobs.enqueue(db, EMBED_TRANSCRIPT, {"session_id": session_id}, key=f"{EMBED_TRANSCRIPT}:{session_id}"),
+    )
+
+
+async def enqueue_diagnosis_set(db, session_id: str):
+    # The stored vector carries the diagnosis, so relabel it
+    await jobs.enqueue(db, EMBED_TRANSCRIPT, {"session_id": session_id}, key=f"{EMBED_TRANSCRIPT}:{session_id}")
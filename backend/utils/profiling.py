@@ -0,0 +1,181 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from typing import List, Optional
+
+from dotenv import load_dotenv
+from utils.users import is_admin_token
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_RING_SIZE = int(os.getenv("PROFILE_RING_SIZE", "50"))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+PROFILE_MAX_ACTIVE = int(os.getenv("PROFILE_MAX_ACTIVE", "4"))
+
+_NULL_SPAN = nullcontext()
+_active = 0
+
+
+class _Sampler(threading.Thread):
+    """Samples the stack of one thread (the event loop) at a fixed interval.
+
+    All requests share the loop thread, so samples also include work done for
+    other requests that were in flight at the same time.
+    """
+
+    def __init__(self, target_ident: int, interval: float):
+        super().__init__(daemon=True)
+        self.target_ident = target_ident
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.target_ident)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class Profile:
+    def __init__(self, name: str, reason: str):
+        self.id = f"{datetime.now().strftime('%Y%m%d%H%M%S%f')}_{uuid.uuid4().hex[:8]}"
+        self.name = name
+        self.reason = reason
+        self.started = time.perf_counter()
+        self.spans: List[dict] = []
+        self.finished = False
+        self.sampler = _Sampler(threading.get_ident(), PROFILE_INTERVAL)
+        self.sampler.start()
+
+    def record(self, name: str, start: float, end: float):
+        self.spans.append({
+            "name": name,
+            "start_ms": round((start - self.started) * 1000, 3),
+            "duration_ms": round((end - start) * 1000, 3),
+        })
+
+    @contextmanager
+    def span(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter())
+
+
+def start_profile(name: str, profile_header: Optional[str] = None) -> Optional[Profile]:
+    """Start profiling a request if it carries the admin token in X-Profile or is sampled.
+
+    The sampler runs until finish_profile, so call this from code whose
+    finally is guaranteed to run (a task), not before returning a streaming
+    response whose generator may never be iterated.
+    """
+    global _active
+    if profile_header is None and PROFILE_SAMPLE_RATE <= 0:
+        return None
+    if is_admin_token(profile_header):
+        reason = "header"
+    elif PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        reason = "sampled"
+    else:
+        return None
+    if _active >= PROFILE_MAX_ACTIVE:
+        return None
+    _active += 1
+    return Profile(name, reason)
+
+
+def span(profile: Optional[Profile], name: str):
+    """Time a stage of a profiled request; a no-op when the request is not profiled"""
+    if profile is None:
+        return _NULL_SPAN
+    return profile.span(name)
+
+
+def _write(record: dict):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    with open(os.path.join(PROFILE_DIR, f"{record['id']}.json"), "w") as f:
+        json.dump(record, f)
+    # Keep the directory a bounded ring: drop the oldest profiles
+    files = sorted(f for f in os.listdir(PROFILE_DIR) if f.endswith(".json"))
+    for old in files[:-PROFILE_RING_SIZE]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, old))
+        except OSError:
+            pass
+
+
+async def finish_profile(profile: Optional[Profile], **meta):
+    """Stop sampling and write the profile to the on-disk ring buffer; later calls do nothing"""
+    global _active
+    if profile is None or profile.finished:
+        return
+    profile.finished = True
+    _active -= 1
+    # Joining the sampler thread waits for its current sample; keep that off the event loop
+    await asyncio.to_thread(profile.sampler.stop)
+    record = {
+        "id": profile.id,
+        "name": profile.name,
+        "reason": profile.reason,
+        "total_ms": round((time.perf_counter() - profile.started) * 1000, 3),
+        "spans": profile.spans,
+        "samples": profile.sampler.samples,
+        "interval_ms": PROFILE_INTERVAL * 1000,
+        "stacks": dict(profile.sampler.stacks.most_common(200)),
+        "meta": meta,
+    }
+    try:
+        await asyncio.to_thread(_write, record)
+    except Exception as e:
+        logger.error(f"Error writing profile {profile.id}: {e}")
+
+
+def list_profiles() -> List[dict]:
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(PROFILE_DIR), reverse=True):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(PROFILE_DIR, name)) as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            continue
+        profiles.append({k: record.get(k) for k in ("id", "name", "reason", "total_ms", "meta")})
+    return profiles
+
+
+def load_profile(profile_id: str) -> Optional[dict]:
+    path = os.path.join(PROFILE_DIR, f"{os.path.basename(profile_id)}.json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
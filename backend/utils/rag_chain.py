@@ -6,12 +6,27 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+
+def format_conversation(conversation) -> str:
+    """Prompt lines for the stored turns: who spoke, the question asked and the message, no bookkeeping fields"""
+    if not conversation:
+        return "No previous conversation"
+    lines = []
+    for conv in conversation:
+        if not isinstance(conv, dict):
+            lines.append(f"- {conv}")
+            continue
+        question = f" (question: {conv['question']})" if conv.get("question") else ""
+        lines.append(f"- {conv.get('role', 'user')}{question}: {conv.get('message', '')}")
+    return "\n".join(lines)
+
+
 def get_chain(llm, chat_history: dict = None, age: int = 15, question: str = "") -> Runnable:
 
     conversation = chat_history.get('conversation', [])
     
     # Format chat history for display
-    conversation_text = "\n".join([f"- {conv}" for conv in conversation]) if conversation else "No previous conversation"
+    conversation_text = format_conversation(conversation)
     
     # Fixed template with proper variable names and better structure
     prompt = ChatPromptTemplate.from_template(
@@ -52,4 +67,50 @@ def get_chain(llm, chat_history: dict = None, age: int = 15, question: str = "")
         StrOutputParser()
     )
 
-    return chain
\ No newline at end of file
+    return chain
+
+
+def get_draft_chain(llm, chat_history: dict = None) -> Runnable:
+    """Rephrasing of a candidate next question, written before the user's answer is known"""
+    conversation = (chat_history or {}).get('conversation', [])
+    conversation_text = format_conversation(conversation)
+
+    prompt = ChatPromptTemplate.from_template(
+        "You are a compassionate and thoughtful mental health professional.\n"
+        "Your role is to gently guide the user through self-reflection and emotional awareness.\n\n"
+
+        "Here is the previous conversation:\n{conversation_text}\n\n"
+
+        "**Ask** the following question as a mental health professional would:\n\"{question}\"\n\n"
+        "Instructions:\n"
+        "- Rephrase the question in an empathetic and non-intrusive way but **DONT LOSE THE MEANING**.\n"
+        "- Reply with the question only; do not comment on earlier answers.\n"
+        "- Keep it short, simple and emathatic.\n\n"
+    )
+
+    def format_inputs(inputs):
+        return {"conversation_text": conversation_text, "question": inputs.get("question", "")}
+
+    return format_inputs | prompt | llm | StrOutputParser()
+
+
+def get_consolidation_chain(llm, chat_history: dict = None) -> Runnable:
+    """The sentence of consolidation that goes in front of a pre-generated question"""
+    conversation = (chat_history or {}).get('conversation', [])
+    conversation_text = format_conversation(conversation)
+
+    prompt = ChatPromptTemplate.from_template(
+        "You are a compassionate and thoughtful mental health professional.\n\n"
+
+        "Here is the previous conversation:\n{conversation_text}\n\n"
+
+        "The user's latest input was:\n{input}\n\n"
+        "Instructions:\n"
+        "- Write one short sentence of consolidation that acknowledges the user's input.\n"
+        "- Do not ask a question, give advice or answer for the user.\n\n"
+    )
+
+    def format_inputs(inputs):
+        return {"conversation_text": conversation_text, "input": inputs.get("input", "")}
+
+    return format_inputs | prompt | llm | StrOutputParser()
@@ -0,0 +1,287 @@
+import json
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+import jwt
+from dotenv import load_dotenv
+from pymongo import ReturnDocument
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from utils.metrics import MONGO_SECONDS, RATE_LIMIT_REQUESTS, RATE_LIMIT_THROTTLED, RATE_LIMIT_BACKEND_ERRORS
+from utils.users import JWT_ALGORITHM, JWT_SECRET_KEY
+from utils.utils import session_schools
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT = os.getenv("RATE_LIMIT", "1") == "1"
+# "memory" keeps the buckets in each worker; "mongo" shares them between workers
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+# Buckets kept in memory; the least recently used key is forgotten (refilled) first
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+# Take the client IP from the first X-Forwarded-For address, only behind a proxy that sets it
+RATE_LIMIT_TRUST_PROXY = os.getenv("RATE_LIMIT_TRUST_PROXY", "0") == "1"
+RATE_LIMIT_COLLECTION = "rate_limits"
+
+SCOPES = ("school", "user", "ip")
+_PERIODS = {"s": 1, "m": 60, "h": 3600}
+
+
+class Limit:
+    """Token bucket of `capacity` requests, refilled evenly over `period` seconds.
+
+    Kept as the time at which the bucket would be full again (GCRA), so a
+    check is one comparison and one store however many requests it has seen.
+    """
+
+    def __init__(self, scope: str, capacity: int, period: float):
+        if scope not in SCOPES:
+            raise ValueError(f"Unknown rate limit scope '{scope}', expected one of {SCOPES}")
+        self.scope = scope
+        self.capacity = capacity
+        self.period = period
+        self.interval = period / capacity
+        # How far ahead of now the refill time may run before the bucket is empty
+        self.burst = period - self.interval
+
+    def __repr__(self):
+        return f"{self.scope}:{self.capacity}/{self.period:g}"
+
+
+def parse_limits(spec: str) -> List[Limit]:
+    """ "school:600/m,ip:60/m" -> limits; the period is s, m, h or a number of seconds"""
+    limits = []
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        scope, rate = part.split(":", 1)
+        capacity, period = rate.split("/", 1)
+        seconds = _PERIODS.get(period.strip()) or float(period)
+        limits.append(Limit(scope.strip(), int(capacity), seconds))
+    return limits
+
+
+class RouteGroup:
+    """Limits shared by the routes under some path prefixes, overridable with RATE_LIMIT_<NAME>"""
+
+    def __init__(self, name: str, prefixes: Tuple[str, ...], default: str):
+        self.name = name
+        self.prefixes = prefixes
+        self.limits = parse_limits(os.getenv(f"RATE_LIMIT_{name.upper()}", default))
+
+
+# First matching group wins, so specific prefixes go before the ones that contain them
+GROUPS = [
+    # Each call sends an SMS or checks an OTP with Twilio
+    RouteGroup("otp", ("/api/auth/send-otp", "/api/auth/verify-otp", "/api/auth/signup"), "ip:5/m"),
+    RouteGroup("auth", ("/api/auth/",), "ip:30/m"),
+    # Every turn is an LLM generation; a school's classrooms share one allowance. A whole school
+    # may sit behind one NAT address, so the IP limit is only a backstop above the school's
+    RouteGroup("chat", ("/api/chat/", "/api/questionnaire/"), "school:1200/m,user:120/m,ip:2400/m"),
+    RouteGroup("api", ("/api/",), "user:600/m,ip:1200/m"),
+]
+EXEMPT = ("/api/metrics",)
+
+
+def group_for(path: str) -> Optional[RouteGroup]:
+    if path.startswith(EXEMPT):
+        return None
+    for group in GROUPS:
+        if path.startswith(group.prefixes):
+            return group
+    return None
+
+
+class MemoryBuckets:
+    """Refill times by key in this worker, least recently used first"""
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self.full_at: "OrderedDict[str, float]" = OrderedDict()
+
+    async def acquire(self, key: str, limit: Limit, now: float) -> Optional[float]:
+        """Take a token: None when there was one, else seconds until there is"""
+        full_at = max(self.full_at.get(key, now), now)
+        if full_at - now > limit.burst:
+            return full_at - limit.burst - now
+        self.full_at[key] = full_at + limit.interval
+        self.full_at.move_to_end(key)
+        if len(self.full_at) > self.max_keys:
+            self.full_at.popitem(last=False)
+        return None
+
+    async def release(self, key: str, limit: Limit):
+        """Give back a token taken for a request that another limit refused"""
+        if key in self.full_at:
+            self.full_at[key] -= limit.interval
+
+
+class MongoBuckets:
+    """Refill times in a collection, so every worker draws from the same buckets.
+
+    A check is one find_one_and_update whose pipeline applies the same GCRA
+    step as MemoryBuckets on the server, so concurrent workers cannot both
+    take the last token. Documents expire once their bucket would be full.
+    """
+
+    def __init__(self, db):
+        self.collection = db[RATE_LIMIT_COLLECTION]
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def acquire(self, key: str, limit: Limit, now: float) -> Optional[float]:
+        full_at = {"$max": [{"$ifNull": ["$full_at", now]}, now]}
+        allowed = {"$lte": [full_at, now + limit.burst]}
+        with MONGO_SECONDS.time("rate_limit"):
+            doc = await self.collection.find_one_and_update(
+                {"_id": key},
+                [{"$set": {
+                    "allowed": allowed,
+                    "full_at": {"$cond": [allowed, {"$add": [full_at, limit.interval]}, "$full_at"]},
+                    # Never before the bucket is full again, which is at most a period away
+                    "expires_at": datetime.fromtimestamp(now + limit.period, timezone.utc),
+                }}],
+                projection={"full_at": 1, "allowed": 1},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        if doc["allowed"]:
+            return None
+        return max(doc["full_at"] - limit.burst - now, limit.interval / 2)
+
+    async def release(self, key: str, limit: Limit):
+        with MONGO_SECONDS.time("rate_limit"):
+            await self.collection.update_one({"_id": key}, {"$inc": {"full_at": -limit.interval}})
+
+
+memory = MemoryBuckets()
+shared: Optional[MongoBuckets] = None
+
+
+async def start_rate_limiter(db):
+    """Share the buckets through db when RATE_LIMIT_BACKEND is mongo"""
+    global shared
+    if not RATE_LIMIT or RATE_LIMIT_BACKEND != "mongo":
+        return None
+    shared = MongoBuckets(db)
+    try:
+        await shared.ensure_indexes()
+    except Exception as e:
+        logger.error(f"Error creating rate limit indexes: {e}")
+    return shared
+
+
+async def _acquire(key: str, limit: Limit, now: float) -> Optional[float]:
+    if shared:
+        try:
+            return await shared.acquire(key, limit, now)
+        except Exception as e:
+            # Limits degrade to per-worker instead of refusing or letting everything through
+            RATE_LIMIT_BACKEND_ERRORS.inc()
+            logger.warning(f"Rate limit backend failed, using this worker's buckets: {e}")
+    return await memory.acquire(key, limit, now)
+
+
+async def _release(key: str, limit: Limit):
+    try:
+        await (shared or memory).release(key, limit)
+    except Exception as e:
+        RATE_LIMIT_BACKEND_ERRORS.inc()
+        logger.warning(f"Could not return a rate limit token for {key}: {e}")
+
+
+async def check(group: RouteGroup, ip: Optional[str], user: Optional[str], school: Optional[str]) -> Optional[Tuple[str, float]]:
+    """Take a token from each of the group's buckets that applies.
+
+    Returns None when the request may go ahead, else the refusing scope and
+    seconds to wait. Tokens already taken are given back on a refusal.
+    """
+    identities = {"ip": ip, "user": user, "school": school}
+    now = time.time()
+    taken = []
+    for limit in group.limits:
+        identity = identities[limit.scope]
+        if not identity:
+            continue
+        key = f"{group.name}:{limit.scope}:{identity}"
+        retry_after = await _acquire(key, limit, now)
+        if retry_after is not None:
+            for taken_key, taken_limit in taken:
+                await _release(taken_key, taken_limit)
+            RATE_LIMIT_REQUESTS.inc(group.name, "limited")
+            RATE_LIMIT_THROTTLED.inc(group.name, limit.scope)
+            return limit.scope, retry_after
+        taken.append((key, limit))
+    RATE_LIMIT_REQUESTS.inc(group.name, "allowed")
+    return None
+
+
+def client_ip(request) -> Optional[str]:
+    if RATE_LIMIT_TRUST_PROXY:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else None
+
+
+def _token_claims(request: Request) -> dict:
+    """Claims of a valid bearer token; authentication itself is left to the endpoints"""
+    authorization = request.headers.get("authorization")
+    if not authorization or not authorization.startswith("Bearer ") or not JWT_SECRET_KEY:
+        return {}
+    try:
+        return jwt.decode(authorization.split(" ", 1)[1], JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
+    except Exception:
+        return {}
+
+
+# The only chat route whose session has no school recorded yet; it names it in the body
+SESSION_START = "/api/questionnaire/start"
+
+
+async def _session_school(request: Request) -> Optional[str]:
+    """School of the screening session a chat request belongs to.
+
+    Chat clients are unauthenticated kiosks, so the school is the one recorded
+    for the session when it started; a school named in the body is only taken
+    on the start request itself.
+    """
+    if request.method != "POST" or "application/json" not in request.headers.get("content-type", ""):
+        return None
+    try:
+        body = json.loads(await request.body() or b"{}")
+    except ValueError:
+        return None
+    if not isinstance(body, dict):
+        return None
+    school = session_schools.get(body.get("session_id"))
+    if school is None and request.url.path == SESSION_START:
+        school = body.get("school")
+    return school
+
+
+def too_many_requests(scope: str, retry_after: float) -> JSONResponse:
+    seconds = max(1, math.ceil(retry_after))
+    return JSONResponse({"detail": f"Too many requests for this {scope}, retry in {seconds} s"}, status_code=429,
+                        headers={"Retry-After": str(seconds)})
+
+
+async def middleware(request: Request, call_next):
+    """Refuse requests with 429 once their school's, user's or IP's bucket for the route group is empty"""
+    group = group_for(request.url.path) if RATE_LIMIT else None
+    if group is None or request.method == "OPTIONS":
+        return await call_next(request)
+    scopes = {limit.scope for limit in group.limits}
+    claims = _token_claims(request) if scopes & {"user", "school"} else {}
+    school = claims.get("school")
+    if not school and "school" in scopes:
+        school = await _session_school(request)
+    refused = await check(group, client_ip(request), claims.get("user_id"), school)
+    if refused:
+        return too_many_requests(*refused)
+    return await call_next(request)
@@ -0,0 +1,156 @@
+"""Incremental parsers for class rosters uploaded as CSV, JSON arrays or JSON lines"""
+import codecs
+import csv
+import json
+from typing import AsyncIterator, Iterable
+
+# Spreadsheet headers people actually use, mapped onto the child fields
+HEADER_ALIASES = {
+    "student_name": "name",
+    "child_name": "name",
+    "date_of_birth": "dob",
+    "student_dob": "dob",
+    "sex": "gender",
+    "student_gender": "gender",
+    "school_name": "school",
+    "guardian_name": "parent_name",
+    "parent_phone": "parent_mobile",
+    "guardian_mobile": "parent_mobile",
+}
+
+
+class RosterError(ValueError):
+    pass
+
+
+def _error_line(line: int, error: UnicodeDecodeError) -> int:
+    return line + error.object.count(b"\n", 0, error.start)
+
+
+async def _text(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Text of an upload in UTF-8, or in Windows-1252 as Excel saves CSV by default.
+
+    Windows-1252 is only assumed when the first byte that is not UTF-8 follows
+    plain ASCII; any other undecodable byte is a RosterError naming its line.
+    """
+    decoder = None
+    encoding = "utf-8"
+    ascii_only = True
+    line = 1
+
+    def decode(data: bytes, final: bool = False) -> str:
+        nonlocal decoder, encoding
+        pending = decoder.getstate()[0]
+        try:
+            return decoder.decode(data, final)
+        except UnicodeDecodeError as e:
+            if encoding != "utf-8" or not (ascii_only and e.object[:e.start].isascii()):
+                raise RosterError(f"Line {_error_line(line, e)} is not valid {encoding} text")
+        encoding = "cp1252"
+        decoder = codecs.getincrementaldecoder(encoding)()
+        try:
+            return decoder.decode(pending + data, final)
+        except UnicodeDecodeError as e:
+            raise RosterError(f"Line {_error_line(line, e)} is neither UTF-8 nor Windows-1252 text")
+
+    async for chunk in chunks:
+        if decoder is None:
+            # Excel writes a byte order mark in front of UTF-8 CSV
+            if chunk.startswith(b"\xef\xbb\xbf"):
+                chunk = chunk[3:]
+            decoder = codecs.getincrementaldecoder(encoding)()
+        text = decode(chunk)
+        ascii_only = ascii_only and text.isascii()
+        line += text.count("\n")
+        yield text
+    if decoder:
+        yield decode(b"", final=True)
+
+
+async def _lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    buffer = ""
+    async for text in _text(chunks):
+        buffer += text
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line
+    if buffer:
+        yield buffer
+
+
+def _normalise_header(header: Iterable[str]) -> list:
+    columns = []
+    for column in header:
+        key = column.strip().lower().replace(" ", "_").replace("-", "_")
+        columns.append(HEADER_ALIASES.get(key, key))
+    return columns
+
+
+async def parse_csv(chunks: AsyncIterator[bytes]) -> AsyncIterator[dict]:
+    """Rows as dicts keyed by the header line; quoted fields may span lines"""
+    header = None
+    record = ""
+    async for line in _lines(chunks):
+        record = f"{record}\n{line}" if record else line
+        # An odd number of quotes means a quoted field continues on the next line
+        if record.count('"') % 2:
+            continue
+        text, record = record.rstrip("\r"), ""
+        if not text.strip():
+            continue
+        values = next(csv.reader([text]))
+        if header is None:
+            header = _normalise_header(values)
+            if "name" not in header:
+                raise RosterError(f"CSV header has no name column: {values}")
+            continue
+        yield {column: value.strip() for column, value in zip(header, values) if column and value.strip()}
+    if record:
+        raise RosterError("CSV ends inside a quoted field")
+
+
+async def parse_json(chunks: AsyncIterator[bytes]) -> AsyncIterator[dict]:
+    """Objects of a top-level JSON array, decoded as they arrive, or one object per line"""
+    decoder = json.JSONDecoder()
+    buffer = ""
+    # "array" until its closing bracket is seen, then "closed"; "lines" for JSON lines
+    mode = None
+    async for text in _text(chunks):
+        buffer += text
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos == len(buffer):
+                break
+            if mode is None:
+                mode = "array" if buffer[pos] == "[" else "lines"
+                pos += mode == "array"
+                continue
+            if mode == "closed":
+                raise RosterError("Unexpected data after the end of the JSON array")
+            if mode == "array" and buffer[pos] == "]":
+                mode = "closed"
+                pos += 1
+                continue
+            try:
+                row, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                break  # Incomplete object, wait for the next chunk
+            if not isinstance(row, dict):
+                raise RosterError(f"Roster entries must be objects, got {type(row).__name__}")
+            yield {HEADER_ALIASES.get(k, k): v for k, v in row.items()}
+        buffer = buffer[pos:]
+    if buffer.strip():
+        raise RosterError(f"Invalid JSON near: {buffer.strip()[:80]}")
+    if mode == "array":
+        raise RosterError("JSON array is not closed")
+
+
+def parser_for(content_type: str):
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    if content_type in ("text/csv", "application/csv", "application/vnd.ms-excel"):
+        return parse_csv
+    if content_type in ("application/json", "application/x-ndjson", "application/jsonl", "application/x-jsonlines"):
+        return parse_json
+    raise RosterError(f"Unsupported roster content type '{content_type}', send text/csv or application/json")
@@ -0,0 +1,199 @@
+"""Speculative pre-generation of the next question while the user is still answering.
+
+After each bot turn the likeliest next questions (top sim_search candidates,
+the elaboration prompt, or question 0 at the start) are rephrased in the
+background. When the user's answer selects one of them, the turn streams a
+short consolidation sentence generated live followed by the draft, instead of
+generating the whole answer after the user submits.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from utils.metrics import SPECULATIVE_TOKENS, SPECULATIVE_TURNS
+from utils.rag_chain import get_consolidation_chain, get_draft_chain
+from utils.utils import speculative_drafts
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+SPECULATIVE_DRAFTS = os.getenv("SPECULATIVE_DRAFTS", "0") == "1"
+# Candidate questions drafted after each bot turn
+SPECULATIVE_TOP_K = int(os.getenv("SPECULATIVE_TOP_K", "2"))
+# Streamed chunks (about one token each) a session may spend on drafts over its lifetime
+SPECULATIVE_SESSION_BUDGET = int(os.getenv("SPECULATIVE_SESSION_BUDGET", "1500"))
+# Drafts generating at once across all sessions, so speculation cannot crowd out live turns
+SPECULATIVE_CONCURRENCY = int(os.getenv("SPECULATIVE_CONCURRENCY", "4"))
+# Drafts of sessions without a turn for this long are dropped
+SPECULATIVE_TTL = float(os.getenv("SPECULATIVE_TTL", "900"))
+# The first turn is drafted when the session starts, before the client says which model it uses
+SPECULATIVE_FIRST_MODEL = os.getenv("SPECULATIVE_FIRST_MODEL", "Gemini")
+
+_slots = asyncio.Semaphore(SPECULATIVE_CONCURRENCY)
+
+
+class Draft:
+    """Rephrasing of one candidate question, generated ahead of the turn that may ask it"""
+
+    def __init__(self, index: int, question: str):
+        self.index = index
+        self.question = question
+        self.chunks: List[str] = []
+        self.started = False
+        self.done = False
+        self.failed = False
+        self.task: Optional[asyncio.Task] = None
+        self._updated = asyncio.Event()
+
+    def append(self, chunk: str):
+        self.chunks.append(chunk)
+        self._updated.set()
+
+    def finish(self, failed: bool = False):
+        self.done = True
+        self.failed = failed
+        self._updated.set()
+
+    async def follow(self) -> AsyncIterator[str]:
+        offset = 0
+        while True:
+            while offset < len(self.chunks):
+                yield self.chunks[offset]
+                offset += 1
+            if self.done:
+                if self.failed:
+                    raise RuntimeError(f"Draft of question {self.index} failed part way")
+                return
+            self._updated.clear()
+            if offset == len(self.chunks) and not self.done:
+                await self._updated.wait()
+
+
+class SessionDrafts:
+    def __init__(self):
+        self.model: Optional[str] = None
+        self.drafts: Dict[int, Draft] = {}
+        self.spent = 0
+        self.updated_at = time.monotonic()
+
+
+def _discard(draft: Draft):
+    if draft.task and not draft.task.done():
+        draft.task.cancel()
+    SPECULATIVE_TOKENS.inc("wasted", amount=len(draft.chunks))
+
+
+def discard(session_id: str):
+    """Drop a session's drafts, e.g. when it ends"""
+    session = speculative_drafts.pop(session_id, None)
+    if session:
+        for draft in session.drafts.values():
+            _discard(draft)
+
+
+def _prune():
+    cutoff = time.monotonic() - SPECULATIVE_TTL
+    for session_id in [sid for sid, s in speculative_drafts.items() if s.updated_at < cutoff]:
+        discard(session_id)
+
+
+async def _generate(session: SessionDrafts, draft: Draft, llm, chat_history: dict):
+    try:
+        async with _slots:
+            draft.started = True
+            async for chunk in get_draft_chain(llm, chat_history).astream({"question": draft.question}):
+                if not chunk:
+                    continue
+                draft.append(chunk)
+                # Counted only; the budget is checked before drafts start, as a taken draft must finish
+                session.spent += 1
+    except asyncio.CancelledError:
+        draft.finish(failed=True)
+        raise
+    except Exception as e:
+        logger.info(f"Dropped draft of question {draft.index}: {e}")
+        draft.finish(failed=True)
+    else:
+        draft.finish()
+
+
+def start(session_id: str, llm, model: str, chat_history: dict, candidates: List[Tuple[int, str]]):
+    """Draft the candidate questions for the session's next turn in the background, within its budget"""
+    if not SPECULATIVE_DRAFTS:
+        return
+    _prune()
+    session = speculative_drafts.setdefault(session_id, SessionDrafts())
+    for draft in session.drafts.values():
+        _discard(draft)
+    session.drafts = {}
+    session.model = model
+    session.updated_at = time.monotonic()
+    # The conversation keeps growing in the request handlers; drafts see it as of now
+    snapshot = {"conversation": list(chat_history.get("conversation", []))}
+    for index, question in candidates[:SPECULATIVE_TOP_K]:
+        if session.spent >= SPECULATIVE_SESSION_BUDGET:
+            break
+        draft = Draft(index, question)
+        draft.task = asyncio.create_task(_generate(session, draft, llm, snapshot))
+        session.drafts[index] = draft
+
+
+def take(session_id: str, model: str, index: Optional[int]) -> Optional[Draft]:
+    """The draft for the question this turn asks, if one was started; the session's other drafts are dropped"""
+    if not SPECULATIVE_DRAFTS:
+        return None
+    session = speculative_drafts.get(session_id)
+    if not session or not session.drafts:
+        SPECULATIVE_TURNS.inc("none")
+        return None
+    drafts, session.drafts = session.drafts, {}
+    session.updated_at = time.monotonic()
+    draft = drafts.pop(index, None) if session.model == model and index is not None else None
+    for other in drafts.values():
+        _discard(other)
+    # A draft still waiting for a slot would not finish sooner than generating the answer now
+    if draft is None or draft.failed or not draft.started:
+        if draft:
+            _discard(draft)
+        SPECULATIVE_TURNS.inc("miss")
+        return None
+    SPECULATIVE_TURNS.inc("hit" if draft.done else "hit_pending")
+    return draft
+
+
+async def serve(draft: Draft, llm, chat_history: dict, user_input: str, fallback) -> AsyncIterator[str]:
+    """The turn's answer from a draft: a consolidation sentence generated now, then the drafted question.
+
+    The first question answers "/start" and gets no consolidation, so it streams
+    straight from the draft. If the draft fails, the turn still ends with its
+    question: from fallback() (the live answer stream) when nothing was sent yet,
+    else in the questionnaire's own words.
+    """
+    sent = False
+    try:
+        if user_input.strip().lower() != "/start":
+            async for chunk in get_consolidation_chain(llm, chat_history).astream({"input": user_input}):
+                sent = True
+                yield chunk
+            yield " "
+        async for chunk in draft.follow():
+            sent = True
+            yield chunk
+    except asyncio.CancelledError:
+        _discard(draft)
+        raise
+    except Exception as e:
+        logger.warning(f"Draft of question {draft.index} failed while being served, falling back: {e}")
+        _discard(draft)
+        if not sent:
+            async for chunk in fallback():
+                yield chunk
+        else:
+            # A second generation would repeat what the user has already read
+            yield f"\n{draft.question}"
+        return
+    SPECULATIVE_TOKENS.inc("used", amount=len(draft.chunks))
@@ -1,3 +1,4 @@
+import hmac
 import os
 import random
 import bcrypt
@@ -14,6 +15,7 @@ load_dotenv()
 JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY")
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRATION_HOURS = 24
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
 
 def hash_password(password: str) -> str:
     """Hash a password using bcrypt"""
@@ -45,7 +47,18 @@ def verify_token(token: str) -> dict:
         raise HTTPException(status_code=401, detail="Token has expired")
     except jwt.JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
-        
+
+def is_admin_token(token: Optional[str]) -> bool:
+    """Constant-time check against ADMIN_TOKEN, so response timing does not reveal how much of a guess matched"""
+    if not ADMIN_TOKEN or token is None:
+        return False
+    return hmac.compare_digest(token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8"))
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Dependency for operator-only endpoints, checked against ADMIN_TOKEN"""
+    if not is_admin_token(x_admin_token):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
 async def send_otp(mobile):
     account_sid = os.getenv("TWILIO_ACCOUNT_SID")
     auth_token = os.getenv("TWILIO_AUTH_TOKEN")
@@ -1,3 +1,4 @@
+from collections import OrderedDict
 from typing import Optional, List, Dict, Any
 from langchain_huggingface import HuggingFaceEndpoint, ChatHuggingFace
 from langchain_google_genai import ChatGoogleGenerativeAI
@@ -7,36 +8,56 @@ from dotenv import load_dotenv
 load_dotenv()
 
 # Model registry
-MODELS = {
-    "Mistral": ChatHuggingFace( llm = HuggingFaceEndpoint(
-        repo_id="mistralai/Mistral-7B-Instruct-v0.3",
-        task='conversational',
-        max_new_tokens=128,
-        temperature=0.7,
-        huggingfacehub_api_token=os.getenv("HF_TOKEN"),
+if os.getenv("FAKE_MODELS"):
+    # Deterministic local models for benchmarks and offline runs
+    from utils.fake_llm import FakeStreamingChatModel
+    MODELS = {
+        name: FakeStreamingChatModel(
+            model_name=name,
+            ttft=float(os.getenv("FAKE_MODEL_TTFT", "0.2")),
+            token_delay=float(os.getenv("FAKE_MODEL_TOKEN_DELAY", "0.02")),
         )
-    ),
-    "Zephyr": ChatHuggingFace( llm = HuggingFaceEndpoint(
-        repo_id="meta-llama/Llama-3.1-8B-Instruct",
-        task='text-generation',
-        max_new_tokens=128,
-        temperature=0.7,
-        huggingfacehub_api_token=os.getenv("HF_TOKEN"),
+        for name in ["Mistral", "Zephyr", "Llama", "Gemini"]
+    }
+else:
+    # Model clients share keep-alive pools per provider instead of default httpx/aiohttp sessions
+    from utils import llm_transport
+    llm_transport.use_pooled_transports()
+    HF_TIMEOUT = int(llm_transport.providers["huggingface"].read_timeout)
+    MODELS = {
+        "Mistral": ChatHuggingFace( llm = HuggingFaceEndpoint(
+            repo_id="mistralai/Mistral-7B-Instruct-v0.3",
+            task='conversational',
+            max_new_tokens=128,
+            temperature=0.7,
+            huggingfacehub_api_token=os.getenv("HF_TOKEN"),
+            timeout=HF_TIMEOUT,
+            )
+        ),
+        "Zephyr": ChatHuggingFace( llm = HuggingFaceEndpoint(
+            repo_id="meta-llama/Llama-3.1-8B-Instruct",
+            task='text-generation',
+            max_new_tokens=128,
+            temperature=0.7,
+            huggingfacehub_api_token=os.getenv("HF_TOKEN"),
+            timeout=HF_TIMEOUT,
+            )
+        ),
+        "Llama": ChatHuggingFace( llm = HuggingFaceEndpoint(
+            repo_id="meta-llama/Llama-3.1-8B-Instruct",
+            task="text-generation",
+            max_new_tokens=128,
+            temperature=0.7,
+            huggingfacehub_api_token=os.getenv("HF_TOKEN"),
+            timeout=HF_TIMEOUT,
+            )
+        ),
+        "Gemini": ChatGoogleGenerativeAI(
+            model="gemini-2.0-flash-001",
+            google_api_key=os.getenv("GOOGLE_API_KEY")
         )
-    ),
-    "Llama": ChatHuggingFace( llm = HuggingFaceEndpoint(
-        repo_id="meta-llama/Llama-3.1-8B-Instruct",
-        task="text-generation",
-        max_new_tokens=128,
-        temperature=0.7,
-        huggingfacehub_api_token=os.getenv("HF_TOKEN")
-        )
-    ),
-    "Gemini": ChatGoogleGenerativeAI(
-        model="gemini-2.0-flash-001",
-        google_api_key=os.getenv("GOOGLE_API_KEY")
-    )
-}
+    }
+    MODELS["Gemini"].client = llm_transport.pooled_gemini_client(os.getenv("GOOGLE_API_KEY"))
 
 # Global database connection
 db = None
@@ -45,5 +66,17 @@ questions_asked: Dict[str, set] = {}
 questions: Dict[str, Any] = {}
 last_question_index: Dict[str, int] = {}
 status : Dict[str, bool] = {}
+# Instrument filter of sessions drawing from the item bank (None = all instruments)
+item_bank_sessions: Dict[str, Optional[List[str]]] = {}
+# Cached message vectors per session for incremental context embedding, least recently used first
+context_state: "OrderedDict[str, Any]" = OrderedDict()
+# Resident history and latest answer of sessions served over WebSocket
+socket_sessions: Dict[str, Any] = {}
+# Keyed chat turns ("session_id:key"), running or finished, for retries to attach to
+turn_results: Dict[str, Any] = {}
+# Next-question drafts generated ahead of the user's answer, per session
+speculative_drafts: Dict[str, Any] = {}
+# School of each screening session, for the per-school rate limits of chat requests
+session_schools: Dict[str, str] = {}
 
 otp_store: Dict[str, int] = {}
@@ -77,19 +77,31 @@ const QuestionnaireBot = () => {
     setInput("");
     setLoading(true);
 
-    // Mock streaming response for demo
+    // Retries of this turn reuse the key, so the backend answers it only once
+    const turnKey = window.crypto?.randomUUID ? window.crypto.randomUUID() : `${Date.now()}-${Math.random()}`;
+    const openStream = async (attempt = 0) => {
+      try {
+        return await fetch(`${BACKEND_URL}/api/chat/stream`, {
+          method: "POST",
+          headers: {
+            "Content-Type": "application/json",
+            "Idempotency-Key": turnKey,
+          },
+          body: JSON.stringify({
+            session_id: sessionId,
+            question: userQuestion,
+            model: activeModel
+          })
+        });
+      } catch (error) {
+        if (attempt >= 2) throw error;
+        await new Promise(resolve => setTimeout(resolve, 1000 * (attempt + 1)));
+        return openStream(attempt + 1);
+      }
+    };
+
     try {
-      const response = await fetch(`${BACKEND_URL}/api/chat/stream`, {
-        method: "POST",
-        headers: {
-          "Content-Type": "application/json",
-        },
-        body: JSON.stringify({
-          session_id: sessionId,
-          question: userQuestion,
-          model: activeModel
-        })
-      });
+      const response = await openStream();
 
       if (!response.ok) {
         throw new Error(`HTTP error! status: ${response.status}`);
@@ -152,6 +152,35 @@ function ResponseTable() {
     fetchResponses()
   }, [])
 
+  // Apply live session updates pushed by the backend instead of polling
+  useEffect(() => {
+    const events = new EventSource(`${BACKEND_URL}/api/psychologist/events`)
+    events.onmessage = (message) => {
+      const event = JSON.parse(message.data)
+      if (event.type === "resync") {
+        fetchResponses()
+        return
+      }
+      if (event.school) {
+        setSchools((prev) => (prev.includes(event.school) ? prev : [...prev, event.school]))
+      }
+      setResponses((prev) => {
+        const update =
+          event.type === "session_started"
+            ? event.session
+            : event.type === "diagnosis_set"
+            ? { diagnosis: event.diagnosis }
+            : { feedback: event.feedback }
+        const exists = prev.some((resp) => resp.session_id === event.session_id)
+        if (!exists) {
+          return event.type === "session_started" ? [...prev, update] : prev
+        }
+        return prev.map((resp) => (resp.session_id === event.session_id ? { ...resp, ...update } : resp))
+      })
+    }
+    return () => events.close()
+  }, [])
+
   // Initialize diagnoses state when responses change
   useEffect(() => {
     const initialDiagnoses = {}
@@ -3,7 +3,7 @@ import { useSelector, useDispatch } from "react-redux"
 import { setChildren, addChild, removeChild } from "../redux/childrenSlice"
 import { setSessionId, setSelected } from "../redux/questionnaireSlice"
 import { useNavigate } from "react-router-dom"
-import { ChevronDown, ChevronRight, Trash2, Play, X, AlertTriangle, CheckCircle, XCircle, AlertCircle, User, GraduationCap, Calendar, School } from "lucide-react"
+import { ChevronDown, ChevronRight, Trash2, Play, X, AlertTriangle, CheckCircle, XCircle, AlertCircle, User, GraduationCap, Calendar, School, Upload } from "lucide-react"
 import axios from "axios"
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
@@ -173,6 +173,47 @@ function TeacherDashboard() {
     }
   }
 
+  // Enroll a whole class from a CSV or JSON roster; the backend reports each row
+  const handleImportRoster = async (event) => {
+    const file = event.target.files[0]
+    event.target.value = ""
+    if (!file) return
+
+    setLoading(true)
+    try {
+      const params = new URLSearchParams({ teacher_name: name, teacher_mobile: userMobile })
+      const response = await fetch(`${BACKEND_URL}/api/teacher/import-children?${params}`, {
+        method: 'POST',
+        headers: {
+          'Content-Type': file.name.toLowerCase().endsWith('.csv') ? 'text/csv' : 'application/json',
+          'Authorization': `Bearer ${token}`
+        },
+        body: file
+      })
+
+      const data = await response.json()
+      if (!response.ok) {
+        throw new Error(data.detail || 'Failed to import roster')
+      }
+
+      const counts = data.counts
+      const skipped = data.rows - (counts.inserted || 0)
+      const problems = data.report.filter(entry => entry.status === 'invalid' || entry.status === 'failed')
+      problems.forEach(entry => console.warn(`Roster row ${entry.row}:`, entry.errors))
+      await fetchChildren()
+      if (data.error || problems.length) {
+        showToast('warning', `Added ${counts.inserted || 0} of ${data.rows} students; ${problems.length} rows need fixing${data.error ? ` (${data.error})` : ''}`)
+      } else {
+        showToast('success', `Added ${counts.inserted || 0} students${skipped ? `, ${skipped} already enrolled` : ''}`)
+      }
+    } catch (err) {
+      console.error('Error importing roster:', err)
+      showToast('error', err.message || 'Failed to import roster')
+    } finally {
+      setLoading(false)
+    }
+  }
+
   // Handle deleting a child
   const handleDeleteChild = async (childId) => {
     setLoading(true)
@@ -483,7 +524,7 @@ function TeacherDashboard() {
           </div>
 
           {/* Action Buttons */}
-          <div className="flex justify-center">
+          <div className="flex justify-center gap-4">
             <button
               className="px-8 py-3 bg-gradient-to-r from-green-500 to-blue-600 hover:from-green-600 hover:to-blue-700 text-white font-semibold rounded-xl transition-all duration-200 transform hover:scale-105 shadow-lg disabled:opacity-50 disabled:cursor-not-allowed flex items-center gap-2"
               onClick={() => setIsFormVisible(true)}
@@ -492,6 +533,14 @@ function TeacherDashboard() {
               <User size={16} />
               {loading ? 'Loading...' : 'Add Student'}
             </button>
+            <label
+              className={`px-8 py-3 bg-white/10 hover:bg-white/20 border border-white/20 text-white font-semibold rounded-xl transition-all duration-200 shadow-lg flex items-center gap-2 ${loading ? 'opacity-50 cursor-not-allowed' : 'cursor-pointer'}`}
+              title="CSV or JSON with name, dob (YYYY-MM-DD), gender, school, parent_name and parent_mobile"
+            >
+              <Upload size={16} />
+              Import Roster
+              <input type="file" accept=".csv,.json,.jsonl" className="hidden" onChange={handleImportRoster} disabled={loading} />
+            </label>
           </div>
         </div>
       </div>